@@ -1,20 +1,22 @@
 #!/usr/bin/python3
-import re
-from fastapi import APIRouter, Body
-from fastapi.responses import JSONResponse
+from typing import List
+
+from fastapi import APIRouter, Body, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from loguru import logger
 
 
-from infra_ai_service.service.embedding_service import create_embedding
-from infra_ai_service.service.utils import convert_to_str
-from infra_ai_service.service.extract_spec import (
-    process_src_rpm_from_url,
-    extract_spec_features,
-    check_xml_info,
+from infra_ai_service.service.concurrency import cancel_on_disconnect
+from infra_ai_service.service.concurrency import run_blocking
+from infra_ai_service.service.extract_spec import check_xml_info
+from infra_ai_service.service.feature_pipeline import (
+    check_xml_version,
+    error_message,
+    ingest_batch,
+    ingest_src_rpm,
 )
-
-import infra_ai_service.service.extract_spec as es
+from infra_ai_service.service.job_queue import get_job, submit_job
+from infra_ai_service.service import xml_registry
 
 router = APIRouter()
 
@@ -23,6 +25,34 @@ class FeatureInsertRequest(BaseModel):
     src_rpm_url: str
     os_version: str
     package_name: str = ""
+    # sha256 of the src.rpm, e.g. from the repo metadata; a known package
+    # is then not even downloaded again
+    sha256: str = ""
+
+
+class FeatureInsertBatchItem(BaseModel):
+    src_rpm_url: str
+    package_name: str = ""
+    sha256: str = ""
+
+
+class FeatureInsertBatchRequest(BaseModel):
+    os_version: str
+    packages: List[FeatureInsertBatchItem]
+
+
+class FeatureInsertResult(BaseModel):
+    index: int
+    src_rpm_url: str
+    status: str
+    insert_content: str = ""
+    message: str = ""
+
+
+class FeatureInsertRepoRequest(BaseModel):
+    # base url of the repo, the dir holding repodata/
+    repo_url: str
+    os_version: str
 
 
 class FeatureInsertXml(BaseModel):
@@ -31,44 +61,114 @@ class FeatureInsertXml(BaseModel):
     force_refresh: bool = False
 
 
+class FeatureRefreshXml(BaseModel):
+    os_version: str
+    # the url it was configured with when empty
+    xml_url: str = ""
+
+
 @router.post("/")
-async def feature_insert(request: FeatureInsertRequest = Body(...)):
+async def feature_insert(
+    http_request: Request, request: FeatureInsertRequest = Body(...)
+):
     try:
-        if not es.XML_INFO:
-            raise Exception("need config xml with API '/feature-insert/xml/'")
+        flags = {}
+        ordered_feature = await cancel_on_disconnect(
+            http_request,
+            ingest_src_rpm(
+                request.src_rpm_url,
+                request.os_version,
+                request.package_name,
+                request.sha256,
+                flags=flags,
+            ),
+        )
 
-        xml_version = es.XML_INFO.get("os_version", "%v!@#")  # foolproof
-        if xml_version != request.os_version:
-            raise Exception(
-                "xml os version conflict, please config xml again,"
-                f"{xml_version}:{request.os_version}"
+        # partial source counts, the scan ran out of its budget
+        resp_data = {
+            "status": "success",
+            "insert_content": f"{ordered_feature}",
+            "scan_truncated": flags.get("scan_truncated", False),
+        }
+        return JSONResponse(content=resp_data)
+    except Exception as e:
+        resp_data = {"status": "error", "message": str(e)}
+        return JSONResponse(content=resp_data)
+
+
+@router.post("/batch")
+async def feature_insert_batch(request: FeatureInsertBatchRequest = Body(...)):
+    """one ndjson line per package, in the order the packages finish"""
+    try:
+        check_xml_version(request.os_version)
+    except Exception as e:
+        resp_data = {"status": "error", "message": str(e)}
+        return JSONResponse(content=resp_data)
+
+    async def results():
+        async for index, feature, error in ingest_batch(
+            request.packages, request.os_version
+        ):
+            result = FeatureInsertResult(
+                index=index,
+                src_rpm_url=request.packages[index].src_rpm_url,
+                status="error" if error else "success",
+                insert_content=f"{feature}" if feature else "",
+                message=error_message(error) if error else "",
             )
+            yield result.json() + "\n"
 
-        # download and decompress .src.rpm file
-        rpm_decompress_dir = await process_src_rpm_from_url(
-            request.src_rpm_url
-        )
-        logger.info(
-            f"process src rpm finished rpm_decompress_dir:{rpm_decompress_dir}"
-        )
-        feature = extract_spec_features(
-            rpm_decompress_dir,
-        )
-        logger.info(f"extrac spec features finished feature:{feature}")
-        name = feature[1]["name"]
-        if name != request.package_name:
-            logger.debug(f"name difference {name}: {request.package_name}")
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
-        name = request.package_name if request.package_name else name
 
-        ordered_feature = convert_to_str(feature[1])
-        feature_str = re.sub(r"[{}[\]()@#.\':\/-]", "", str(ordered_feature))
-        logger.info(f"feature_str build finished:{feature_str}")
-        create_embedding(feature_str, request.os_version, name)
+@router.post("/jobs")
+async def feature_insert_job(request: FeatureInsertRequest = Body(...)):
+    """queue the ingestion, poll /feature-insert/jobs/{job_id}"""
+    try:
+        check_xml_version(request.os_version)
+        job_id = await run_blocking(submit_job, "src_rpm", request.dict())
+        resp_data = {"status": "success", "job_id": job_id}
+        return JSONResponse(content=resp_data)
+    except Exception as e:
+        resp_data = {"status": "error", "message": str(e)}
+        return JSONResponse(content=resp_data)
+
 
+@router.post("/repo")
+async def feature_insert_repo(request: FeatureInsertRepoRequest = Body(...)):
+    """queue the ingestion of every changed source package of the repo"""
+    try:
+        check_xml_version(request.os_version)
+        job_id = await run_blocking(submit_job, "repo", request.dict())
+        resp_data = {"status": "success", "job_id": job_id}
+        return JSONResponse(content=resp_data)
+    except Exception as e:
+        resp_data = {"status": "error", "message": str(e)}
+        return JSONResponse(content=resp_data)
+
+
+@router.get("/jobs/{job_id}")
+async def feature_insert_job_status(job_id: int):
+    try:
+        job = await run_blocking(get_job, job_id)
+        if job is None:
+            raise Exception(f"job {job_id} not found")
+        resp_data = {"status": "success", "job": job}
+        return JSONResponse(content=resp_data)
+    except Exception as e:
+        resp_data = {"status": "error", "message": str(e)}
+        return JSONResponse(content=resp_data)
+
+
+@router.get("/xml/")
+async def list_xml():
+    """the configured os_version and the memory their xml takes"""
+    try:
+        entries = await run_blocking(xml_registry.list_entries)
         resp_data = {
             "status": "success",
-            "insert_content": f"{ordered_feature}",
+            "xml": entries,
+            "memory_bytes": xml_registry.total_memory_bytes(),
         }
         return JSONResponse(content=resp_data)
     except Exception as e:
@@ -79,15 +179,17 @@ async def feature_insert(request: FeatureInsertRequest = Body(...)):
 @router.post("/xml/")
 async def config_xml(request: FeatureInsertXml = Body(...)):
     try:
-        if not request.force_refresh and es.XML_INFO is not None:
-            latest_version = es.XML_INFO.get("os_version", None)
-            if latest_version == request.os_version:
-                raise Exception(
-                    f"already config os_version[{latest_version}],"
-                    "need to config with 'force_refresh'=True"
-                )
-
-        es.XML_INFO = await check_xml_info(request.xml_url, request.os_version)
+        if (
+            not request.force_refresh
+            and xml_registry.get_entry(request.os_version) is not None
+        ):
+            raise Exception(
+                f"already config os_version[{request.os_version}],"
+                "need to config with 'force_refresh'=True"
+            )
+
+        xml_info = await check_xml_info(request.xml_url, request.os_version)
+        await run_blocking(xml_registry.register, xml_info, request.xml_url)
         resp_data = {
             "status": "success",
         }
@@ -95,3 +197,41 @@ async def config_xml(request: FeatureInsertXml = Body(...)):
     except Exception as e:
         resp_data = {"status": "error", "message": str(e)}
         return JSONResponse(content=resp_data)
+
+
+@router.post("/xml/refresh")
+async def refresh_xml(request: FeatureRefreshXml = Body(...)):
+    """read the xml of a configured os_version again, the others are kept"""
+    try:
+        entry = xml_registry.get_entry(request.os_version)
+        if entry is None:
+            raise Exception(f"os_version[{request.os_version}] not configured")
+        xml_url = request.xml_url or entry.xml_url
+        if not xml_url:
+            raise Exception(
+                f"no xml url known for os_version[{request.os_version}]"
+            )
+
+        xml_info = await check_xml_info(xml_url, request.os_version)
+        entry = await run_blocking(xml_registry.register, xml_info, xml_url)
+        resp_data = {
+            "status": "success",
+            "xml": await run_blocking(xml_registry.describe, entry),
+        }
+        return JSONResponse(content=resp_data)
+    except Exception as e:
+        resp_data = {"status": "error", "message": str(e)}
+        return JSONResponse(content=resp_data)
+
+
+@router.delete("/xml/{os_version}")
+async def evict_xml(os_version: str):
+    """forget the xml of os_version, with its snapshot"""
+    try:
+        if not await run_blocking(xml_registry.evict, os_version):
+            raise Exception(f"os_version[{os_version}] not configured")
+        resp_data = {"status": "success"}
+        return JSONResponse(content=resp_data)
+    except Exception as e:
+        resp_data = {"status": "error", "message": str(e)}
+        return JSONResponse(content=resp_data)
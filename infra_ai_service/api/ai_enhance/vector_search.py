@@ -1,11 +1,76 @@
+from typing import Optional
+
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 
-from infra_ai_service.model.model import SearchInput, SearchOutput
-from infra_ai_service.service.search_service import perform_vector_search
+from infra_ai_service.model.model import (
+    BatchSearchInput,
+    BatchSearchOutput,
+    SearchInput,
+    SearchOutput,
+)
+from infra_ai_service.service.search_service import (
+    decode_cursor,
+    iter_batch_vector_search,
+    iter_vector_search,
+    perform_batch_vector_search,
+    perform_similar_search_by_id,
+    perform_similar_search_by_name,
+    perform_vector_search,
+    prepare_vector,
+    prepare_vectors,
+)
+from infra_ai_service.service.utils import to_ndjson
 
 router = APIRouter()
 
 
 @router.post("", response_model=SearchOutput)
 async def vector_search(input_data: SearchInput):
-    return await perform_vector_search(input_data)
+    if not input_data.stream:
+        return await perform_vector_search(input_data)
+
+    if input_data.cursor:
+        decode_cursor(input_data.cursor)
+    vector = await prepare_vector(input_data)
+    return StreamingResponse(
+        to_ndjson(iter_vector_search(input_data, vector)),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/batch", response_model=BatchSearchOutput)
+async def batch_vector_search(input_data: BatchSearchInput):
+    if not input_data.stream:
+        return await perform_batch_vector_search(input_data)
+
+    vectors = await prepare_vectors(input_data.queries)
+    return StreamingResponse(
+        to_ndjson(iter_batch_vector_search(input_data, vectors)),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.get("/similar", response_model=SearchOutput)
+async def similar_search(
+    name: str,
+    os_version: str,
+    target_os_version: Optional[str] = None,
+    top_n: int = 5,
+    score_threshold: float = 0.7,
+):
+    return await perform_similar_search_by_name(
+        name, os_version, target_os_version, top_n, score_threshold
+    )
+
+
+@router.get("/similar/{doc_id}", response_model=SearchOutput)
+async def similar_search_by_id(
+    doc_id: int,
+    target_os_version: Optional[str] = None,
+    top_n: int = 5,
+    score_threshold: float = 0.7,
+):
+    return await perform_similar_search_by_id(
+        doc_id, target_os_version, top_n, score_threshold
+    )
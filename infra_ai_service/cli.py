@@ -0,0 +1,354 @@
+#!/usr/bin/python3
+"""
+Offline feature extraction for backfills, without the server:
+
+    infra-ai-extract --xml primary.xml.zst -o features.jsonl rpms/
+
+Every src.rpm is unpacked and scanned on a pool of worker processes,
+merged with the package of the given primary.xml and written as one JSON
+line, in the order of the input. With --embed the features are also
+embedded and inserted, --batch-size at a time.
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.sdk import pgvector
+from infra_ai_service.service.embedding_service import create_embeddings
+from infra_ai_service.service.extract_spec import (
+    decompress_src_rpm,
+    decompress_tar_file,
+    extract_src_features,
+)
+from infra_ai_service.service.extract_xml import (
+    XmlIndex,
+    decompressed,
+    extract_xml_index,
+)
+from infra_ai_service.service.feature_pipeline import (
+    error_message,
+    feature_text,
+)
+from infra_ai_service.service.sandbox import init_worker, run_limited
+from infra_ai_service.service.utils import (
+    convert_to_str,
+    update_json_indexed,
+)
+from infra_ai_service.service.workspace import workspace_root
+
+
+def extract_src_rpm(rpm_path: str):
+    """features of a local src.rpm before the xml merge, runs on a worker"""
+    root = workspace_root()
+    os.makedirs(root, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="feature-", dir=root) as work_dir:
+        rpm_dir = decompress_src_rpm(rpm_path, work_dir)
+        if settings.SRC_SCAN_MODE != "archive":
+            decompress_tar_file(rpm_dir)
+        return extract_src_features(rpm_dir)
+
+
+def load_xml_info(xml_path: str):
+    with open(xml_path, "rb") as raw, decompressed(raw, xml_path) as f:
+        return extract_xml_index(f)
+
+
+def src_rpm_paths(inputs):
+    """the src.rpm files given, directories are listed in name order"""
+    for path in inputs:
+        if os.path.isdir(path):
+            for file in sorted(os.listdir(path)):
+                if file.endswith(".src.rpm"):
+                    yield os.path.join(path, file)
+        else:
+            yield path
+
+
+# in a worker, where its jobs tell that they started
+_STARTED = None
+
+
+def _init_extract_worker(memory_mb: int, shared_by: int, started):
+    global _STARTED
+    _STARTED = started
+    init_worker(memory_mb, shared_by)
+
+
+def _extract_job(index: int, rpm_path: str):
+    """runs on a worker; one small write to a pipe, no lock to die holding"""
+    if _STARTED is not None:
+        _STARTED.send(index)
+    return extract_src_rpm(rpm_path)
+
+
+def _broken(future):
+    return isinstance(future.exception(), BrokenProcessPool)
+
+
+class _Extractor:
+    """
+    the worker pool of extract_ordered; the jobs tell when they start, so
+    when a worker dies the jobs that were running are told apart from the
+    ones still queued
+    """
+
+    def __init__(self, jobs: int):
+        self.jobs = jobs
+        self.reader, self.writer = multiprocessing.Pipe(duplex=False)
+        self.started = set()
+        # pools of the jobs run alone, shut down once all is done
+        self.alone = []
+        self.pool = self._new_pool(jobs, self.writer)
+
+    def _new_pool(self, workers: int, started):
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_extract_worker,
+            initargs=(settings.SANDBOX_MEMORY_MB, self.jobs, started),
+        )
+
+    def submit(self, index: int, rpm_path: str, pool=None):
+        return (pool or self.pool).submit(
+            run_limited,
+            _extract_job,
+            (index, rpm_path),
+            settings.SPEC_STAGE_TIMEOUT,
+            settings.SANDBOX_CPU_SECONDS,
+        )
+
+    def _poll_started(self):
+        while self.reader.poll():
+            self.started.add(self.reader.recv())
+
+    def finished(self, index: int):
+        self._poll_started()
+        self.started.discard(index)
+
+    def _rerun_alone(self, index: int, rpm_path: str):
+        """the future of rpm_path run on a worker of its own"""
+        pool = self._new_pool(1, None)
+        self.alone.append(pool)
+        result = Future()
+
+        def settle(future):
+            pool.shutdown(wait=False)
+            if _broken(future):
+                result.set_exception(
+                    Exception("worker died, memory or cpu limit exceeded")
+                )
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(future.result())
+
+        self.submit(index, rpm_path, pool).add_done_callback(settle)
+        return result
+
+    def _rerun(self, index: int, rpm_path: str, future):
+        if not _broken(future):
+            return future
+        if index in self.started:
+            return self._rerun_alone(index, rpm_path)
+        return self.submit(index, rpm_path)
+
+    def restart(self, window):
+        """
+        new workers after one died; any running job may have killed it,
+        those run again each on a worker of its own, at the same time, so
+        only the one to blame fails; the queued ones go to the new workers
+        """
+        wait([future for _, _, future in window])
+        self.pool.shutdown(wait=False)
+        self.pool = self._new_pool(self.jobs, self.writer)
+        self._poll_started()
+        return collections.deque(
+            (index, rpm_path, self._rerun(index, rpm_path, future))
+            for index, rpm_path, future in window
+        )
+
+    def close(self):
+        for pool in [self.pool, *self.alone]:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.reader.close()
+        self.writer.close()
+
+
+def _fill(window, extractor, rpm_paths):
+    while len(window) < extractor.jobs * 4:
+        index, rpm_path = next(rpm_paths, (None, None))
+        if rpm_path is None:
+            return
+        window.append((index, rpm_path, extractor.submit(index, rpm_path)))
+
+
+def _outcome(rpm_path: str, future):
+    try:
+        return rpm_path, future.result(), None
+    except Exception as e:
+        return rpm_path, None, e
+
+
+def extract_ordered(rpm_paths, jobs: int):
+    """
+    Yields (rpm_path, data, error) in input order, at most a few jobs per
+    worker are queued ahead. When a worker is killed by the memory or cpu
+    limit, the jobs that were running are run again each alone before any
+    of them is failed, new workers take over the queued ones.
+    """
+    rpm_paths = enumerate(rpm_paths)
+    extractor = _Extractor(jobs)
+    window = collections.deque()
+    try:
+        while True:
+            _fill(window, extractor, rpm_paths)
+            if not window:
+                return
+
+            index, rpm_path, future = window[0]
+            wait([future])
+            if _broken(future):
+                logger.warning("extract worker died, rerun its jobs alone")
+                window = extractor.restart(window)
+                continue
+
+            window.popleft()
+            extractor.finished(index)
+            yield _outcome(rpm_path, future)
+    finally:
+        extractor.close()
+
+
+def merge_features(data: dict, xml_info: XmlIndex):
+    if not data:
+        raise Exception("no spec file in src.rpm")
+    return update_json_indexed(xml_info, data)[1]
+
+
+class _Embedder:
+    """embeds and inserts the features batch_size at a time"""
+
+    def __init__(self, os_version: str, batch_size: int):
+        self.os_version = os_version
+        self.batch_size = max(batch_size, 1)
+        self.contents, self.names = [], []
+        self.inserted = self.failed = 0
+
+    def add(self, ordered_feature: str, name: str):
+        self.contents.append(feature_text(ordered_feature))
+        self.names.append(name)
+        if len(self.contents) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.contents:
+            return
+        try:
+            self.inserted += create_embeddings(
+                self.contents, self.os_version, self.names
+            )
+        except Exception as e:
+            logger.error(f"embed {len(self.contents)} features fail: {e}")
+            self.failed += len(self.contents)
+        self.contents, self.names = [], []
+
+    def close(self):
+        """flush what is left, returns the number of failed features"""
+        self.flush()
+        pgvector.close_pool()
+        logger.info(
+            f"embedded {self.inserted}, embedding failed {self.failed}"
+        )
+        return self.failed
+
+
+def _merge_result(data, error, xml_info: XmlIndex, embedder):
+    """the result fields of one src.rpm, raises its error"""
+    if error is not None:
+        raise error
+    feature = merge_features(data, xml_info)
+    ordered_feature = convert_to_str(feature)
+    if embedder is not None:
+        embedder.add(ordered_feature, feature["name"])
+    return {"status": "success", "insert_content": ordered_feature}
+
+
+def run(args, out):
+    """returns the number of failed src.rpm files"""
+    xml_info = load_xml_info(args.xml) if args.xml else XmlIndex({})
+    logger.info(f"{len(xml_info)} packages in {args.xml}")
+
+    embedder = None
+    if args.embed:
+        pgvector.setup_model_and_pool()
+        embedder = _Embedder(args.os_version, args.batch_size)
+
+    count = failed = 0
+    jobs = args.jobs or os.cpu_count() or 1
+    paths = src_rpm_paths(args.inputs)
+    for rpm_path, data, error in extract_ordered(paths, jobs):
+        result = {"index": count, "src_rpm_url": rpm_path}
+        try:
+            result.update(_merge_result(data, error, xml_info, embedder))
+        except Exception as e:
+            logger.error(f"extract {rpm_path} fail: {e}")
+            failed += 1
+            result.update(status="error", message=error_message(e))
+        out.write(json.dumps(result) + "\n")
+        count += 1
+
+    if embedder is not None:
+        failed += embedder.close()
+    logger.info(f"extracted {count} src.rpm, {failed} failed")
+    return failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="infra-ai-extract",
+        description="extract src.rpm features to JSON lines",
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="src.rpm files or directories of them"
+    )
+    parser.add_argument(
+        "--xml", help="primary.xml of the repo, may be .gz or .zst"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="JSON lines file, - for stdout"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=0, help="worker processes"
+    )
+    parser.add_argument(
+        "--embed", action="store_true", help="embed and insert the features"
+    )
+    parser.add_argument("--os-version", help="os_version of the features")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args(argv)
+    if args.embed and not args.os_version:
+        parser.error("--embed needs --os-version")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output == "-":
+        failed = run(args, sys.stdout)
+    else:
+        with open(args.output, "w", encoding="utf-8") as out:
+            failed = run(args, out)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,6 +44,69 @@ class Settings(BaseSettings):
     OPENAI_BASE_URL: str = ""
 
     SRC_RPM_DIR: str = "/tmp/infra_ai_service/"
+    # per-request workspaces, SRC_RPM_DIR is used when empty
+    WORKSPACE_DIR: str = ""
+    WORKSPACE_QUOTA_MB: int = 0
+    INGEST_CONCURRENCY: int = 4
+    # threads running the blocking ingestion stages of all requests
+    INGEST_STAGE_WORKERS: int = 8
+    # packages in one pipeline stage at the same time, over all requests
+    INGEST_DOWNLOAD_CONCURRENCY: int = 4
+    INGEST_EXTRACT_CONCURRENCY: int = 2
+    INGEST_EMBED_CONCURRENCY: int = 4
+    # extraction worker processes, 0 runs the stages in the server process
+    SANDBOX_WORKERS: int = 2
+    SANDBOX_MAX_JOBS: int = 100
+    # limits of one worker, 0 means unlimited
+    SANDBOX_MEMORY_MB: int = 0
+    SANDBOX_CPU_SECONDS: int = 0
+    # seconds, 0 means no timeout
+    RPM_STAGE_TIMEOUT: float = 120
+    TAR_STAGE_TIMEOUT: float = 300
+    SPEC_STAGE_TIMEOUT: float = 300
+    RPMSPEC_TIMEOUT: float = 60
+    # extracted features by src.rpm sha256, disabled when the dir is empty
+    FEATURE_CACHE_DIR: str = ""
+    FEATURE_CACHE_MB: int = 512
+    # downloaded src.rpm and xml files, disabled when the dir is empty
+    DOWNLOAD_CACHE_DIR: str = ""
+    DOWNLOAD_CACHE_MB: int = 4096
+    DOWNLOAD_TIMEOUT: float = 300
+    # parallel byte ranges for files bigger than one chunk
+    DOWNLOAD_RANGE_WORKERS: int = 4
+    DOWNLOAD_RANGE_CHUNK_MB: int = 8
+    DOWNLOAD_RETRIES: int = 3
+    # comma separated dirs, file:// urls and paths below them are read in
+    # place; empty refuses local sources
+    LOCAL_SOURCE_ROOTS: str = ""
+    # ingestion jobs, JOB_WORKERS per server process, 0 only queues them
+    JOB_TABLE_NAME: str = "ingest_jobs"
+    JOB_WORKERS: int = 2
+    JOB_MAX_ATTEMPTS: int = 3
+    # seconds
+    JOB_RETRY_BACKOFF: float = 30
+    JOB_LEASE_SECONDS: float = 300
+    JOB_POLL_INTERVAL: float = 2
+    # parsed xml per os_version, disabled when the dir is empty
+    XML_SNAPSHOT_DIR: str = ""
+    # state of the packages of ingested repos, packages per ingest round
+    REPO_STATE_TABLE_NAME: str = "repo_packages"
+    REPO_INGEST_BATCH: int = 64
+    # "dir": unpack the upstream archive, "archive": scan it in memory
+    SRC_SCAN_MODE: str = "dir"
+    # 0 means one scan worker per cpu / no per-file limit
+    SRC_SCAN_WORKERS: int = 0
+    SRC_SCAN_FILE_MAX_BYTES: int = 0
+    # comma separated globs, relative to the top of the sources
+    SRC_SCAN_INCLUDE: str = ""
+    SRC_SCAN_EXCLUDE: str = ""
+    # files above the size are skipped, budgets stop the scan early
+    SRC_SCAN_MAX_FILE_SIZE: int = 0
+    SRC_SCAN_BYTE_BUDGET: int = 0
+    SRC_SCAN_TIME_BUDGET: float = 0
+    # "rg": the names of the former rg pipelines, "fixed": corrected class
+    # and url patterns, the feature text of a package changes
+    SRC_SCAN_PATTERNS: str = "rg"
 
     @property
     def BASE_URL(self) -> str:
@@ -79,6 +142,52 @@ class Settings(BaseSettings):
             "OPENAI_API_KEY": {"env": "OPENAI_API_KEY"},
             "OPENAI_BASE_URL": {"env": "OPENAI_BASE_URL"},
             "SRC_RPM_DIR": {"env": "SRC_RPM_DIR"},
+            "WORKSPACE_DIR": {"env": "WORKSPACE_DIR"},
+            "WORKSPACE_QUOTA_MB": {"env": "WORKSPACE_QUOTA_MB"},
+            "INGEST_CONCURRENCY": {"env": "INGEST_CONCURRENCY"},
+            "INGEST_STAGE_WORKERS": {"env": "INGEST_STAGE_WORKERS"},
+            "INGEST_DOWNLOAD_CONCURRENCY": {
+                "env": "INGEST_DOWNLOAD_CONCURRENCY"
+            },
+            "INGEST_EXTRACT_CONCURRENCY": {
+                "env": "INGEST_EXTRACT_CONCURRENCY"
+            },
+            "INGEST_EMBED_CONCURRENCY": {"env": "INGEST_EMBED_CONCURRENCY"},
+            "SANDBOX_WORKERS": {"env": "SANDBOX_WORKERS"},
+            "SANDBOX_MAX_JOBS": {"env": "SANDBOX_MAX_JOBS"},
+            "SANDBOX_MEMORY_MB": {"env": "SANDBOX_MEMORY_MB"},
+            "SANDBOX_CPU_SECONDS": {"env": "SANDBOX_CPU_SECONDS"},
+            "RPM_STAGE_TIMEOUT": {"env": "RPM_STAGE_TIMEOUT"},
+            "TAR_STAGE_TIMEOUT": {"env": "TAR_STAGE_TIMEOUT"},
+            "SPEC_STAGE_TIMEOUT": {"env": "SPEC_STAGE_TIMEOUT"},
+            "RPMSPEC_TIMEOUT": {"env": "RPMSPEC_TIMEOUT"},
+            "FEATURE_CACHE_DIR": {"env": "FEATURE_CACHE_DIR"},
+            "FEATURE_CACHE_MB": {"env": "FEATURE_CACHE_MB"},
+            "DOWNLOAD_CACHE_DIR": {"env": "DOWNLOAD_CACHE_DIR"},
+            "DOWNLOAD_CACHE_MB": {"env": "DOWNLOAD_CACHE_MB"},
+            "DOWNLOAD_TIMEOUT": {"env": "DOWNLOAD_TIMEOUT"},
+            "DOWNLOAD_RANGE_WORKERS": {"env": "DOWNLOAD_RANGE_WORKERS"},
+            "DOWNLOAD_RANGE_CHUNK_MB": {"env": "DOWNLOAD_RANGE_CHUNK_MB"},
+            "DOWNLOAD_RETRIES": {"env": "DOWNLOAD_RETRIES"},
+            "LOCAL_SOURCE_ROOTS": {"env": "LOCAL_SOURCE_ROOTS"},
+            "JOB_TABLE_NAME": {"env": "JOB_TABLE_NAME"},
+            "JOB_WORKERS": {"env": "JOB_WORKERS"},
+            "JOB_MAX_ATTEMPTS": {"env": "JOB_MAX_ATTEMPTS"},
+            "JOB_RETRY_BACKOFF": {"env": "JOB_RETRY_BACKOFF"},
+            "JOB_LEASE_SECONDS": {"env": "JOB_LEASE_SECONDS"},
+            "JOB_POLL_INTERVAL": {"env": "JOB_POLL_INTERVAL"},
+            "XML_SNAPSHOT_DIR": {"env": "XML_SNAPSHOT_DIR"},
+            "REPO_STATE_TABLE_NAME": {"env": "REPO_STATE_TABLE_NAME"},
+            "REPO_INGEST_BATCH": {"env": "REPO_INGEST_BATCH"},
+            "SRC_SCAN_MODE": {"env": "SRC_SCAN_MODE"},
+            "SRC_SCAN_WORKERS": {"env": "SRC_SCAN_WORKERS"},
+            "SRC_SCAN_FILE_MAX_BYTES": {"env": "SRC_SCAN_FILE_MAX_BYTES"},
+            "SRC_SCAN_INCLUDE": {"env": "SRC_SCAN_INCLUDE"},
+            "SRC_SCAN_EXCLUDE": {"env": "SRC_SCAN_EXCLUDE"},
+            "SRC_SCAN_MAX_FILE_SIZE": {"env": "SRC_SCAN_MAX_FILE_SIZE"},
+            "SRC_SCAN_BYTE_BUDGET": {"env": "SRC_SCAN_BYTE_BUDGET"},
+            "SRC_SCAN_TIME_BUDGET": {"env": "SRC_SCAN_TIME_BUDGET"},
+            "SRC_SCAN_PATTERNS": {"env": "SRC_SCAN_PATTERNS"},
         }
 
 
@@ -3,6 +3,12 @@ from fastapi.responses import UJSONResponse
 
 from infra_ai_service.api.router import api_router
 from infra_ai_service.sdk.pgvector import setup_model_and_pool
+from infra_ai_service.service.job_queue import (
+    start_job_workers,
+    stop_job_workers,
+)
+from infra_ai_service.service.sandbox import start_sandbox, stop_sandbox
+from infra_ai_service.service.xml_registry import load_snapshots
 
 
 def get_app() -> FastAPI:
@@ -28,5 +34,13 @@ def get_app() -> FastAPI:
     @app.on_event("startup")
     async def startup_event():
         setup_model_and_pool()
+        load_snapshots()
+        start_sandbox()
+        start_job_workers()
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        await stop_job_workers()
+        stop_sandbox()
 
     return app
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -6,8 +6,10 @@ from pydantic import BaseModel
 class SearchInput(BaseModel):
     query_text: str
     os_version: str
-    top_n: int = 5
+    top_n: int = 5  # 分页时为每页条数
     score_threshold: float = 0.7
+    cursor: Optional[str] = None  # 上一页返回的 next_cursor
+    stream: bool = False  # 以 NDJSON 逐条返回
 
 
 class SearchResult(BaseModel):
@@ -19,6 +21,25 @@ class SearchResult(BaseModel):
 
 class SearchOutput(BaseModel):
     results: List[SearchResult]
+    next_cursor: Optional[str] = None
+
+
+class BatchSearchInput(BaseModel):
+    queries: List[str]
+    os_version: str
+    top_n: int = 5
+    score_threshold: float = 0.7
+    stream: bool = False  # 以 NDJSON 逐条返回
+
+
+class BatchSearchItem(BaseModel):
+    index: int
+    query_text: str
+    results: List[SearchResult]
+
+
+class BatchSearchOutput(BaseModel):
+    results: List[BatchSearchItem]
 
 
 class TextInput(BaseModel):
@@ -38,6 +38,38 @@ def embedding(content):
         raise Exception(f"Error fetching embeddings: {response.status_code}")
 
 
+def embedding_batch(contents):
+    """embed several texts with one proxy call, keeps the input order"""
+    url = f"{settings.PROXY_URL}/embeddings"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {settings.PROXY_TOKEN}",
+    }
+    body = {
+        "prompt": list(contents),
+        "model": "bge-large-en-v1.5",
+        "encoding_format": "float",
+    }
+    logger.info(f"embedding batch url: {url} size: {len(body['prompt'])}")
+    response = requests.post(url, headers=headers, json=body)
+    if response.status_code != 200:
+        logger.error(
+            f"Failed to get embeddings, status code: {response.status_code}"
+        )
+        raise Exception(f"Error fetching embeddings: {response.status_code}")
+
+    try:
+        embeddings = response.json().get("embeddings")
+    except ValueError as e:
+        logger.error(f"Failed to parse the response: {e}")
+        raise
+
+    if embeddings is None or len(embeddings) != len(body["prompt"]):
+        logger.error("Embeddings missing or mismatched in the response.")
+        raise ValueError("Embeddings missing or mismatched in the response.")
+    return embeddings
+
+
 def chat(model, message, *args):
     url = f"{settings.PROXY_URL}/chat/completions"
     headers = {
@@ -57,6 +57,56 @@ def setup_database(pool):
             USING GIN (to_tsvector('{settings.LANGUAGE}', content))
             """
         )
+        # lookup of a stored vector by package for /search/similar
+        conn.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {settings.TABLE_NAME}_os_version_name_idx
+            ON {settings.TABLE_NAME} (os_version, name)
+            """
+        )
+        # ingestion jobs, see service/job_queue
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {settings.JOB_TABLE_NAME} (
+                id bigserial PRIMARY KEY,
+                kind text NOT NULL,
+                payload jsonb NOT NULL,
+                status text NOT NULL DEFAULT 'queued',
+                stage text,
+                attempts int NOT NULL DEFAULT 0,
+                max_attempts int NOT NULL DEFAULT 1,
+                error text,
+                result text,
+                run_after timestamptz NOT NULL DEFAULT now(),
+                lease_until timestamptz,
+                created_at timestamptz NOT NULL DEFAULT now(),
+                updated_at timestamptz NOT NULL DEFAULT now()
+            )
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {settings.JOB_TABLE_NAME}_claim_idx
+            ON {settings.JOB_TABLE_NAME} (status, run_after)
+            WHERE status IN ('queued', 'running')
+            """
+        )
+        # packages of the ingested repos, see service/repo_ingest
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {settings.REPO_STATE_TABLE_NAME} (
+                os_version text NOT NULL,
+                name text NOT NULL,
+                version text NOT NULL,
+                sha256 text NOT NULL,
+                src_rpm_url text NOT NULL,
+                status text NOT NULL,
+                error text,
+                updated_at timestamptz NOT NULL DEFAULT now(),
+                PRIMARY KEY (os_version, name)
+            )
+            """
+        )
 
 
 def close_pool():
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+
+# how often a running ingestion checks that its client is still there
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# created on first use, shared by every ingestion of the process
+_STAGE_EXECUTOR = None
+
+
+def _stage_executor():
+    global _STAGE_EXECUTOR
+    if _STAGE_EXECUTOR is None:
+        _STAGE_EXECUTOR = ThreadPoolExecutor(
+            max_workers=max(settings.INGEST_STAGE_WORKERS, 1),
+            thread_name_prefix="ingest-stage",
+        )
+    return _STAGE_EXECUTOR
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking stage (file io, subprocess, proxy call) on the bounded
+    stage executor so the event loop keeps serving other requests.
+
+    A running thread cannot be stopped: on cancellation the stage is
+    awaited to its end before CancelledError is raised again, so the
+    caller never cleans up a workspace that is still in use.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        _stage_executor(), functools.partial(func, *args, **kwargs)
+    )
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait({future})
+        raise
+
+
+async def cancel_on_disconnect(request, coro):
+    """
+    Await coro, cancel it when the client of request goes away. The
+    remaining stages are skipped and CancelledError is raised.
+    """
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            logger.warning("client disconnected, cancel the ingestion")
+            task.cancel()
+            # let the task unwind (workspace cleanup) before leaving
+            await asyncio.wait({task})
+            raise asyncio.CancelledError()
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+"""
+Download cache for src.rpm files and repo metadata, keyed by URL. A
+cached file is revalidated with If-None-Match / If-Modified-Since before
+reuse, fetched with the ranged downloader, and the least recently used
+files are removed once the cache is bigger than DOWNLOAD_CACHE_MB. A
+flock per URL makes concurrent downloads of the same URL (threads or
+server processes) share one fetch.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import downloader
+from infra_ai_service.service.local_source import link_or_copy
+
+META_SUFFIX = ".json"
+LOCK_SUFFIX = ".lock"
+PARTIAL_SUFFIXES = (downloader.STATE_SUFFIX, downloader.PART_SUFFIX)
+
+
+def enabled():
+    return bool(settings.DOWNLOAD_CACHE_DIR) and settings.DOWNLOAD_CACHE_MB > 0
+
+
+def _cache_dir():
+    return os.path.expanduser(settings.DOWNLOAD_CACHE_DIR)
+
+
+def _entry_path(url: str):
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(_cache_dir(), key[:2], key)
+
+
+def _read_meta(path: str):
+    try:
+        with open(path + META_SUFFIX, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path: str, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _conditional_headers(path: str, meta):
+    if not meta or not os.path.exists(path):
+        return {}
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def _write_meta(path: str, meta: dict):
+    _write_atomic(
+        path + META_SUFFIX, lambda f: f.write(json.dumps(meta).encode())
+    )
+
+
+def _refresh(url: str, path: str, max_bytes: int):
+    """bring the cached copy up to date, the caller holds the url lock"""
+    meta = _read_meta(path)
+    headers = _conditional_headers(path, meta)
+    if headers:
+        request = urllib.request.Request(url, headers=headers, method="HEAD")
+        try:
+            with urllib.request.urlopen(
+                request, timeout=settings.DOWNLOAD_TIMEOUT or None
+            ):
+                pass  # 200, the file changed
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            logger.info(f"download cache hit: {url}")
+            return meta
+        except urllib.error.URLError as e:
+            logger.warning(f"revalidate {url} fail, use cached copy: {e}")
+            return meta
+
+    # ranged and resumable, the file only appears once complete
+    meta = downloader.download(url, path, max_bytes)
+    meta["url"] = url
+    _write_meta(path, meta)
+    return meta
+
+
+def fetch(url: str, dst_path: str, max_bytes: int = 0):
+    """
+    Place the content of url at dst_path, from the cache when it is still
+    valid. Returns the cache metadata (etag, last_modified, sha256, size).
+    """
+    path = _entry_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + LOCK_SUFFIX, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        meta = _refresh(url, path, max_bytes)
+        os.utime(path)
+        link_or_copy(path, dst_path)
+
+    evict()
+    return meta
+
+
+class _Tee:
+    """reads from the response, keeps a copy of what was read"""
+
+    def __init__(self, response, copy):
+        self.response = response
+        self.copy = copy
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1):
+        data = self.response.read(size)
+        self.copy.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self):
+        while self.read(1024 * 1024):
+            pass
+
+
+def _open_fresh(url: str, path: str):
+    """the response of a conditional GET, None when the cached copy is good"""
+    headers = _conditional_headers(path, _read_meta(path))
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        return urllib.request.urlopen(
+            request, timeout=settings.DOWNLOAD_TIMEOUT or None
+        )
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or not headers:
+            raise
+        logger.info(f"download cache hit: {url}")
+    except urllib.error.URLError as e:
+        if not headers:
+            raise
+        logger.warning(f"revalidate {url} fail, use cached copy: {e}")
+    return None
+
+
+def _stream_into_cache(url: str, path: str, response):
+    copy = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path), suffix=".tmp", delete=False
+    )
+    try:
+        with response, copy:
+            tee = _Tee(response, copy)
+            yield tee
+            tee.drain()
+        length = response.headers.get("Content-Length")
+        if length and int(length) != tee.size:
+            raise Exception(f"download {url} incomplete: {tee.size}:{length}")
+        os.replace(copy.name, path)
+    except BaseException:
+        try:
+            os.remove(copy.name)
+        except OSError:
+            pass
+        raise
+
+    meta = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": tee.digest.hexdigest(),
+        "size": tee.size,
+        "url": url,
+    }
+    _write_meta(path, meta)
+
+
+@contextmanager
+def open_stream(url: str):
+    """
+    A binary stream of url, the cached copy when it is still valid. A
+    fresh download is written to the cache while the caller reads it, it
+    replaces the cached copy once read to the end.
+    """
+    path = _entry_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + LOCK_SUFFIX, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        response = _open_fresh(url, path)
+        if response is None:
+            os.utime(path)
+            with open(path, "rb") as f:
+                yield f
+        else:
+            yield from _stream_into_cache(url, path, response)
+
+    evict()
+
+
+def _try_lock(path: str):
+    lock = open(path + LOCK_SUFFIX, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return lock
+    except OSError:
+        lock.close()
+        return None
+
+
+def _entry_name(file: str):
+    """the download a file belongs to, None for metadata and locks"""
+    for suffix in PARTIAL_SUFFIXES:
+        if file.endswith(suffix):
+            return file[: -len(suffix)]
+    return None if "." in file else file
+
+
+def _entries():
+    """(mtime, size, path) of every cached download, partial ones included"""
+    entries = {}
+    for root, _, files in os.walk(_cache_dir()):
+        for file in files:
+            name = _entry_name(file)
+            if name is None:
+                continue
+            try:
+                st = os.stat(os.path.join(root, file))
+            except OSError:
+                continue
+            path = os.path.join(root, name)
+            mtime, size = entries.get(path, (0, 0))
+            entries[path] = (max(mtime, st.st_mtime), size + st.st_size)
+    return [(mtime, size, path) for path, (mtime, size) in entries.items()]
+
+
+def _remove_entry(path: str):
+    """False when the file is being downloaded or handed out right now"""
+    lock = _try_lock(path)
+    if lock is None:
+        return False
+    with lock:
+        partials = [path + suffix for suffix in PARTIAL_SUFFIXES]
+        for file in [path, path + META_SUFFIX, *partials]:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+    return True
+
+
+def evict():
+    """remove the least recently used files above the size limit"""
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    limit = settings.DOWNLOAD_CACHE_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if _remove_entry(path):
+            total -= size
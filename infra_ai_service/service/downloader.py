@@ -0,0 +1,348 @@
+#!/usr/bin/python3
+"""
+HTTP downloader for big src.rpm and repo metadata files. When the server
+accepts byte ranges the file is fetched in DOWNLOAD_RANGE_CHUNK_MB chunks
+over several connections, written in place with pwrite. Finished chunks
+are recorded next to the partial file, so an interrupted download resumes
+where it stopped as long as the remote file is unchanged. Without range
+support it falls back to one stream.
+"""
+
+import fcntl
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import feature_cache
+
+COPY_CHUNK = 1024 * 1024
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+LOCK_SUFFIX = ".lock"
+# partials of download_resumable nobody came back for
+PARTIAL_MAX_AGE = 24 * 3600
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class DownloadError(Exception):
+    """not worth a retry"""
+
+
+def _open(url: str, headers=None, method: str = "GET"):
+    request = urllib.request.Request(url, headers=headers or {}, method=method)
+    return urllib.request.urlopen(
+        request, timeout=settings.DOWNLOAD_TIMEOUT or None
+    )
+
+
+def probe_url(url: str):
+    """size, validators and range support of url, None when HEAD fails"""
+    try:
+        with _open(url, method="HEAD") as resp:
+            headers = resp.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            raise
+        return None
+    except urllib.error.URLError:
+        return None
+
+    size = headers.get("Content-Length", "")
+    return {
+        "size": int(size) if size.isdigit() else None,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "ranges": headers.get("Accept-Ranges", "").lower() == "bytes",
+    }
+
+
+def _retryable(e: Exception):
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code >= 500
+    return isinstance(
+        e, (urllib.error.URLError, http.client.HTTPException, OSError)
+    )
+
+
+def _retry(func):
+    retries = max(settings.DOWNLOAD_RETRIES, 0)
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == retries or not _retryable(e):
+                raise
+            logger.warning(f"download attempt {attempt + 1} fail: {e}")
+            time.sleep(0.5 * 2**attempt)
+
+
+def _load_state(state_path: str, url: str, probe, chunk_size: int):
+    """state of the partial file, None when the remote file changed"""
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    expected = {
+        "url": url,
+        "size": probe["size"],
+        "etag": probe["etag"],
+        "last_modified": probe["last_modified"],
+        "chunk_size": chunk_size,
+    }
+    if any(state.get(k) != v for k, v in expected.items()):
+        return None
+    return state
+
+
+def _save_state(state_path, url, probe, chunk_size, done):
+    state = {
+        "url": url,
+        "size": probe["size"],
+        "etag": probe["etag"],
+        "last_modified": probe["last_modified"],
+        "chunk_size": chunk_size,
+        "done": sorted(done),
+    }
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def _fetch_range(url: str, fd: int, start: int, end: int, probe):
+    headers = {"Range": f"bytes={start}-{end}"}
+    # the server answers 200 with the whole file when it changed meanwhile
+    validator = probe["etag"] or probe["last_modified"]
+    if validator:
+        headers["If-Range"] = validator
+
+    with _open(url, headers) as resp:
+        if resp.status != 206:
+            raise RangeNotSupported(f"status {resp.status} for a range")
+        offset = start
+        for chunk in iter(lambda: resp.read(COPY_CHUNK), b""):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+    if offset != end + 1:
+        raise http.client.IncompleteRead(b"", end + 1 - offset)
+
+
+def _resume_chunks(url, part_path, state_path, probe, chunk_size):
+    """chunks of the partial file already on disk"""
+    if not os.path.exists(part_path):
+        return set()
+    state = _load_state(state_path, url, probe, chunk_size)
+    done = set(state["done"]) if state else set()
+    if done:
+        logger.info(f"resume {url}: {len(done)} chunks on disk")
+    return done
+
+
+def _run_all(func, items, workers: int):
+    """func(item) for each item on workers threads, stops at an error"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(func, item) for item in items]
+        finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            future.cancel()
+        for future in finished:
+            future.result()
+
+
+def _download_ranges(url: str, part_path: str, probe, workers: int):
+    size = probe["size"]
+    chunk_size = settings.DOWNLOAD_RANGE_CHUNK_MB * 1024 * 1024
+    state_path = part_path[: -len(PART_SUFFIX)] + STATE_SUFFIX
+    done = _resume_chunks(url, part_path, state_path, probe, chunk_size)
+    chunks = [
+        i
+        for i in range((size + chunk_size - 1) // chunk_size)
+        if i not in done
+    ]
+    lock = threading.Lock()
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, size)
+
+        def fetch(i):
+            start = i * chunk_size
+            end = min(size, start + chunk_size) - 1
+            _retry(lambda: _fetch_range(url, fd, start, end, probe))
+            with lock:
+                done.add(i)
+                _save_state(state_path, url, probe, chunk_size, done)
+
+        _run_all(fetch, chunks, workers)
+    finally:
+        os.close(fd)
+
+
+def _resume_offset(url: str, part_path: str, state_path: str, probe):
+    """where one stream continues the partial file, 0 to start over"""
+    if probe is None or not probe["ranges"]:
+        return 0
+    if os.path.exists(part_path) and _load_state(state_path, url, probe, 0):
+        return os.path.getsize(part_path)
+    return 0
+
+
+def _resume_headers(offset: int, probe):
+    if not offset:
+        return {}
+    headers = {"Range": f"bytes={offset}-"}
+    validator = probe["etag"] or probe["last_modified"]
+    if validator:
+        headers["If-Range"] = validator
+    return headers
+
+
+def _write_stream(resp, part_path: str, offset: int, max_bytes: int):
+    with open(part_path, "r+b" if offset else "wb") as f:
+        f.seek(offset)
+        f.truncate()
+        total = offset
+        for chunk in iter(lambda: resp.read(COPY_CHUNK), b""):
+            total += len(chunk)
+            if max_bytes and total > max_bytes:
+                raise DownloadError(f"file is larger than {max_bytes} bytes")
+            f.write(chunk)
+
+
+def _download_stream(url: str, part_path: str, probe, max_bytes: int):
+    """one stream; continues a partial file when the server allows it"""
+    state_path = part_path[: -len(PART_SUFFIX)] + STATE_SUFFIX
+    resumable = probe is not None and probe["ranges"]
+
+    def attempt():
+        offset = _resume_offset(url, part_path, state_path, probe)
+        if resumable:
+            _save_state(state_path, url, probe, 0, ())
+        with _open(url, _resume_headers(offset, probe)) as resp:
+            if resp.status != 206:
+                offset = 0
+            _write_stream(resp, part_path, offset, max_bytes)
+
+    _retry(attempt)
+
+
+def _ranged(probe):
+    """whether the file is worth several connections"""
+    chunk_size = settings.DOWNLOAD_RANGE_CHUNK_MB * 1024 * 1024
+    return (
+        probe is not None
+        and probe["ranges"]
+        and probe["size"] is not None
+        and settings.DOWNLOAD_RANGE_WORKERS > 1
+        and chunk_size > 0
+        and probe["size"] > chunk_size
+    )
+
+
+def _remove_files(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _fetch(url: str, dst_path: str, probe, max_bytes: int):
+    """fetch url into the partial file of dst_path"""
+    part_path = dst_path + PART_SUFFIX
+    if not _ranged(probe):
+        _download_stream(url, part_path, probe, max_bytes)
+        return
+    try:
+        _download_ranges(
+            url, part_path, probe, settings.DOWNLOAD_RANGE_WORKERS
+        )
+    except RangeNotSupported as e:
+        logger.warning(f"ranged download of {url} fail, one stream: {e}")
+        _remove_files(part_path, dst_path + STATE_SUFFIX)
+        _download_stream(url, part_path, None, max_bytes)
+
+
+def _check(part_path: str, probe, sha256: str):
+    """
+    size and sha256 of the partial file, removed when they are wrong; the
+    sha256 is only computed when it is checked or used as feature cache key
+    """
+    size = os.path.getsize(part_path)
+    if probe and probe["size"] is not None and size != probe["size"]:
+        os.remove(part_path)
+        raise DownloadError(f"size mismatch: {size}:{probe['size']}")
+    if not sha256 and not feature_cache.enabled():
+        return size, ""
+    digest = feature_cache.file_sha256(part_path)
+    if sha256 and digest != sha256.lower():
+        os.remove(part_path)
+        raise DownloadError(f"sha256 mismatch: {digest}:{sha256}")
+    return size, digest
+
+
+def download(url: str, dst_path: str, max_bytes: int = 0, sha256: str = ""):
+    """
+    Download url to dst_path, which only appears once complete. Returns
+    etag, last_modified, sha256 and size of the file.
+    """
+    part_path = dst_path + PART_SUFFIX
+    probe = probe_url(url)
+    if probe and max_bytes and (probe["size"] or 0) > max_bytes:
+        raise DownloadError(f"file is larger than {max_bytes} bytes")
+
+    _fetch(url, dst_path, probe, max_bytes)
+    size, digest = _check(part_path, probe, sha256)
+    os.replace(part_path, dst_path)
+    _remove_files(dst_path + STATE_SUFFIX)
+    return {
+        "etag": probe["etag"] if probe else None,
+        "last_modified": probe["last_modified"] if probe else None,
+        "sha256": digest,
+        "size": size,
+    }
+
+
+def _partial_dir():
+    return os.path.join(settings.SRC_RPM_DIR, "partial")
+
+
+def _drop_stale_partials(part_dir: str):
+    now = time.time()
+    for entry in os.scandir(part_dir):
+        if not entry.name.endswith((PART_SUFFIX, STATE_SUFFIX)):
+            continue
+        try:
+            if now - entry.stat().st_mtime > PARTIAL_MAX_AGE:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def download_resumable(url: str, dst_path: str, max_bytes: int = 0):
+    """
+    download() for a dst_path in a short-lived directory, the partial file
+    is kept by url under SRC_RPM_DIR so a retry of a dropped request
+    resumes it
+    """
+    part_dir = _partial_dir()
+    os.makedirs(part_dir, exist_ok=True)
+    path = os.path.join(part_dir, hashlib.sha256(url.encode()).hexdigest())
+    with open(path + LOCK_SUFFIX, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        meta = download(url, path, max_bytes)
+        shutil.move(path, dst_path)
+
+    _drop_stale_partials(part_dir)
+    return meta
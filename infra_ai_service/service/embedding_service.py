@@ -3,12 +3,23 @@ from fastapi import HTTPException
 from infra_ai_service.model.model import EmbeddingOutput
 from infra_ai_service.sdk import pgvector, ai_proxy
 
+INSERT_SQL = """
+INSERT INTO documents
+(content, embedding, os_version, name)
+VALUES (%s, %s, %s, %s)
+"""
 
-def create_embedding(content, os_version, name):
+DELETE_SQL = "DELETE FROM documents WHERE os_version = %s AND name = %s"
+
+
+def create_embedding(content, os_version, name, replace=False):
+    """replace drops the earlier documents of name in the same commit"""
     try:
         embeddings = ai_proxy.embedding(content)
         with pgvector.pool.connection() as conn:
-            with conn.cursor() as cur:
+            with conn.transaction(), conn.cursor() as cur:
+                if replace:
+                    cur.execute(DELETE_SQL, (os_version, name))
                 logger.info("execute insert into embedding pgvector")
                 cur.execute(
                     """
@@ -27,3 +38,21 @@ def create_embedding(content, os_version, name):
         raise HTTPException(
             status_code=400, detail=f"Error processing embedding: {e}"
         )
+
+
+def create_embeddings(contents, os_version, names):
+    """create_embedding of several features, one proxy call, one commit"""
+    embeddings = ai_proxy.embedding_batch(contents)
+    with pgvector.pool.connection() as conn:
+        with conn.transaction(), conn.cursor() as cur:
+            logger.info(f"execute insert of {len(contents)} embeddings")
+            cur.executemany(
+                INSERT_SQL,
+                [
+                    (content, embedding, os_version, name)
+                    for content, embedding, name in zip(
+                        contents, embeddings, names
+                    )
+                ],
+            )
+    return len(contents)
@@ -1,49 +1,78 @@
 #!/usr/bin/python3
 
 import os
+import shutil
 import subprocess
-import copy
-import urllib.request
 import re
-import tempfile
+import urllib.request
+from contextlib import ExitStack, contextmanager
 from loguru import logger
+from infra_ai_service.service.extract_xml import (
+    check_xml_name,
+    decompressed,
+    extract_xml_index,
+)
 from infra_ai_service.config.config import settings
-from infra_ai_service.service.extract_xml import extract_xml_features
-from infra_ai_service.service.utils import update_json
-import asyncio
-
-XML_INFO = None
-
-
-async def _download_from_url(url, rpm_path):
+from infra_ai_service.service import (
+    download_cache,
+    downloader,
+    xml_registry,
+    xml_snapshot,
+)
+from infra_ai_service.service.concurrency import run_blocking
+from infra_ai_service.service.local_source import link_or_copy, local_path
+from infra_ai_service.service.sandbox import cpu_share, run_sandboxed
+from infra_ai_service.service.rpm_reader import (
+    SOURCE_ARCHIVE_RE,
+    extract_members,
+)
+from infra_ai_service.service.spec_parser import parse_spec
+from infra_ai_service.service.src_scanner import (
+    ScanOptions,
+    scan_archive,
+    scan_dir,
+)
+from infra_ai_service.service.utils import update_json_indexed
+from infra_ai_service.service.workspace import (
+    check_quota,
+    quota_bytes,
+    remaining_quota,
+    run_within_quota,
+)
+
+
+async def download_from_url(url, rpm_path, max_bytes=0):
+    """url at rpm_path, from a local mirror, the cache or the network"""
     try:
-        await asyncio.get_event_loop().run_in_executor(
-            None,
-            urllib.request.urlretrieve,
-            url,
-            rpm_path
+        src_path = local_path(url)
+        if src_path:
+            await run_blocking(link_or_copy, src_path, rpm_path)
+            return
+        if download_cache.enabled():
+            await run_blocking(download_cache.fetch, url, rpm_path, max_bytes)
+            return
+        await run_blocking(
+            downloader.download_resumable, url, rpm_path, max_bytes
         )
     except Exception as e:
         raise Exception(f"download src.rpm fail: {e}")
 
 
-def _decompress_src_rpm(rpm_path):
+def decompress_src_rpm(rpm_path, work_dir=None):
+    """unpack next to rpm_path, or in work_dir for a file read in place"""
     if not os.path.exists(rpm_path):
         raise Exception("check download rpm error, file not exit")
 
-    cur_dir = os.path.dirname(rpm_path)
+    cur_dir = work_dir or os.path.dirname(rpm_path)
     try:
         rpm_dir = os.path.join(cur_dir, "tmp_src_rpm")
-        cmd = ["rm", "-rf", rpm_dir]
-        del_res = subprocess.run(cmd)
-        if del_res.returncode != 0:
-            raise ValueError(f"delete redundant dir fail: {del_res.stderr}")
-
-        # rpm2cpio <pkg> | cpio -div -D <path>
-        cmd = f"rpm2cpio {rpm_path} | cpio -div -D {rpm_dir}"
-        res = subprocess.run(cmd, shell=True)
-        if res.returncode != 0:
-            raise ValueError(f"errcode[{res.stderr}]")
+        shutil.rmtree(rpm_dir, ignore_errors=True)
+
+        # only .spec and source archives are written, see rpm_reader
+        members = extract_members(
+            rpm_path, rpm_dir, max_bytes=remaining_quota(cur_dir)
+        )
+        logger.info(f"extract src.rpm members: {members}")
         return rpm_dir
     except Exception as e:
         raise Exception(f"decompress src.rpm fail: {e}")
@@ -53,65 +82,99 @@ def _get_tar_cmd(suffix, tar_path, dst_path):
     if not os.path.exists(tar_path):
         return None
     os.makedirs(dst_path)
+    # argv lists: the names come from the rpm payload and never see a
+    # shell, and a timeout kills tar itself
     suffix_cmd = {
-        ".tar.gz": f"tar -xzf {tar_path} -C {dst_path}",
-        ".tgz": f"tar -xzf {tar_path} -C {dst_path}",
-        ".tar.bz2": f"tar -xjf {tar_path} -C {dst_path}",
-        ".tar.xz": f"tar -xJf {tar_path} -C {dst_path}",
-        ".zip": f"unzip {tar_path} -d {dst_path}",
+        ".tar.gz": ["tar", "-xzf", tar_path, "-C", dst_path],
+        ".tgz": ["tar", "-xzf", tar_path, "-C", dst_path],
+        ".tar.bz2": ["tar", "-xjf", tar_path, "-C", dst_path],
+        ".tar.xz": ["tar", "-xJf", tar_path, "-C", dst_path],
+        ".tar.zst": ["tar", "--zstd", "-xf", tar_path, "-C", dst_path],
+        ".zip": ["unzip", "-q", tar_path, "-d", dst_path],
     }
     return suffix_cmd.get(suffix, None)
 
 
-def _decompress_tar_file(rpm_dir):
-    if not os.path.exists(rpm_dir):
-        raise Exception("check decompress rpm error, directory not exit")
-
-    suffix, tar_path = "", ""
+def _find_source_archive(rpm_dir):
     for file in os.listdir(rpm_dir):
-        match = re.search(r"\.(tar\.gz|tar\.bz2|tar\.xz|zip|tgz)$", file)
+        match = SOURCE_ARCHIVE_RE.search(file)
         if match:
-            suffix = match.group()
-            tar_path = os.path.join(rpm_dir, file)
-            break
+            return match.group(), os.path.join(rpm_dir, file)
+    return "", ""
+
+
+def decompress_tar_file(rpm_dir):
+    if not os.path.exists(rpm_dir):
+        raise Exception("check decompress rpm error, directory not exit")
 
+    suffix, tar_path = _find_source_archive(rpm_dir)
     dst_path = os.path.join(rpm_dir, "src")
     cmd = _get_tar_cmd(suffix, tar_path, dst_path)
     if not cmd:
         raise ValueError("found new zip file")
 
     try:
-        res = subprocess.run(cmd, shell=True)
-        if res.returncode != 0:
-            raise ValueError(f"returncode[{res.stderr}]")
+        # the workspace quota is enforced while tar writes
+        returncode = run_within_quota(
+            cmd,
+            dst_path,
+            remaining_quota(os.path.dirname(rpm_dir)),
+            timeout=settings.TAR_STAGE_TIMEOUT,
+        )
+        if returncode != 0:
+            raise ValueError(f"returncode[{returncode}]")
         # TODO: maybe, don't need return
         return dst_path
     except Exception as e:
         raise Exception(f"decompress tar file error: {e}")
 
 
-async def process_src_rpm_from_url(url: str):
+async def download_src_rpm(url: str, work_dir: str):
+    """path of the src.rpm, a file of a local mirror is not copied"""
     if not url.endswith(".src.rpm"):
         raise Exception("url of src.rpm may be wrong")
 
-    file_save_dir = os.path.expanduser(settings.SRC_RPM_DIR)
+    try:
+        src_path = local_path(url)
+    except Exception as e:
+        raise Exception(f"download src.rpm fail: {e}")
+    if src_path:
+        return src_path
 
-    if not os.path.exists(file_save_dir):
-        os.makedirs(file_save_dir)
+    rpm_path = os.path.join(work_dir, "tmp.src.rpm")
+    await download_from_url(url, rpm_path, quota_bytes())
+    return rpm_path
 
-    # download .src.rpm file
-    rpm_path = os.path.join(file_save_dir, "tmp.src.rpm")
-    await _download_from_url(url, rpm_path)
 
+async def unpack_src_rpm(rpm_path: str, work_dir: str):
     # decompress .src.rpm file
-    rpm_dir = _decompress_src_rpm(rpm_path)
-
-    # decompress tar file
-    _decompress_tar_file(rpm_dir)
+    rpm_dir = await run_sandboxed(
+        decompress_src_rpm,
+        rpm_path,
+        work_dir,
+        timeout=settings.RPM_STAGE_TIMEOUT,
+    )
+    await run_blocking(check_quota, work_dir)
+
+    # decompress tar file, the archive scan mode reads it in place
+    if settings.SRC_SCAN_MODE != "archive":
+        await run_sandboxed(
+            decompress_tar_file, rpm_dir, timeout=settings.TAR_STAGE_TIMEOUT
+        )
+        await run_blocking(check_quota, work_dir)
 
     return rpm_dir
 
 
+async def process_src_rpm_from_url(url: str, work_dir: str):
+    """
+    work_dir is private to the caller (see workspace.workspace), so
+    several requests can download and decompress at the same time.
+    """
+    rpm_path = await download_src_rpm(url, work_dir)
+    return await unpack_src_rpm(rpm_path, work_dir)
+
+
 def _process_binarylist(binary_list, data_count):
     res = []
     for binary in binary_list:
@@ -150,19 +213,22 @@ def _process_requires(build_requires, data_count):
     data_count["buildRequires"] = new_build_requires
 
 
-def _process_source0(abs_path, data_count):
+def _rpmspec_parse(abs_path: str, dir_path: str):
+    """expand the spec once, `rpmspec -P` resolves macros and conditionals"""
     try:
-        source0_command = f"rpmspec -P {abs_path} | grep Source0:"
-        source_command = f"rpmspec -P {abs_path} | grep Source:"
-        if subprocess.getoutput(source0_command) != "":
-            source0 = subprocess.getoutput(source0_command)
-            source0 = source0.split("Source0:")[1].strip()
-        else:
-            source0 = subprocess.getoutput(source_command)
-            source0 = source0.split("Source:")[1].strip()
-        data_count["source0"] = source0
-    except Exception:
-        data_count["source0"] = ""
+        res = subprocess.run(
+            ["rpmspec", "-P", abs_path],
+            cwd=dir_path,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=settings.RPMSPEC_TIMEOUT or None,
+        )
+    except Exception as e:
+        raise Exception(f"rpmspec cmd fail: {e}")
+
+    if res.returncode != 0:
+        logger.warning(f"rpmspec -P {abs_path} fail: {res.stderr.decode()}")
+    return parse_spec(res.stdout.decode())
 
 
 def _process_spec_file(dir_path: str, file: str, data: dict, count: int):
@@ -171,69 +237,42 @@ def _process_spec_file(dir_path: str, file: str, data: dict, count: int):
 
     name = os.path.splitext(file)[0]
     data[count]["name"] = name
-    try:
-        abs_path = os.path.join(dir_path, file)
-        cmd = ["rpmspec", "-q", abs_path]
-        output_binary = subprocess.run(
-            cmd, cwd=dir_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
 
-        cmd = ["rpmspec", "-q", "--provides", abs_path]
-        output_providers = subprocess.run(
-            cmd, cwd=dir_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+    spec = _rpmspec_parse(os.path.join(dir_path, file), dir_path)
+    _process_binarylist(spec["binaries"], data[count])
+    _process_provides(spec["provides"], data[count])
+    _process_requires(spec["build_requires"], data[count])
+    data[count]["source0"] = spec["source0"]
 
-        cmd = ["rpmspec", "-q", "--buildrequires", abs_path]
-        output_buildrequires = subprocess.run(
-            cmd, cwd=dir_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
 
-    except Exception as e:
-        raise Exception(f"rpmspec cmd fail: {e}")
+def _split_globs(globs: str):
+    return tuple(g.strip() for g in globs.split(",") if g.strip())
+
+
+def _scan_options():
+    return ScanOptions(
+        include=_split_globs(settings.SRC_SCAN_INCLUDE),
+        exclude=_split_globs(settings.SRC_SCAN_EXCLUDE),
+        max_file_size=settings.SRC_SCAN_MAX_FILE_SIZE,
+        file_max_bytes=settings.SRC_SCAN_FILE_MAX_BYTES,
+        byte_budget=settings.SRC_SCAN_BYTE_BUDGET,
+        time_budget=settings.SRC_SCAN_TIME_BUDGET,
+        patterns=settings.SRC_SCAN_PATTERNS,
+    )
+
+
+def _scan_workers():
+    if settings.SRC_SCAN_WORKERS:
+        return settings.SRC_SCAN_WORKERS
+    # a sandbox or cli worker scans with its share of the cpus, all of
+    # them per worker would start cpu x cpu scan processes
+    return cpu_share()
 
-    binary_list = output_binary.stdout.decode().strip().splitlines()
-    provides = output_providers.stdout.decode().strip().splitlines()
-    build_requires = output_buildrequires.stdout.decode().strip().splitlines()
-
-    _process_binarylist(binary_list, data[count])
-    _process_provides(provides, data[count])
-    _process_requires(build_requires, data[count])
-    _process_source0(abs_path, data[count])
-
-
-def _process_url_name(res: str):
-    if res.strip().split(" ")[0].isdigit():
-        url_name = res.strip().split(" ")[1]
-        start = url_name.find('"')
-        end = url_name[start + 1:].find('"')
-        if start + end + 1 == len(url_name) - 1:
-            return url_name.replace('"', "")
-        else:
-            return url_name[1: start + end + 1]
-    return ""
-
-
-def _process_src_dir_common(cmd, data_count):
-    res_str = subprocess.getoutput(cmd[0])
-    if res_str != "":
-        res_list = res_str.split("\n")
-        res_names = []
-        for res in res_list:
-            if res.find("Permission denied") == -1:
-                if cmd[1] == "url_names":
-                    url_name = _process_url_name(res)
-                    if url_name != "":
-                        res_names.append(url_name)
-                elif cmd[1] == "path_names":
-                    tmp_name = res.strip().split(" ")[1].replace('"', "")
-                    res_names.append(tmp_name)
-                else:
-                    res_names.append(res.strip().split(" ")[1])
-            else:
-                continue
-        data_count[cmd[1]] = res_names
-    else:
-        data_count[cmd[1]] = []
+
+def _check_truncated(src_path, features):
+    if features.get("scan_truncated", False):
+        logger.warning(f"scan budget exhausted, partial counts: {src_path}")
+    return features
 
 
 def _process_src_dir(src_path, data, count):
@@ -242,74 +281,73 @@ def _process_src_dir(src_path, data, count):
 
     if not os.path.exists(src_path):
         raise Exception("src dir not exist")
-    cmd_list = [
-        (
-            (
-                "rg -o --no-filename "
-                f"'\\<[A-Z]+_[A-Z]+\\>' '{src_path}' "
-                "| sort | uniq -c | sort -nr | head -10"
-            ),
-            "macro_names",
-        ),
-        (
-            (
-                "rg -o --no-filename "
-                f"'\\<[a-z]+@[a-z]+\\.[a-z.]+\\>' '{src_path}' "
-                "| sort | uniq -c | sort -nr | head -10"
-            ),
-            "email_names",
-        ),
-        # class_names probably don't need -I para
-        (
-            (
-                "rg -o --no-filename "
-                f"'[A-Z][a-z]\\{{3,\\}}[A-Z][a-z]\\{{3,\\}}' '{src_path}'"
-                " | sort | uniq -c | sort -nr | head -10"
-            ),
-            "class_names",
-        ),
-        (
-            (
-                "rg -o --no-filename "
-                f"'\"/[A-Za-z.]+(/[A-Za-z.]+){{2,}}\"' '{src_path}' "
-                "| sort | uniq -c | sort -nr | head -10"
-            ),
-            "path_names",
-        ),
-        (
-            (
-                "rg -o --no-filename "
-                "'\"(https?|ftp)://([a-zA-Z0-9-]+.)+[a-zA-Z]{2,6}(/.*)?\"' "
-                f"'{src_path}' | sort | uniq -c | sort -nr | head -10"
-            ),
-            "url_names",
-        ),
-    ]
-
-    for cmd in cmd_list:
-        _process_src_dir_common(cmd, data[count])
-
-
-def decompress_xml_file(feature_xml_path: str):
-    if feature_xml_path.endswith(".xml.zst"):
-        cmd = ["zstd", "-d", feature_xml_path]
-        dep_res = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
 
-    if feature_xml_path.endswith(".xml.gz"):
-        cmd = ["gzip", "-d", feature_xml_path]
-        dep_res = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+    # one walk for macro, email, class, path and url names
+    features = scan_dir(
+        src_path, workers=_scan_workers(), options=_scan_options()
+    )
+    data[count].update(_check_truncated(src_path, features))
 
-    logger.info("decompress xml file finished")
-    if dep_res.returncode != 0:
-        raise ValueError(f"delete redundant dir fail: {dep_res.stderr}")
+
+def _process_src_archive(tar_path, data, count):
+    if not data.get(count, None):
+        data[count] = {}
+
+    try:
+        features = scan_archive(tar_path, options=_scan_options())
+    except Exception as e:
+        raise Exception(f"scan source archive error: {e}")
+    data[count].update(_check_truncated(tar_path, features))
+
+
+@contextmanager
+def _open_xml_source(xml_url: str):
+    """the xml file as served, read in place, from the cache or the net"""
+    src_path = local_path(xml_url)
+    if src_path:
+        with open(src_path, "rb") as f:
+            yield f
+    elif download_cache.enabled():
+        with download_cache.open_stream(xml_url) as f:
+            yield f
+    else:
+        with urllib.request.urlopen(
+            xml_url, timeout=settings.DOWNLOAD_TIMEOUT or None
+        ) as f:
+            yield f
+
+
+def read_xml_info(xml_url: str, os_version: str = ""):
+    """
+    xml features of the url by package name, decompressed in process and
+    parsed while it downloads, the uncompressed xml is never written
+    """
+    check_xml_name(xml_url)
+    with ExitStack() as stack:
+        try:
+            raw = stack.enter_context(_open_xml_source(xml_url))
+        except Exception as e:
+            raise Exception(f"download xml fail: {e}")
+        xml = stack.enter_context(decompressed(raw, xml_url))
+        return extract_xml_index(xml, os_version)
+
+
+def _load_xml_info(xml_url: str, os_version: str):
+    """parse the xml, or reopen its snapshot when the source is unchanged"""
+    try:
+        validators = xml_snapshot.source_validators(xml_url)
+    except Exception as e:
+        raise Exception(f"download xml fail: {e}")
+    xml_info = xml_snapshot.open_valid(xml_url, os_version, validators)
+    if xml_info is not None:
+        logger.info(f"xml of {os_version} unchanged, snapshot reused")
+    else:
+        xml_info = read_xml_info(xml_url, os_version)
+        try:
+            xml_snapshot.write(xml_info, xml_url, validators)
+        except Exception as e:
+            logger.error(f"write xml snapshot of {os_version} fail: {e}")
+    return xml_info
 
 
 async def check_xml_info(xml_url: str, os_version: str):
@@ -317,33 +355,27 @@ async def check_xml_info(xml_url: str, os_version: str):
     :param force_refresh: refresh xml feature info from xml file
     :type bool
     """
-    with tempfile.TemporaryDirectory() as src_rpm_dir:
-        if xml_url.endswith(".xml.zst"):
-            base_name = f"{os_version}.xml.zst"
-        if xml_url.endswith(".xml.gz"):
-            base_name = f"{os_version}.xml.gz"
-
-        feature_xml_path = os.path.join(src_rpm_dir, base_name)
-        await _download_from_url(xml_url, feature_xml_path)
-        decompress_xml_file(feature_xml_path)
+    if xml_snapshot.enabled():
+        return await run_blocking(_load_xml_info, xml_url, os_version)
+    return await run_blocking(read_xml_info, xml_url, os_version)
 
-        feature_xml_path = feature_xml_path.replace(".zst", "")
-        feature_xml_path = feature_xml_path.replace(".gz", "")
 
-        if not os.path.exists(feature_xml_path):
-            raise Exception("download xml unknown error")
-
-        xml_info = extract_xml_features(feature_xml_path)
-        xml_info.update({"os_version": os_version})
-
-        return xml_info
-
-    return None
+def _process_src(dir_path, file, archive_name, data, count):
+    """scan file when it is the unpacked tree or the source archive"""
+    if file == "src":
+        _process_src_dir(os.path.join(dir_path, "src"), data, count)
+    elif file == archive_name:
+        _process_src_archive(os.path.join(dir_path, file), data, count)
+    else:
+        return False
+    return True
 
 
-def extract_spec_features(dir_path: str):
-    if not XML_INFO:
-        raise Exception('need to config xml with API "/feature-insert/xml/"')
+def extract_src_features(dir_path: str):
+    """spec and source features of an unpacked src.rpm, before the xml merge"""
+    archive_name = None
+    if settings.SRC_SCAN_MODE == "archive":
+        archive_name = os.path.basename(_find_source_archive(dir_path)[1])
 
     data = {}
     count = 1
@@ -353,21 +385,22 @@ def extract_spec_features(dir_path: str):
             _process_spec_file(dir_path, file, data, count)
             count_flag += 1
 
-        if file == "src":
-            src_path = os.path.join(dir_path, "src")
-            _process_src_dir(src_path, data, count)
+        if _process_src(dir_path, file, archive_name, data, count):
             count_flag += 1
 
         if count_flag == 2:
             count += 1
             count_flag = 0
 
-    # os_version use only in API /feature-insert/
-    # XML_INFO cann't change
-    xml_info = copy.deepcopy(XML_INFO)
-    if xml_info.get("os_version", None):
-        del xml_info["os_version"]
+    return data
 
-    data = update_json(xml_info, data)
 
-    return data
+def merge_xml_features(data: dict, os_version: str):
+    # the xml of os_version is shared and read only, only the matching
+    # record is copied
+    return update_json_indexed(xml_registry.get(os_version), data)
+
+
+def extract_spec_features(dir_path: str, os_version: str):
+    xml_registry.get(os_version)  # fail before the extraction
+    return merge_xml_features(extract_src_features(dir_path), os_version)
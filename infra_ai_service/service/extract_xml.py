@@ -1,6 +1,17 @@
 #!/usr/bin/python3
 
+import gzip
 import xml.etree.ElementTree as ET
+from collections.abc import Mapping
+from types import MappingProxyType
+
+import zstandard
+
+try:
+    # optional, about twice as fast on a big primary.xml
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 
 def _get_tag_name(tag: str):
@@ -60,27 +71,149 @@ def _get_func_with_name(name: str):
     return process_func.get(name, None)
 
 
-def extract_xml_features(feature_xml_path: str):
+def _iter_packages_lxml(source):
+    context = lxml_etree.iterparse(
+        source, events=('end',), tag='{*}package', encoding='utf-8',
+        remove_comments=True, remove_pis=True, huge_tree=True
+    )
+    for _, package in context:
+        parent = package.getparent()
+        if parent is None or parent.getparent() is not None:
+            continue  # only the children of <metadata>
+        yield package
+        package.clear()
+        # drop the cleared siblings too, the root keeps them otherwise
+        while package.getprevious() is not None:
+            del parent[0]
+
+
+def _iter_packages_et(source):
+    context = ET.iterparse(
+        source, events=('start', 'end'),
+        parser=ET.XMLParser(encoding='utf-8')
+    )
+    _, root = next(context)
+    depth = 1
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if _get_tag_name(elem.tag) == 'package':
+                yield elem
+            elem.clear()
+            root.remove(elem)
+
+
+def iter_packages(source):
+    '''
+    <package> elements of a primary.xml (path or binary file object), one
+    at a time: each one is freed once the caller moved on, the memory
+    does not grow with the file lists of the metadata
+    '''
+    if lxml_etree is not None:
+        return _iter_packages_lxml(source)
+    return _iter_packages_et(source)
+
+
+XML_SUFFIXES = ('.xml', '.xml.gz', '.xml.zst')
+
+
+def check_xml_name(name: str):
+    if not name.endswith(XML_SUFFIXES):
+        raise Exception(f'xml must be .xml, .xml.gz or .xml.zst: {name}')
+
+
+def decompressed(raw, name: str):
+    '''
+    the xml inside the binary stream raw, decompressed as it is read;
+    name (path or url) tells the compression
+    '''
+    check_xml_name(name)
+    if name.endswith('.zst'):
+        return zstandard.ZstdDecompressor().stream_reader(
+            raw, read_across_frames=True, closefd=False
+        )
+    if name.endswith('.gz'):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    return raw
+
+
+def _package_features(package):
+    data = {}
+    for info in package:
+        tag_name = _get_tag_name(info.tag)
+        tag_func = _get_func_with_name(tag_name)
+        if tag_func:
+            tag_func(data, info)
+    return data
+
+
+def extract_xml_features(feature_xml_path):
     try:
-        metadata = ET.parse(
-            feature_xml_path, parser=ET.XMLParser(encoding='utf-8')
-        ).getroot()
         res = {}
         count = 1
-        for package in metadata:
-            if _get_tag_name(package.tag) != 'package':
-                continue
+        for package in iter_packages(feature_xml_path):
+            res[count] = _package_features(package)
+            count += 1
+        return res
+    except Exception as e:
+        raise Exception(f'process xml error: {e}')
 
-            if not res.get(count, None):
-                res[count] = {}
 
-            for info in package:
-                tag_name = _get_tag_name(info.tag)
-                tag_func = _get_func_with_name(tag_name)
-                if tag_func:
-                    tag_func(res[count], info)
+def _freeze(data: dict):
+    return MappingProxyType({
+        key: tuple(value) if isinstance(value, list) else value
+        for key, value in data.items()
+    })
 
-            count += 1
-        return res
+
+class XmlIndex(Mapping):
+    '''
+    xml features by package name, read only: the records are shared by
+    every request, a merge copies the one record it needs
+    '''
+
+    def __init__(self, packages: dict, os_version: str = ''):
+        self._packages = MappingProxyType(packages)
+        self.os_version = os_version
+
+    @classmethod
+    def from_features(cls, features, os_version: str = ''):
+        '''index features (as extract_xml_features), first name wins'''
+        packages = {}
+        for data in features:
+            name = data.get('name', '')
+            if name and name not in packages:
+                packages[name] = _freeze(data)
+        return cls(packages, os_version)
+
+    def __getitem__(self, name):
+        return self._packages[name]
+
+    def __iter__(self):
+        return iter(self._packages)
+
+    def __len__(self):
+        return len(self._packages)
+
+    def copy_record(self, name: str):
+        '''a private, mutable copy of the record of name, None if missing'''
+        record = self._packages.get(name)
+        if record is None:
+            return None
+        return {
+            key: list(value) if isinstance(value, tuple) else value
+            for key, value in record.items()
+        }
+
+
+def extract_xml_index(source, os_version: str = ''):
+    try:
+        return XmlIndex.from_features(
+            (_package_features(p) for p in iter_packages(source)),
+            os_version,
+        )
     except Exception as e:
         raise Exception(f'process xml error: {e}')
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""
+On-disk cache of the features extracted from a src.rpm (spec and source
+scan, before the xml merge), keyed by the sha256 of the src.rpm. One
+json file per entry, the least recently used entries are removed once
+the cache is bigger than FEATURE_CACHE_MB.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+
+# bump when the extracted features change for the same src.rpm
+FEATURE_CACHE_VERSION = 1
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def enabled():
+    return bool(settings.FEATURE_CACHE_DIR) and settings.FEATURE_CACHE_MB > 0
+
+
+def _cache_dir():
+    return os.path.expanduser(settings.FEATURE_CACHE_DIR)
+
+
+def cache_key(sha256: str):
+    """the extraction settings are part of the key, results depend on them"""
+    config = [
+        FEATURE_CACHE_VERSION,
+        settings.SRC_SCAN_MODE,
+        settings.SRC_SCAN_FILE_MAX_BYTES,
+        settings.SRC_SCAN_INCLUDE,
+        settings.SRC_SCAN_EXCLUDE,
+        settings.SRC_SCAN_MAX_FILE_SIZE,
+        settings.SRC_SCAN_BYTE_BUDGET,
+        settings.SRC_SCAN_PATTERNS,
+    ]
+    tag = hashlib.sha256(json.dumps(config).encode()).hexdigest()[:16]
+    return f"{sha256.lower()}-{tag}"
+
+
+def _entry_path(key: str):
+    return os.path.join(_cache_dir(), key[:2], f"{key}.json")
+
+
+def get(sha256: str):
+    if not enabled():
+        return None
+
+    path = _entry_path(cache_key(sha256))
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        # mtime is the lru clock
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"drop broken feature cache entry {path}: {e}")
+        _remove(path)
+        return None
+
+    logger.info(f"feature cache hit: {sha256}")
+    # json turns the int keys of extract_src_features into strings
+    return {int(k): v for k, v in data.items()}
+
+
+def put(sha256: str, data: dict):
+    if not enabled():
+        return
+    if settings.SRC_SCAN_TIME_BUDGET and any(
+        info.get("scan_truncated") for info in data.values()
+    ):
+        # cut by the clock, another run may see more
+        return
+
+    path = _entry_path(cache_key(sha256))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        _remove(tmp_path)
+        raise
+    evict()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _entries():
+    """(mtime, size, path) of every cache file"""
+    entries = []
+    for root, _, files in os.walk(_cache_dir()):
+        for file in files:
+            path = os.path.join(root, file)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def evict():
+    """remove the least recently used entries above the size limit"""
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    limit = settings.FEATURE_CACHE_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        _remove(path)
+        total -= size
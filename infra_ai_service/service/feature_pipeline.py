@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+import asyncio
+import re
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import feature_cache, xml_registry
+from infra_ai_service.service.concurrency import run_blocking
+from infra_ai_service.service.embedding_service import create_embedding
+from infra_ai_service.service.extract_spec import (
+    download_src_rpm,
+    extract_src_features,
+    merge_xml_features,
+    unpack_src_rpm,
+)
+from infra_ai_service.service.feature_cache import file_sha256
+from infra_ai_service.service.sandbox import run_sandboxed
+from infra_ai_service.service.utils import convert_to_str
+from infra_ai_service.service.workspace import (
+    ingest_slot,
+    stage_slot,
+    workspace,
+)
+
+
+def check_xml_version(os_version: str):
+    xml_registry.get(os_version)
+
+
+def feature_text(ordered_feature: str):
+    """the text embedded for a feature, see convert_to_str"""
+    return re.sub(r"[{}[\]()@#.\':\/-]", "", ordered_feature)
+
+
+async def report_stage(report, stage: str):
+    """tell the job the stage it is in, report is None outside of jobs"""
+    if report is not None:
+        await report(stage)
+
+
+async def _cached_features(digest: str):
+    if not digest:
+        return None
+    return await run_blocking(feature_cache.get, digest)
+
+
+async def _download_checked(src_rpm_url: str, sha256: str, work_dir: str):
+    """
+    download the src.rpm into work_dir, returns its path and its sha256,
+    which is only computed when it is checked or used as cache key
+    """
+    async with stage_slot("download"):
+        rpm_path = await download_src_rpm(src_rpm_url, work_dir)
+        digest = ""
+        if sha256 or feature_cache.enabled():
+            digest = await run_blocking(file_sha256, rpm_path)
+    if sha256 and digest != sha256.lower():
+        raise Exception(f"src.rpm sha256 mismatch: {digest}:{sha256}")
+    return rpm_path, digest
+
+
+async def _unpack_and_extract(rpm_path: str, work_dir: str):
+    async with stage_slot("extract"):
+        rpm_decompress_dir = await unpack_src_rpm(rpm_path, work_dir)
+        logger.info(
+            "process src rpm finished "
+            f"rpm_decompress_dir:{rpm_decompress_dir}"
+        )
+        return await run_sandboxed(
+            extract_src_features,
+            rpm_decompress_dir,
+            timeout=settings.SPEC_STAGE_TIMEOUT,
+        )
+
+
+async def _extract_features(src_rpm_url: str, sha256: str = "", report=None):
+    """
+    features of the src.rpm before the xml merge, from the feature cache
+    when the same src.rpm was extracted before
+    """
+    data = await _cached_features(sha256)
+    if data is not None:
+        return data
+
+    async with ingest_slot(), workspace() as work_dir:
+        await report_stage(report, "download")
+        rpm_path, digest = await _download_checked(
+            src_rpm_url, sha256, work_dir
+        )
+        data = await _cached_features(digest)
+        if data is not None:
+            return data
+
+        await report_stage(report, "extract")
+        data = await _unpack_and_extract(rpm_path, work_dir)
+        if digest:
+            await run_blocking(feature_cache.put, digest, data)
+        return data
+
+
+async def ingest_src_rpm(
+    src_rpm_url: str,
+    os_version: str,
+    package_name: str = "",
+    sha256: str = "",
+    report=None,
+    flags=None,
+    replace: bool = False,
+):
+    """
+    download, extract and embed one src.rpm, returns the inserted feature;
+    the extraction stages run in the sandbox workers, the other blocking
+    stages on the stage executor. report(stage) is awaited as each stage
+    starts. flags, when given, gets `scan_truncated`, which is kept out of
+    the feature text. replace drops the earlier document of the package.
+    """
+    check_xml_version(os_version)
+
+    data = await _extract_features(src_rpm_url, sha256, report)
+    feature = merge_xml_features(data, os_version)
+    logger.info(f"extrac spec features finished feature:{feature}")
+    name = feature[1]["name"]
+    if name != package_name:
+        logger.debug(f"name difference {name}: {package_name}")
+
+    name = package_name if package_name else name
+    if flags is not None:
+        flags["scan_truncated"] = bool(feature[1].get("scan_truncated"))
+
+    ordered_feature = convert_to_str(feature[1])
+    feature_str = feature_text(ordered_feature)
+    logger.info(f"feature_str build finished:{feature_str}")
+    await report_stage(report, "embed")
+    async with stage_slot("embed"):
+        await run_blocking(
+            create_embedding, feature_str, os_version, name, replace
+        )
+
+    return ordered_feature
+
+
+def error_message(e: Exception):
+    # create_embedding raises HTTPException, its str() is empty
+    return getattr(e, "detail", None) or str(e)
+
+
+async def ingest_batch(packages, os_version: str, replace: bool = False):
+    """
+    Ingest packages (src_rpm_url, package_name, sha256) of one os_version,
+    all of them go through the stages at once, bounded by the stage slots.
+    Yields (index, feature, error) in completion order.
+    """
+    check_xml_version(os_version)
+
+    async def ingest(index, package):
+        try:
+            feature = await ingest_src_rpm(
+                package.src_rpm_url,
+                os_version,
+                package.package_name,
+                package.sha256,
+                replace=replace,
+            )
+            return index, feature, None
+        except Exception as e:
+            logger.error(f"ingest {package.src_rpm_url} fail: {e}")
+            return index, None, e
+
+    tasks = [
+        asyncio.ensure_future(ingest(index, package))
+        for index, package in enumerate(packages)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # the client went away, stop what is left and clean up
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
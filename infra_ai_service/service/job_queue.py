@@ -0,0 +1,315 @@
+#!/usr/bin/python3
+"""
+Ingestion jobs kept in postgres. Submitting returns the job id at once,
+background workers of every server process claim jobs with
+FOR UPDATE SKIP LOCKED under a lease they keep renewing. A job whose
+lease ran out (the server died) is claimed again, a failed job is
+retried with exponential backoff up to JOB_MAX_ATTEMPTS. A worker only
+updates the row of the attempt it claimed, a late one is fenced off.
+"""
+
+import asyncio
+import json
+import time
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.sdk import pgvector
+from infra_ai_service.service.concurrency import run_blocking
+from infra_ai_service.service.feature_pipeline import (
+    error_message,
+    ingest_src_rpm,
+)
+from infra_ai_service.service.repo_ingest import ingest_repo
+
+JOB_COLUMNS = (
+    "id, kind, payload, status, stage, attempts, max_attempts, error, "
+    "result, created_at, updated_at"
+)
+
+SUBMIT_SQL = """
+INSERT INTO {table} (kind, payload, max_attempts)
+VALUES (%s, %s::jsonb, %s)
+RETURNING id
+"""
+
+GET_SQL = "SELECT {columns} FROM {table} WHERE id = %s"
+
+CLAIM_SQL = """
+UPDATE {table}
+SET status = 'running', attempts = attempts + 1, stage = NULL,
+    lease_until = now() + make_interval(secs => %(lease)s),
+    updated_at = now()
+WHERE id = (
+    SELECT id FROM {table}
+    WHERE (status = 'queued' AND run_after <= now())
+       OR (status = 'running' AND lease_until < now())
+    ORDER BY id
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING {columns}
+"""
+
+# a job that kept killing its server is not run again
+EXPIRE_SQL = """
+UPDATE {table}
+SET status = 'failed', error = 'lease expired on the last attempt',
+    lease_until = NULL, updated_at = now()
+WHERE status = 'running' AND lease_until < now()
+  AND attempts >= max_attempts
+"""
+
+HEARTBEAT_SQL = """
+UPDATE {table}
+SET lease_until = now() + make_interval(secs => %s), updated_at = now()
+WHERE id = %s AND attempts = %s AND status = 'running'
+"""
+
+STAGE_SQL = """
+UPDATE {table} SET stage = %s, updated_at = now()
+WHERE id = %s AND attempts = %s AND status = 'running'
+"""
+
+COMPLETE_SQL = """
+UPDATE {table}
+SET status = 'done', stage = NULL, error = NULL, result = %s,
+    lease_until = NULL, updated_at = now()
+WHERE id = %s AND attempts = %s AND status = 'running'
+"""
+
+RETRY_SQL = """
+UPDATE {table}
+SET status = 'queued', error = %s, lease_until = NULL,
+    run_after = now() + make_interval(secs => %s), updated_at = now()
+WHERE id = %s AND attempts = %s AND status = 'running'
+"""
+
+FAIL_SQL = """
+UPDATE {table}
+SET status = 'failed', error = %s, lease_until = NULL, updated_at = now()
+WHERE id = %s AND attempts = %s AND status = 'running'
+"""
+
+# a job stopped by a server shutdown does not lose an attempt
+RELEASE_SQL = """
+UPDATE {table}
+SET status = 'queued', attempts = attempts - 1, lease_until = NULL,
+    run_after = now(), updated_at = now()
+WHERE id = %s AND attempts = %s AND status = 'running'
+"""
+
+_WORKERS = []
+
+
+class LeaseLost(Exception):
+    """the job was claimed again, its row belongs to another attempt"""
+
+
+def _sql(template: str):
+    return template.format(table=settings.JOB_TABLE_NAME, columns=JOB_COLUMNS)
+
+
+def _execute(template: str, params, fetch: bool = False):
+    with pgvector.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_sql(template), params)
+            return cur.fetchone() if fetch else cur.rowcount
+
+
+def _row_to_job(row):
+    job = dict(zip([c.strip() for c in JOB_COLUMNS.split(",")], row))
+    for key in ("created_at", "updated_at"):
+        if job[key] is not None:
+            job[key] = job[key].isoformat()
+    return job
+
+
+def submit_job(kind: str, payload: dict):
+    row = _execute(
+        SUBMIT_SQL,
+        (kind, json.dumps(payload), max(settings.JOB_MAX_ATTEMPTS, 1)),
+        fetch=True,
+    )
+    logger.info(f"job {row[0]} submitted: {kind} {payload}")
+    return row[0]
+
+
+def get_job(job_id: int):
+    row = _execute(GET_SQL, (job_id,), fetch=True)
+    return _row_to_job(row) if row else None
+
+
+def claim_job():
+    _execute(EXPIRE_SQL, ())
+    row = _execute(
+        CLAIM_SQL, {"lease": settings.JOB_LEASE_SECONDS}, fetch=True
+    )
+    return _row_to_job(row) if row else None
+
+
+def _update_claimed(template: str, job: dict, *params):
+    """
+    update the row of a claimed job, its attempt is the fencing token;
+    raises LeaseLost when another claim took the job meanwhile
+    """
+    if not _execute(template, (*params, job["id"], job["attempts"])):
+        raise LeaseLost(
+            f"job {job['id']} attempt {job['attempts']} lost its lease"
+        )
+
+
+def heartbeat(job: dict):
+    _update_claimed(HEARTBEAT_SQL, job, settings.JOB_LEASE_SECONDS)
+
+
+def set_stage(job: dict, stage: str):
+    _update_claimed(STAGE_SQL, job, stage)
+
+
+def complete_job(job: dict, result: str):
+    _update_claimed(COMPLETE_SQL, job, result)
+
+
+def fail_job(job: dict, error: str):
+    if job["attempts"] < job["max_attempts"]:
+        delay = settings.JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+        logger.warning(f"job {job['id']} retry in {delay}s: {error}")
+        _update_claimed(RETRY_SQL, job, error, delay)
+    else:
+        logger.error(f"job {job['id']} failed: {error}")
+        _update_claimed(FAIL_SQL, job, error)
+
+
+def release_job(job: dict):
+    # nothing to give back when the job was claimed again
+    _execute(RELEASE_SQL, (job["id"], job["attempts"]))
+
+
+async def _ingest_src_rpm_job(job: dict, report):
+    payload = job["payload"]
+    return await ingest_src_rpm(
+        payload["src_rpm_url"],
+        payload["os_version"],
+        payload.get("package_name", ""),
+        payload.get("sha256", ""),
+        report=report,
+    )
+
+
+async def _ingest_repo_job(job: dict, report):
+    payload = job["payload"]
+    summary = await ingest_repo(
+        payload["repo_url"], payload["os_version"], report=report
+    )
+    return json.dumps(summary)
+
+
+JOB_HANDLERS = {
+    "src_rpm": _ingest_src_rpm_job,
+    "repo": _ingest_repo_job,
+}
+
+
+async def _keep_lease(job: dict):
+    """
+    renew the lease of a running job, a failed heartbeat is retried;
+    raises LeaseLost when the job was claimed again or the lease would
+    run out before the next try
+    """
+    interval = max(settings.JOB_LEASE_SECONDS / 3, 1)
+    renewed = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        started = time.monotonic()
+        try:
+            await run_blocking(heartbeat, job)
+            renewed = started
+        except LeaseLost:
+            raise
+        except Exception as e:
+            logger.warning(f"job {job['id']} heartbeat fail: {e}")
+            lapse = time.monotonic() - renewed + interval
+            if lapse >= settings.JOB_LEASE_SECONDS:
+                raise LeaseLost(f"job {job['id']} lease not renewed")
+
+
+async def _run_handler(job: dict, report):
+    """the result of the job handler, which is cancelled on LeaseLost"""
+    handler = JOB_HANDLERS[job["kind"]]
+    work = asyncio.ensure_future(handler(job, report))
+    lease = asyncio.ensure_future(_keep_lease(job))
+    try:
+        await asyncio.wait({work, lease}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (work, lease):
+            task.cancel()
+        await asyncio.gather(work, lease, return_exceptions=True)
+    if work.cancelled():
+        raise lease.exception()
+    return work.result()
+
+
+async def _run_and_record(job: dict, report):
+    try:
+        result = await _run_handler(job, report)
+    except asyncio.CancelledError:
+        await run_blocking(release_job, job)
+        raise
+    except LeaseLost:
+        raise
+    except Exception as e:
+        await run_blocking(fail_job, job, error_message(e))
+    else:
+        await run_blocking(complete_job, job, f"{result}")
+
+
+async def run_job(job: dict):
+    """run a claimed job, record its result or error"""
+
+    async def report(stage):
+        await run_blocking(set_stage, job, stage)
+
+    try:
+        await _run_and_record(job, report)
+    except LeaseLost as e:
+        # another worker may own the job by now, leave its row alone
+        logger.error(f"{e}, job stopped")
+
+
+async def _claim():
+    try:
+        return await run_blocking(claim_job)
+    except Exception as e:
+        logger.error(f"claim job fail: {e}")
+        return None
+
+
+async def _work():
+    while True:
+        job = await _claim()
+        if job is None:
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+            continue
+
+        logger.info(f"job {job['id']} attempt {job['attempts']} started")
+        try:
+            await run_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # the database went away, the lease brings the job back
+            logger.error(f"job {job['id']} bookkeeping fail: {e}")
+
+
+def start_job_workers():
+    for _ in range(settings.JOB_WORKERS - len(_WORKERS)):
+        _WORKERS.append(asyncio.ensure_future(_work()))
+
+
+async def stop_job_workers():
+    for worker in _WORKERS:
+        worker.cancel()
+    await asyncio.gather(*_WORKERS, return_exceptions=True)
+    _WORKERS.clear()
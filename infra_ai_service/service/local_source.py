@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+"""
+file:// URLs and plain paths as sources, for hosts with a local mirror.
+Files are read in place; where a private copy is needed it is a hard
+link or a reflink, a real copy only as the last resort.
+"""
+
+import fcntl
+import os
+import shutil
+import urllib.parse
+
+from infra_ai_service.config.config import settings
+
+# linux/fs.h
+FICLONE = 0x40049409
+
+
+def _allowed_roots():
+    return [
+        os.path.realpath(os.path.expanduser(root.strip()))
+        for root in settings.LOCAL_SOURCE_ROOTS.split(",")
+        if root.strip()
+    ]
+
+
+def _url_path(url: str):
+    """the path of a file:// url or a plain path, None for remote urls"""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "":
+        return url
+    if parsed.scheme != "file":
+        return None
+    if parsed.netloc not in ("", "localhost"):
+        raise Exception(f"file url of another host: {url}")
+    return urllib.parse.unquote(parsed.path)
+
+
+def _allowed(real_path: str):
+    return any(
+        os.path.commonpath([root, real_path]) == root
+        for root in _allowed_roots()
+    )
+
+
+def local_path(url: str):
+    """
+    the path behind a file:// url or a plain path, None for remote urls;
+    only files below LOCAL_SOURCE_ROOTS are served
+    """
+    path = _url_path(url)
+    if path is None:
+        return None
+
+    real_path = os.path.realpath(os.path.expanduser(path))
+    if not _allowed(real_path):
+        raise Exception(f"local path outside of LOCAL_SOURCE_ROOTS: {path}")
+    if not os.path.isfile(real_path):
+        raise Exception(f"no such file: {path}")
+    return real_path
+
+
+def _reflink(src: str, dst: str):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def link_or_copy(src: str, dst: str):
+    """
+    make dst a private view of src that is only read: hard link, else
+    reflink (btrfs, xfs), else copy
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+"""
+Ingestion of every source package of a repo. The packages are streamed
+from the primary metadata listed in repodata/repomd.xml, a package whose
+name, version and sha256 were ingested before is skipped, the document
+of a changed package replaces the earlier one, of several versions of a
+package only the newest is ingested. The outcome of
+each package is written to the package state table as soon as it is
+known, a run stopped half way (a crash, the job lease ran out) resumes
+where it stopped.
+"""
+
+import itertools
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import NamedTuple
+from urllib.parse import urljoin
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.sdk import pgvector
+from infra_ai_service.service.concurrency import run_blocking
+from infra_ai_service.service.extract_spec import download_from_url
+from infra_ai_service.service.extract_xml import decompressed, iter_packages
+from infra_ai_service.service.feature_pipeline import (
+    check_xml_version,
+    error_message,
+    ingest_batch,
+    report_stage,
+)
+from infra_ai_service.service.workspace import workspace
+
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+
+LOAD_STATES_SQL = """
+SELECT name, version, sha256, status FROM {table} WHERE os_version = %s
+"""
+
+SAVE_STATE_SQL = """
+INSERT INTO {table}
+    (os_version, name, version, sha256, src_rpm_url, status, error)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (os_version, name) DO UPDATE
+SET version = EXCLUDED.version, sha256 = EXCLUDED.sha256,
+    src_rpm_url = EXCLUDED.src_rpm_url, status = EXCLUDED.status,
+    error = EXCLUDED.error, updated_at = now()
+"""
+
+
+class RepoPackage(NamedTuple):
+    src_rpm_url: str
+    package_name: str
+    version: str
+    sha256: str
+
+
+def _get_tag_name(tag: str):
+    return tag.split("}")[-1]
+
+
+def _child(elem: ET.Element, name: str):
+    for child in elem:
+        if _get_tag_name(child.tag) == name:
+            return child
+    return None
+
+
+def _sql(template: str):
+    return template.format(table=settings.REPO_STATE_TABLE_NAME)
+
+
+def load_package_states(os_version: str):
+    """name -> (version, sha256, status) of the packages seen before"""
+    with pgvector.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_sql(LOAD_STATES_SQL), (os_version,))
+            return {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+
+
+def save_package_state(
+    os_version: str, package: RepoPackage, status: str, error: str = None
+):
+    with pgvector.pool.connection() as conn:
+        conn.execute(
+            _sql(SAVE_STATE_SQL),
+            (
+                os_version,
+                package.package_name,
+                package.version,
+                package.sha256,
+                package.src_rpm_url,
+                status,
+                error,
+            ),
+        )
+
+
+def _repo_base(repo_url: str):
+    return repo_url.rstrip("/") + "/"
+
+
+def primary_location(repomd_path: str):
+    """href of the primary metadata in repomd.xml"""
+    root = ET.parse(repomd_path).getroot()
+    for data in root:
+        if _get_tag_name(data.tag) != "data" or data.get("type") != "primary":
+            continue
+        location = _child(data, "location")
+        if location is not None and location.get("href"):
+            return location.get("href")
+    raise Exception("no primary metadata in repomd.xml")
+
+
+def _version(elem: ET.Element):
+    version = f"{elem.get('ver', '')}-{elem.get('rel', '')}"
+    epoch = elem.get("epoch", "0")
+    return version if epoch in ("", "0") else f"{epoch}:{version}"
+
+
+def _segments(text: str):
+    # numeric segments sort after alphabetic ones
+    return [
+        (1, int(part), "") if part.isdigit() else (0, 0, part)
+        for part in re.findall(r"\d+|[a-zA-Z]+", text)
+    ]
+
+
+def _version_key(version: str):
+    """sort key of [epoch:]version-release, close to rpmvercmp"""
+    epoch, _, version = version.rpartition(":")
+    version, _, release = version.rpartition("-")
+    return int(epoch or 0), _segments(version), _segments(release)
+
+
+def _source_package(elem: ET.Element, repo_url: str):
+    fields = {_get_tag_name(child.tag): child for child in elem}
+    if fields.get("arch") is None or fields["arch"].text != "src":
+        return None
+
+    location = fields["location"]
+    base = _repo_base(location.get(XML_BASE) or repo_url)
+    checksum = fields.get("checksum")
+    sha256 = ""
+    if checksum is not None and checksum.get("type") == "sha256":
+        sha256 = (checksum.text or "").strip()
+    return RepoPackage(
+        src_rpm_url=urljoin(base, location.get("href")),
+        package_name=fields["name"].text.strip(),
+        version=_version(fields["version"]),
+        sha256=sha256,
+    )
+
+
+def iter_source_packages(primary_path: str, repo_url: str):
+    """source packages of the primary metadata, one at a time"""
+    with open(primary_path, "rb") as raw, decompressed(
+        raw, primary_path
+    ) as xml:
+        for elem in iter_packages(xml):
+            package = _source_package(elem, repo_url)
+            if package is not None:
+                yield package
+
+
+async def _download_primary(repo_url: str, work_dir: str):
+    repomd_path = os.path.join(work_dir, "repomd.xml")
+    await download_from_url(
+        urljoin(_repo_base(repo_url), "repodata/repomd.xml"), repomd_path
+    )
+    href = await run_blocking(primary_location, repomd_path)
+
+    # kept compressed on disk: the ingestion reads it over hours, too long
+    # to hold the connection open
+    primary_path = os.path.join(work_dir, os.path.basename(href))
+    await download_from_url(urljoin(_repo_base(repo_url), href), primary_path)
+    return primary_path
+
+
+def _newest_versions(batch, newest: dict, summary: dict):
+    """
+    the newest version of each package of the batch, newest holds the ones
+    of earlier batches; two versions would replace each other's document
+    """
+    latest = {}
+    for package in batch:
+        name = package.package_name
+        best = latest.get(name) or newest.get(name)
+        key = _version_key(package.version)
+        if best is not None and _version_key(best.version) >= key:
+            summary["skipped"] += 1
+            continue
+        if name in latest:
+            summary["skipped"] += 1
+        latest[name] = package
+    newest.update(latest)
+    return list(latest.values())
+
+
+async def _ingest_pending(pending, os_version: str, summary: dict):
+    packages = [package for package, _ in pending]
+    async for index, _, error in ingest_batch(
+        packages, os_version, replace=True
+    ):
+        package, outcome = pending[index]
+        if error is None:
+            summary[outcome] += 1
+            await run_blocking(save_package_state, os_version, package, "done")
+        else:
+            summary["failed"] += 1
+            await run_blocking(
+                save_package_state,
+                os_version,
+                package,
+                "failed",
+                error_message(error),
+            )
+
+
+async def ingest_repo(repo_url: str, os_version: str, report=None):
+    """
+    ingest the new and changed source packages of the repo, returns the
+    number of added, updated, skipped and failed packages
+    """
+    check_xml_version(os_version)
+
+    states = await run_blocking(load_package_states, os_version)
+    summary = {"added": 0, "updated": 0, "skipped": 0, "failed": 0}
+    async with workspace() as work_dir:
+        await report_stage(report, "metadata")
+        primary_path = await _download_primary(repo_url, work_dir)
+        packages = iter_source_packages(primary_path, repo_url)
+
+        batch_size = max(settings.REPO_INGEST_BATCH, 1)
+        newest = {}
+        while True:
+            # the metadata is parsed one batch at a time, off the loop
+            batch = await run_blocking(
+                lambda: list(itertools.islice(packages, batch_size))
+            )
+            if not batch:
+                break
+
+            pending = []
+            for package in _newest_versions(batch, newest, summary):
+                state = states.get(package.package_name)
+                if state == (package.version, package.sha256, "done"):
+                    summary["skipped"] += 1
+                else:
+                    # a package that never got in is not an update
+                    done = state is not None and state[2] == "done"
+                    outcome = "updated" if done else "added"
+                    pending.append((package, outcome))
+            if pending:
+                await _ingest_pending(pending, os_version, summary)
+            await report_stage(report, f"ingest {sum(summary.values())}")
+
+    logger.info(f"ingest repo {repo_url} finished: {summary}")
+    return summary
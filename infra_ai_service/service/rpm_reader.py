@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+"""
+Minimal in-process reader for src.rpm files: lead, signature header and
+main header are parsed only as far as needed to find the payload
+compressor, then the cpio (newc) payload is decompressed as a stream.
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import re
+import struct
+
+try:
+    import zstandard
+except ImportError:  # zstd payloads need the zstandard package
+    zstandard = None
+
+RPM_LEAD_MAGIC = b"\xed\xab\xee\xdb"
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+RPM_HEADER_INTRO = struct.Struct(">4s4xII")
+RPM_INDEX_ENTRY = struct.Struct(">iiii")
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPM_STRING_TYPE = 6
+
+CPIO_NEWC_MAGIC = (b"070701", b"070702")
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = "TRAILER!!!"
+
+COPY_CHUNK = 1024 * 1024
+
+# the members feature extraction needs from a src.rpm
+SOURCE_ARCHIVE_RE = re.compile(
+    r"\.(tar\.gz|tar\.bz2|tar\.xz|tar\.zst|zip|tgz)$"
+)
+
+
+def is_wanted_member(name: str):
+    return name.endswith(".spec") or bool(SOURCE_ARCHIVE_RE.search(name))
+
+
+def _read_exact(fp, size: int):
+    # decompressing readers may return short reads before the end
+    data = b""
+    while len(data) < size:
+        chunk = fp.read(size - len(data))
+        if not chunk:
+            raise ValueError("unexpected end of rpm file")
+        data += chunk
+    return data
+
+
+def _read_header(fp):
+    """return (index entries, data store) of one rpm header structure"""
+    magic, nindex, hsize = RPM_HEADER_INTRO.unpack(
+        _read_exact(fp, RPM_HEADER_INTRO.size)
+    )
+    if magic[:3] != RPM_HEADER_MAGIC[:3]:
+        raise ValueError("bad rpm header magic")
+
+    entries = [
+        RPM_INDEX_ENTRY.unpack(_read_exact(fp, RPM_INDEX_ENTRY.size))
+        for _ in range(nindex)
+    ]
+    return entries, _read_exact(fp, hsize)
+
+
+def _header_string(entries, store: bytes, tag: int):
+    for entry_tag, entry_type, offset, _ in entries:
+        if entry_tag == tag and entry_type == RPM_STRING_TYPE:
+            end = store.index(b"\0", offset)
+            return store[offset:end].decode()
+    return None
+
+
+def read_payload_compressor(fp):
+    """
+    Skip lead and signature, leave fp at the start of the payload and
+    return the compressor named in the main header.
+    """
+    lead = _read_exact(fp, RPM_LEAD_SIZE)
+    if lead[:4] != RPM_LEAD_MAGIC:
+        raise ValueError("not a rpm file")
+
+    entries, store = _read_header(fp)  # signature
+    sig_size = RPM_HEADER_INTRO.size + len(entries) * 16 + len(store)
+    _read_exact(fp, (8 - sig_size % 8) % 8)  # signature is 8 byte aligned
+
+    entries, store = _read_header(fp)
+    return _header_string(entries, store, RPMTAG_PAYLOADCOMPRESSOR) or "gzip"
+
+
+def open_payload(fp, compressor: str):
+    if compressor == "gzip":
+        return gzip.GzipFile(fileobj=fp)
+    if compressor in ("xz", "lzma"):
+        return lzma.LZMAFile(fp)
+    if compressor == "bzip2":
+        return bz2.BZ2File(fp)
+    if compressor == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd payload needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(fp)
+    raise ValueError(f"unsupported payload compressor: {compressor}")
+
+
+def _skip(fp, size: int):
+    while size > 0:
+        chunk = fp.read(min(size, COPY_CHUNK))
+        if not chunk:
+            raise ValueError("unexpected end of cpio payload")
+        size -= len(chunk)
+
+
+def _copy(fp, dst_path: str, size: int):
+    with open(dst_path, "wb") as dst:
+        while size > 0:
+            chunk = fp.read(min(size, COPY_CHUNK))
+            if not chunk:
+                raise ValueError("unexpected end of cpio payload")
+            dst.write(chunk)
+            size -= len(chunk)
+
+
+def iter_cpio_members(fp):
+    """
+    Yield (name, mode, size) for every newc member. The caller has to
+    consume exactly `size` bytes of fp before asking for the next one,
+    see extract_members.
+    """
+    while True:
+        header = _read_exact(fp, CPIO_HEADER_SIZE)
+        if header[:6] not in CPIO_NEWC_MAGIC:
+            raise ValueError(f"unsupported cpio format: {header[:6]}")
+
+        fields = [int(header[6 + i * 8 : 14 + i * 8], 16) for i in range(13)]
+        mode, size, name_size = fields[1], fields[6], fields[11]
+        name = _read_exact(fp, name_size)[:-1].decode()
+        _skip(fp, (4 - (CPIO_HEADER_SIZE + name_size) % 4) % 4)
+        if name == CPIO_TRAILER:
+            return
+
+        yield name, mode, size
+        _skip(fp, (4 - size % 4) % 4)
+
+
+def _wanted_name(name: str, mode: int, wanted):
+    # src.rpm payloads are flat, never trust directories
+    base_name = os.path.basename(name)
+    is_file = (mode & 0o170000) == 0o100000
+    return base_name if is_file and base_name and wanted(base_name) else ""
+
+
+def extract_members(
+    rpm_path: str, dst_dir: str, wanted=is_wanted_member, max_bytes: int = 0
+):
+    """
+    Write the wanted regular files of a src.rpm into dst_dir, everything
+    else is decompressed and dropped. Returns the extracted file names.
+    Fails before writing a member that would take the written bytes over
+    max_bytes (0 means unlimited).
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    extracted = []
+    written = 0
+    with open(rpm_path, "rb") as raw:
+        compressor = read_payload_compressor(raw)
+        with open_payload(raw, compressor) as payload:
+            for name, mode, size in iter_cpio_members(payload):
+                base_name = _wanted_name(name, mode, wanted)
+                if not base_name:
+                    _skip(payload, size)
+                    continue
+                written += size
+                if max_bytes and written > max_bytes:
+                    raise ValueError(f"members exceed {max_bytes} bytes")
+                _copy(payload, os.path.join(dst_dir, base_name), size)
+                extracted.append(base_name)
+    return extracted
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+"""
+Long lived worker processes for the extraction stages (src.rpm, tar,
+rpmspec and source scan). The workers are forked once and reused, each
+job runs under a wall-clock timeout and the memory and cpu limits of
+the settings. The pool is replaced after SANDBOX_MAX_JOBS jobs per
+worker, and rebuilt when a worker dies or hangs. The jobs that were
+running on the broken pool are run again, each on a worker of its own,
+so only the job to blame fails.
+"""
+
+import asyncio
+import os
+import resource
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service.concurrency import run_blocking
+
+# the parent waits that much longer than the job timeout before it kills
+# the workers, so the job gets the chance to fail cleanly first
+KILL_GRACE = 5
+
+_POOL = None
+_POOL_JOBS = 0
+
+# workers sharing the cpus with this process, 0 outside of a worker
+_SHARED_BY = 0
+
+
+class StageTimeout(Exception):
+    pass
+
+
+def init_worker(memory_mb: int, shared_by: int = 0):
+    """initializer of a worker process, shared_by workers use the cpus"""
+    global _SHARED_BY
+    _SHARED_BY = shared_by
+    # inherited by the rpmspec / tar children of the worker too
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def cpu_share():
+    """the cpus of this process, a worker gets its share of the pool's"""
+    cpus = os.cpu_count() or 1
+    return max(cpus // _SHARED_BY, 1) if _SHARED_BY else cpus
+
+
+def _on_alarm(signum, frame):
+    raise StageTimeout("stage timed out")
+
+
+def _limit_cpu(cpu_seconds: int):
+    # RLIMIT_CPU counts the whole life of the worker, not only this job
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_seconds
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def run_limited(func, args, timeout: float, cpu_seconds: int):
+    """runs in the worker; SIGXCPU kills it when cpu_seconds run out"""
+    if cpu_seconds:
+        _limit_cpu(cpu_seconds)
+    if timeout:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _new_pool(workers: int):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(settings.SANDBOX_MEMORY_MB, settings.SANDBOX_WORKERS),
+    )
+
+
+def _sandbox_pool():
+    global _POOL, _POOL_JOBS
+    max_jobs = settings.SANDBOX_WORKERS * settings.SANDBOX_MAX_JOBS
+    if _POOL is not None and max_jobs and _POOL_JOBS >= max_jobs:
+        # running jobs end on the old workers, then they exit
+        logger.info(f"recycle sandbox workers after {_POOL_JOBS} jobs")
+        _POOL.shutdown(wait=False)
+        _POOL = None
+    if _POOL is None:
+        _POOL, _POOL_JOBS = _new_pool(settings.SANDBOX_WORKERS), 0
+    _POOL_JOBS += 1
+    return _POOL
+
+
+def _kill_pool(pool):
+    global _POOL
+    if _POOL is pool:
+        _POOL = None
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False)
+
+
+def start_sandbox():
+    """fork the workers ahead of the first request"""
+    global _POOL, _POOL_JOBS
+    if settings.SANDBOX_WORKERS <= 0 or _POOL is not None:
+        return
+    _POOL, _POOL_JOBS = _new_pool(settings.SANDBOX_WORKERS), 0
+    for _ in range(settings.SANDBOX_WORKERS):
+        _POOL.submit(os.getpid)
+
+
+def stop_sandbox():
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+async def _run_on(pool, func, args, timeout: float):
+    wait_for = timeout + KILL_GRACE if timeout else None
+    try:
+        future = asyncio.wrap_future(
+            pool.submit(
+                run_limited, func, args, timeout, settings.SANDBOX_CPU_SECONDS
+            )
+        )
+        done, _ = await asyncio.wait({future}, timeout=wait_for)
+        if done:
+            return future.result()
+    except asyncio.CancelledError:
+        # the job is bounded by its timeout, let it end before cleanup
+        await asyncio.wait({future}, timeout=wait_for)
+        raise
+    except BrokenProcessPool:
+        _kill_pool(pool)
+        raise
+
+    logger.error(f"{func.__name__} hangs, kill its sandbox workers")
+    _kill_pool(pool)
+    raise StageTimeout(f"{func.__name__} timed out after {timeout}s")
+
+
+async def run_sandboxed(func, *args, timeout: float = 0):
+    """
+    Run func(*args) on a sandbox worker, func and args must be picklable.
+    With SANDBOX_WORKERS=0 it runs on the stage executor, unconfined.
+    """
+    if settings.SANDBOX_WORKERS <= 0:
+        return await run_blocking(func, *args)
+
+    try:
+        return await _run_on(_sandbox_pool(), func, args, timeout)
+    except BrokenProcessPool:
+        # any job of the shared pool may have broken it, a rerun on a
+        # worker of its own tells whether this one is to blame
+        logger.warning(f"sandbox pool broken, rerun {func.__name__} alone")
+
+    pool = _new_pool(1)
+    try:
+        return await _run_on(pool, func, args, timeout)
+    except BrokenProcessPool:
+        raise Exception(
+            f"{func.__name__} worker died, memory or cpu limit exceeded"
+        )
+    finally:
+        pool.shutdown(wait=False)
@@ -1,23 +1,82 @@
 # infraAIService/infra_ai_service/service/search_service.py
+import base64
+import json
+
 from loguru import logger
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 from infra_ai_service.model.model import (
+    BatchSearchInput,
+    BatchSearchItem,
+    BatchSearchOutput,
     SearchInput,
     SearchOutput,
     SearchResult,
 )
 from infra_ai_service.sdk import pgvector, ai_proxy
 
+# keyset pagination on (distance, id), the score threshold is pushed down
+# as a distance bound so every page is already filtered
+SEARCH_SQL = """
+    SELECT id, content, embedding <=> %(vec)s::vector AS distance, name
+    FROM documents
+    WHERE os_version=%(os_version)s
+      AND embedding <=> %(vec)s::vector <= %(max_distance)s
+      {keyset}
+    ORDER BY distance, id
+    LIMIT %(limit)s
+"""
+
+# one round trip for all queries: every vector gets its own top-k
+# subquery, rows come back grouped by the input position
+BATCH_SEARCH_SQL = """
+    SELECT q.ord, d.id, d.content, d.similarity, d.name
+    FROM unnest(%s::text[]) WITH ORDINALITY AS q(vec, ord)
+    CROSS JOIN LATERAL (
+        SELECT id, content, name,
+         1 - (embedding <=> q.vec::vector) AS similarity
+        FROM documents
+        WHERE os_version=%s
+        ORDER BY embedding <=> q.vec::vector
+        LIMIT %s
+    ) AS d
+    ORDER BY q.ord, d.similarity DESC
+"""
+
+# neighbours of an already stored vector, the first column tells apart
+# "source row missing" (no row at all) from "no neighbour" (NULL hit)
+SIMILAR_SEARCH_SQL = """
+    WITH src AS (
+        SELECT id, embedding, os_version
+        FROM documents
+        WHERE {source_filter}
+        ORDER BY id DESC
+        LIMIT 1
+    )
+    SELECT src.id, d.id, d.content, d.similarity, d.name
+    FROM src
+    LEFT JOIN LATERAL (
+        SELECT id, content, name,
+         1 - (embedding <=> src.embedding) AS similarity
+        FROM documents
+        WHERE os_version=COALESCE(%s::text, src.os_version)
+          AND id <> src.id
+        ORDER BY embedding <=> src.embedding
+        LIMIT %s
+    ) AS d ON true
+"""
+
 
 async def prepare_vector(input_data: SearchInput):
     try:
-        response = ai_proxy.embedding(input_data.query_text)
+        embeddings = await run_in_threadpool(
+            ai_proxy.embedding, input_data.query_text
+        )
         logger.info(
-            f"query text: {input_data.query_text} "
-            f"embedding: {response.embeddings}"
+            f"query text: {input_data.query_text} embedding: {embeddings}"
         )
-        return response.embeddings
+        return embeddings
     except Exception as e:
         logger.error(f"prepare vector failed: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -25,47 +84,229 @@ async def prepare_vector(input_data: SearchInput):
         )
 
 
+def encode_cursor(distance, doc_id):
+    raw = json.dumps([distance, doc_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        distance, doc_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return float(distance), int(doc_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid search cursor")
+
+
+def _search_query(input_data: SearchInput, embedding_vector_list):
+    params = {
+        "vec": embedding_vector_list,
+        "os_version": input_data.os_version,
+        "max_distance": 1 - input_data.score_threshold,
+        "limit": input_data.top_n,
+    }
+    keyset = ""
+    if input_data.cursor:
+        keyset = "AND (embedding <=> %(vec)s::vector, id) > (%(d)s, %(id)s)"
+        params["d"], params["id"] = decode_cursor(input_data.cursor)
+
+    return SEARCH_SQL.format(keyset=keyset), params
+
+
+def _row_to_result(row):
+    return SearchResult(
+        id=str(row[0]), score=1 - row[2], text=row[1], name=row[3]
+    )
+
+
+def iter_vector_search(input_data: SearchInput, embedding_vector_list):
+    """yield hits one by one straight from the server side row stream"""
+    sql, params = _search_query(input_data, embedding_vector_list)
+    with pgvector.pool.connection() as conn:
+        with conn.cursor() as cur:
+            for row in cur.stream(sql, params):
+                yield _row_to_result(row)
+
+
+def _vector_search(input_data: SearchInput, embedding_vector_list):
+    sql, params = _search_query(input_data, embedding_vector_list)
+    with pgvector.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+    next_cursor = None
+    # a full page means there may be more, continue after the last row
+    if rows and len(rows) == input_data.top_n:
+        next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+
+    return SearchOutput(
+        results=[_row_to_result(row) for row in rows],
+        next_cursor=next_cursor,
+    )
+
+
 async def perform_vector_search(input_data: SearchInput):
+    if input_data.cursor:
+        decode_cursor(input_data.cursor)  # fail fast before embedding
     embedding_vector_list = await prepare_vector(input_data)
 
     try:
+        return await run_in_threadpool(
+            _vector_search, input_data, embedding_vector_list
+        )
+    except Exception as e:
+        logger.error(f"pgvector query failed: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail=f"pgvector query failed: {str(e)}"
+        )
 
-        async with pgvector.pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    """
-                    SELECT id, content, embedding,
-                     1 - (embedding <=> %s::vector)
-                    AS similarity, name
-                    FROM documents
-                    WHERE os_version=%s
-                    ORDER BY similarity DESC
-                    LIMIT %s
-                    """,
-                    (
-                        embedding_vector_list,
-                        input_data.os_version,
-                        input_data.top_n,
-                    ),
-                )
-                rows = await cur.fetchall()
-
-        results = []
-        for row in rows:
-            similarity = row[3]
-            if similarity >= input_data.score_threshold:
-                results.append(
-                    SearchResult(
-                        id=str(row[0]),
-                        score=similarity,
-                        text=row[1],
-                        name=row[4],
+
+def _vector_literal(vector):
+    return "[" + ",".join(str(float(v)) for v in vector) + "]"
+
+
+async def prepare_vectors(queries):
+    if not queries:
+        return []
+    try:
+        return await run_in_threadpool(ai_proxy.embedding_batch, queries)
+    except Exception as e:
+        logger.error(f"prepare vectors failed: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail=f"prepare vectors failed: {str(e)}"
+        )
+
+
+def iter_batch_vector_search(input_data: BatchSearchInput, vectors):
+    """
+    Yield one BatchSearchItem per query in input order. Rows are streamed
+    from the server, so only one query's hits are held at a time.
+    """
+    if not input_data.queries:
+        return
+
+    params = (
+        [_vector_literal(v) for v in vectors],
+        input_data.os_version,
+        input_data.top_n,
+    )
+    index, results = 0, []
+    with pgvector.pool.connection() as conn:
+        with conn.cursor() as cur:
+            for row in cur.stream(BATCH_SEARCH_SQL, params):
+                ord_index = row[0] - 1
+                while index < ord_index:
+                    yield BatchSearchItem(
+                        index=index,
+                        query_text=input_data.queries[index],
+                        results=results,
                     )
-                )
+                    index, results = index + 1, []
+
+                similarity = row[3]
+                if similarity >= input_data.score_threshold:
+                    results.append(
+                        SearchResult(
+                            id=str(row[1]),
+                            score=similarity,
+                            text=row[2],
+                            name=row[4],
+                        )
+                    )
+
+    # queries without any hit still get their (empty) entry
+    while index < len(input_data.queries):
+        yield BatchSearchItem(
+            index=index,
+            query_text=input_data.queries[index],
+            results=results,
+        )
+        index, results = index + 1, []
+
+
+async def perform_batch_vector_search(input_data: BatchSearchInput):
+    vectors = await prepare_vectors(input_data.queries)
+    try:
+        items = await run_in_threadpool(
+            lambda: list(iter_batch_vector_search(input_data, vectors))
+        )
+        return BatchSearchOutput(results=items)
+    except Exception as e:
+        logger.error(f"pgvector batch query failed: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail=f"pgvector batch query failed: {str(e)}"
+        )
+
+
+def _similar_search(source_filter, source_params, target_os_version, top_n):
+    sql = SIMILAR_SEARCH_SQL.format(source_filter=source_filter)
+    with pgvector.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, (*source_params, target_os_version, top_n))
+            return cur.fetchall()
 
-        return SearchOutput(results=results)
+
+async def perform_similar_search(
+    source_filter,
+    source_params,
+    target_os_version=None,
+    top_n=5,
+    score_threshold=0.7,
+):
+    """
+    k-NN around the stored embedding of one document, no re-embedding.
+    target_os_version defaults to the version of the source document.
+    """
+    try:
+        rows = await run_in_threadpool(
+            _similar_search,
+            source_filter,
+            source_params,
+            target_os_version,
+            top_n,
+        )
     except Exception as e:
         logger.error(f"pgvector query failed: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500, detail=f"pgvector query failed: {str(e)}"
         )
+
+    if not rows:
+        raise HTTPException(
+            status_code=404,
+            detail=f"source package not found: {source_params}",
+        )
+
+    results = []
+    for row in rows:
+        similarity = row[3]
+        if row[1] is not None and similarity >= score_threshold:
+            results.append(
+                SearchResult(
+                    id=str(row[1]),
+                    score=similarity,
+                    text=row[2],
+                    name=row[4],
+                )
+            )
+    return SearchOutput(results=results)
+
+
+async def perform_similar_search_by_name(
+    name, os_version, target_os_version=None, top_n=5, score_threshold=0.7
+):
+    return await perform_similar_search(
+        "os_version=%s AND name=%s",
+        (os_version, name),
+        target_os_version,
+        top_n,
+        score_threshold,
+    )
+
+
+async def perform_similar_search_by_id(
+    doc_id, target_os_version=None, top_n=5, score_threshold=0.7
+):
+    return await perform_similar_search(
+        "id=%s", (doc_id,), target_os_version, top_n, score_threshold
+    )
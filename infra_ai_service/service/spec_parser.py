@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+Parser for the output of `rpmspec -P`: macros are expanded and
+conditionals resolved already, so only the preambles have to be read.
+One parse yields what `rpmspec -q`, `-q --provides`, `-q --buildrequires`
+and the Source0 grep used to give.
+"""
+
+import re
+
+TAG_RE = re.compile(r"^\s*([A-Za-z][A-Za-z0-9]*)(\([^)]*\))?\s*:\s*(.*)$")
+SECTION_RE = re.compile(r"^%([a-z_]+)\b\s*(.*)$")
+DEP_OPERATORS = ("<", ">", "<=", ">=", "=", "==")
+
+# %package starts a preamble, all other sections end it
+SECTIONS = {
+    "package",
+    "description",
+    "prep",
+    "generate_buildrequires",
+    "conf",
+    "build",
+    "install",
+    "check",
+    "clean",
+    "files",
+    "changelog",
+    "pre",
+    "post",
+    "preun",
+    "postun",
+    "pretrans",
+    "posttrans",
+    "preuntrans",
+    "postuntrans",
+    "verifyscript",
+    "triggerprein",
+    "triggerin",
+    "triggerun",
+    "triggerpostun",
+    "filetriggerin",
+    "filetriggerun",
+    "filetriggerpostun",
+    "transfiletriggerin",
+    "transfiletriggerun",
+    "transfiletriggerpostun",
+    "sourcelist",
+    "patchlist",
+}
+
+
+def _tokenize_deps(value: str):
+    tokens, depth, cur = [], 0, ""
+    for ch in value:
+        if depth == 0 and (ch.isspace() or ch == ","):
+            tokens.append(cur)
+            cur = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(ch, 0)
+        cur += ch
+    tokens.append(cur)
+    return [token for token in tokens if token]
+
+
+def _split_deps(value: str):
+    """
+    Split a dependency tag value like rpm does: entries are separated by
+    whitespace or commas, `name op version` stays one entry and rich
+    dependencies keep their parentheses.
+    """
+    tokens = _tokenize_deps(value)
+    deps, i = [], 0
+    while i < len(tokens):
+        if i + 2 < len(tokens) and tokens[i + 1] in DEP_OPERATORS:
+            deps.append(" ".join(tokens[i : i + 3]))
+            i += 3
+        else:
+            deps.append(tokens[i])
+            i += 1
+    return deps
+
+
+def _dep_name(dep: str):
+    return dep.split(" ")[0]
+
+
+def _sorted_deps(deps):
+    """rpm keeps dependency sets sorted by name and without duplicates"""
+    return sorted(set(deps), key=lambda d: (_dep_name(d), d))
+
+
+def _subpackage_name(args, main_name: str):
+    if args[:1] == ["-n"] and len(args) > 1:
+        return args[1]
+    return f"{main_name}-{args[0]}" if args else ""
+
+
+def _source_number(key: str):
+    """the N of a SourceN tag, "0" for Source, None for the other tags"""
+    if key == "source":
+        return "0"
+    if key.startswith("source") and key[6:].isdigit():
+        return str(int(key[6:]))
+    return None
+
+
+class _SpecReader:
+    """the preamble tags of every package, fed line by line"""
+
+    def __init__(self):
+        self.main = {"name": "", "provides": []}
+        self.packages = [self.main]
+        self.pkg = self.main
+        self.in_preamble = True
+        self.build_requires, self.sources = [], {}
+
+    def feed(self, line: str):
+        section = SECTION_RE.match(line)
+        if section and section.group(1) in SECTIONS:
+            self._section(section.group(1), section.group(2).split())
+            return
+
+        tag = TAG_RE.match(line) if self.in_preamble else None
+        if tag:
+            self._tag(tag.group(1).lower(), tag.group(3).strip())
+
+    def _section(self, section: str, args):
+        self.in_preamble = section == "package"
+        if self.in_preamble:
+            name = _subpackage_name(args, self.main["name"])
+            self.pkg = {"name": name, "provides": []}
+            self.packages.append(self.pkg)
+
+    def _tag(self, key: str, value: str):
+        number = _source_number(key)
+        if key == "name" and self.pkg is self.main:
+            self.main["name"] = value
+        elif key == "provides":
+            self.pkg["provides"].extend(_split_deps(value))
+        elif key == "buildrequires":
+            self.build_requires.extend(_split_deps(value))
+        elif number is not None:
+            self.sources.setdefault(number, value)
+
+    def result(self):
+        provides = []
+        for package in self.packages:
+            # every package provides itself
+            provides.extend(
+                _sorted_deps(package["provides"] + [package["name"]])
+            )
+
+        return {
+            "binaries": [p["name"] for p in self.packages],
+            "provides": provides,
+            "build_requires": _sorted_deps(self.build_requires),
+            "source0": self.sources.get("0", ""),
+        }
+
+
+def parse_spec(text: str):
+    reader = _SpecReader()
+    for line in text.splitlines():
+        reader.feed(line)
+    return reader.result()
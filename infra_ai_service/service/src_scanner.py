@@ -0,0 +1,452 @@
+#!/usr/bin/python3
+"""
+In-memory feature scanner for upstream sources, one pass runs all the
+feature patterns over every file (the former rg | sort | uniq -c
+pipelines of extract_spec). Results are the top names per feature, most
+frequent first.
+"""
+
+import contextlib
+import ctypes
+import fnmatch
+import heapq
+import mmap
+import multiprocessing
+import os
+import re
+import signal
+import stat
+import tarfile
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple, Tuple
+
+from loguru import logger
+
+try:
+    import zstandard
+except ImportError:  # .tar.zst sources need the zstandard package
+    zstandard = None
+
+TOP_K = 10
+READ_CHUNK = 1024 * 1024
+
+# files are handed to the scan workers in batches of this size
+SCAN_BATCH_FILES = 256
+SCAN_BATCH_BYTES = 32 * 1024 * 1024
+
+# shared by all scans of the process, created on first parallel scan
+_SCAN_POOL = None
+
+PR_SET_PDEATHSIG = 1
+
+
+def _unquote(name: bytes):
+    return name.replace(b'"', b"")
+
+
+def _rg_url(name: bytes):
+    """what extract_spec made of an rg url match, b"" was dropped"""
+    token = name.split(b" ")[0]
+    end = token.find(b'"', 1)
+    if end == len(token) - 1:
+        return _unquote(token)
+    return token[1:end] if end != -1 else b""
+
+
+# (feature key, pattern, fix up of the top matches); with a group only
+# the group is counted.
+# "rg" gives the documents of the former rg pipelines, bugs included: rg
+# read \{3,\} as literal braces, so class names hardly ever match, and a
+# url runs to the last quote of its line.
+# "fixed" matches what the patterns meant, the feature text of the same
+# package differs from the "rg" one.
+PATTERN_SETS = {
+    "rg": [
+        ("macro_names", re.compile(rb"\b[A-Z]+_[A-Z]+\b"), None),
+        # \> of rg: the end of a word, not any word boundary
+        (
+            "email_names",
+            re.compile(rb"\b[a-z]+@[a-z]+\.[a-z.]+(?<=\w)\b"),
+            None,
+        ),
+        (
+            "class_names",
+            re.compile(rb"[A-Z][a-z]\{3,\}[A-Z][a-z]\{3,\}"),
+            None,
+        ),
+        (
+            "path_names",
+            re.compile(rb'"/[A-Za-z.]+(?:/[A-Za-z.]+){2,}"'),
+            _unquote,
+        ),
+        (
+            "url_names",
+            re.compile(
+                rb'"(?:https?|ftp)://(?:[a-zA-Z0-9-]+.)+[a-zA-Z]{2,6}'
+                rb'(?:/.*)?"'
+            ),
+            _rg_url,
+        ),
+    ],
+    "fixed": [
+        ("macro_names", re.compile(rb"\b[A-Z]+_[A-Z]+\b"), None),
+        ("email_names", re.compile(rb"\b[a-z]+@[a-z]+\.[a-z.]+\b"), None),
+        ("class_names", re.compile(rb"[A-Z][a-z]{3,}[A-Z][a-z]{3,}"), None),
+        (
+            "path_names",
+            re.compile(rb'"(/[A-Za-z.]+(?:/[A-Za-z.]+){2,})"'),
+            None,
+        ),
+        (
+            "url_names",
+            re.compile(
+                rb'"((?:https?|ftp)://(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,6}'
+                rb'(?:/[^"\n]*)?)"'
+            ),
+            None,
+        ),
+    ],
+}
+FEATURE_KEYS = [key for key, _, _ in PATTERN_SETS["rg"]]
+
+# never opened, whatever the NUL probe would say
+BINARY_SUFFIXES = (
+    ".png", ".jpg", ".jpeg", ".gif", ".ico", ".bmp", ".webp", ".pdf",
+    ".gz", ".bz2", ".xz", ".zst", ".zip", ".jar", ".whl", ".7z",
+    ".so", ".a", ".o", ".dll", ".exe", ".class", ".pyc", ".wasm",
+    ".ttf", ".otf", ".woff", ".woff2", ".mo",
+)  # fmt: skip
+
+
+class ScanOptions(NamedTuple):
+    """
+    Filters and budgets of one scan. Globs match the path relative to
+    the source root (or the archive member name), `*` also matches `/`.
+    0 disables a limit.
+    """
+
+    include: Tuple[str, ...] = ()
+    exclude: Tuple[str, ...] = ()
+    max_file_size: int = 0  # bigger files are skipped
+    file_max_bytes: int = 0  # only the head of a file is scanned
+    byte_budget: int = 0  # total bytes scanned
+    time_budget: float = 0  # seconds
+    patterns: str = "rg"  # a key of PATTERN_SETS
+
+    def wants(self, rel_path: str, size: int):
+        if is_hidden(rel_path) or rel_path.lower().endswith(BINARY_SUFFIXES):
+            return False
+        if self.max_file_size and size > self.max_file_size:
+            return False
+        if self.include and not _match_any(rel_path, self.include):
+            return False
+        return not _match_any(rel_path, self.exclude)
+
+    def scan_size(self, size: int):
+        if self.file_max_bytes:
+            return min(size, self.file_max_bytes)
+        return size
+
+    def deadline(self):
+        return time.time() + self.time_budget if self.time_budget else 0
+
+
+def _match_any(path: str, patterns):
+    return any(fnmatch.fnmatchcase(path, p) for p in patterns)
+
+
+def is_hidden(path: str):
+    # rg skips hidden files and directories by default
+    return any(
+        part.startswith(".") and part not in (".", "..")
+        for part in path.split("/")
+    )
+
+
+class FeatureCounter:
+    """Counts every feature pattern over the text fed to it."""
+
+    def __init__(self, patterns: str = "rg"):
+        self.patterns = PATTERN_SETS[patterns]
+        self.counters = {key: Counter() for key in FEATURE_KEYS}
+        self.truncated = False
+
+    def feed(self, data: bytes):
+        for key, pattern, _ in self.patterns:
+            self.counters[key].update(pattern.findall(data))
+
+    def merge(self, counters: dict):
+        for key, counter in counters.items():
+            self.counters[key].update(counter)
+
+    def feed_file(self, path: str, max_bytes: int = 0):
+        """
+        Scan a file through mmap, the patterns run on the mapping without
+        copying it. Only the first max_bytes are scanned when it is set.
+        Binary files are handled like in feed_stream.
+        """
+        try:
+            with open(path, "rb") as fp:
+                size = os.fstat(fp.fileno()).st_size
+                if size == 0:
+                    return
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    end = min(size, max_bytes) if max_bytes else size
+                    self._feed_mapping(mm, end)
+        except (OSError, ValueError):
+            # unreadable files were dropped from the rg output as well
+            return
+
+    def _feed_mapping(self, mm, end: int):
+        nul = mm.find(b"\0", 0, end)
+        if nul != -1:
+            if nul < READ_CHUNK:
+                return
+            end = nul
+        for key, pattern, _ in self.patterns:
+            self.counters[key].update(pattern.findall(mm, 0, end))
+
+    def feed_stream(self, fp, max_bytes: int = 0):
+        """
+        Feed a file object chunk by chunk, cut on line ends because every
+        pattern is line bound. A NUL byte marks binary content: in the
+        first chunk the stream is skipped, later scanning stops there.
+        Returns the number of bytes read.
+        """
+        carry, first, total = b"", True, 0
+        while not max_bytes or total < max_bytes:
+            size = READ_CHUNK
+            if max_bytes:
+                size = min(size, max_bytes - total)
+            chunk = fp.read(size)
+            if not chunk:
+                break
+            total += len(chunk)
+            nul = chunk.find(b"\0")
+            if nul != -1:
+                if not first:
+                    self.feed(carry + chunk[:nul])
+                return total
+
+            first = False
+            data = carry + chunk
+            cut = data.rfind(b"\n") + 1
+            self.feed(data[:cut])
+            carry = data[cut:]
+        self.feed(carry)
+        return total
+
+    def top(self, k: int = TOP_K):
+        """
+        top names of every feature, ties ordered like `sort -nr`;
+        `scan_truncated` is set when a budget stopped the scan early
+        """
+        res = {}
+        for key, _, fix_up in self.patterns:
+            items = heapq.nlargest(
+                k, self.counters[key].items(), key=lambda kv: (kv[1], kv[0])
+            )
+            names = [name for name, _ in items]
+            if fix_up is not None:
+                names = [name for name in map(fix_up, names) if name]
+            res[key] = [name.decode("utf-8", "replace") for name in names]
+        if self.truncated:
+            res["scan_truncated"] = True
+        return res
+
+
+def _iter_tar_members(path: str):
+    with contextlib.ExitStack() as stack:
+        if path.endswith(".tar.zst"):
+            if zstandard is None:
+                raise ValueError(".tar.zst needs the zstandard package")
+            raw = stack.enter_context(open(path, "rb"))
+            reader = stack.enter_context(
+                zstandard.ZstdDecompressor().stream_reader(raw)
+            )
+            tar = tarfile.open(fileobj=reader, mode="r|")
+        else:
+            tar = tarfile.open(path, mode="r|*")
+
+        with tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, member.size, tar.extractfile(member)
+
+
+def _iter_zip_members(path: str):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                with archive.open(info) as fp:
+                    yield info.filename, info.file_size, fp
+
+
+def iter_archive_members(path: str):
+    """yield (name, size, file object) of the regular files of an archive"""
+    if path.endswith(".zip"):
+        return _iter_zip_members(path)
+    return _iter_tar_members(path)
+
+
+def scan_archive(path: str, k: int = TOP_K, options=ScanOptions()):
+    """scan an archive without unpacking it, nothing is written to disk"""
+    counter = FeatureCounter(options.patterns)
+    deadline, scanned = options.deadline(), 0
+    for name, size, fp in iter_archive_members(path):
+        if not options.wants(name, size):
+            continue
+        budget_hit = options.byte_budget and scanned >= options.byte_budget
+        if budget_hit or (deadline and time.time() > deadline):
+            counter.truncated = True
+            break
+        scanned += counter.feed_stream(fp, options.file_max_bytes)
+    return counter.top(k)
+
+
+def iter_source_files(src_path: str, options=ScanOptions()):
+    """
+    (path, size) of the regular, non hidden files below src_path that
+    pass the options filters, symlinks are not followed
+    """
+    for root, dirs, files in os.walk(src_path):
+        rel_root = os.path.relpath(root, src_path)
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if not d.startswith(".")
+            and not _match_any(f"{rel_root}{d}/", options.exclude)
+        )
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode) and options.wants(
+                rel_root + file, st.st_size
+            ):
+                yield path, st.st_size
+
+
+def _plan_batches(files, options: ScanOptions):
+    """split files in batches, stop at the byte budget"""
+    batches, batch, batch_bytes, total = [], [], 0, 0
+    truncated = False
+    for path, size in files:
+        size = options.scan_size(size)
+        if options.byte_budget and total + size > options.byte_budget:
+            truncated = True
+            break
+        total += size
+        batch.append(path)
+        batch_bytes += size
+        if len(batch) >= SCAN_BATCH_FILES or batch_bytes >= SCAN_BATCH_BYTES:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+    if batch:
+        batches.append(batch)
+    return batches, truncated
+
+
+def _scan_batch(
+    paths, max_bytes: int = 0, deadline: float = 0, patterns: str = "rg"
+):
+    counter = FeatureCounter(patterns)
+    for path in paths:
+        if deadline and time.time() > deadline:
+            counter.truncated = True
+            break
+        counter.feed_file(path, max_bytes)
+    return counter.counters, counter.truncated
+
+
+def _die_with_parent():
+    # a scan worker of a killed sandbox worker would wait for work forever
+    try:
+        ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    except (OSError, AttributeError):
+        pass
+
+
+def _new_scan_pool(workers: int):
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=_die_with_parent
+    )
+
+
+def _scan_pool(workers: int):
+    global _SCAN_POOL
+    if _SCAN_POOL is None:
+        _SCAN_POOL = _new_scan_pool(workers)
+    return _SCAN_POOL
+
+
+def _drop_scan_pool(pool):
+    global _SCAN_POOL
+    if _SCAN_POOL is pool:
+        _SCAN_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _scan_on(pool, batches, args):
+    futures = [pool.submit(_scan_batch, batch, *args) for batch in batches]
+    return [future.result() for future in as_completed(futures)]
+
+
+def _scan_parallel(batches, args, workers: int):
+    if multiprocessing.parent_process() is not None:
+        # a pool kept by a sandbox or cli worker would hold its exit, the
+        # worker waits for the children of its pools
+        pool = _new_scan_pool(workers)
+        try:
+            return _scan_on(pool, batches, args)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    pool = _scan_pool(workers)
+    try:
+        return _scan_on(pool, batches, args)
+    except BrokenProcessPool:
+        # a dead worker breaks the pool for good, never reuse it
+        _drop_scan_pool(pool)
+        raise
+
+
+def _scan_batches(batches, args, workers: int):
+    if workers <= 1 or len(batches) <= 1:
+        return [_scan_batch(batch, *args) for batch in batches]
+    try:
+        return _scan_parallel(batches, args, workers)
+    except BrokenProcessPool:
+        # a worker may have been killed while idle, once more on a new pool
+        logger.warning("scan pool broken, scanning on a new pool")
+    try:
+        return _scan_parallel(batches, args, workers)
+    except BrokenProcessPool as e:
+        raise Exception(f"scan worker died: {e}")
+
+
+def scan_dir(
+    src_path: str, k: int = TOP_K, workers: int = 1, options=ScanOptions()
+):
+    """
+    Scan a source tree. With several workers the files are split in
+    batches over a process pool and the per-batch counters are merged.
+    When the byte or time budget runs out the partial counts are
+    returned, flagged with `scan_truncated`.
+    """
+    counter = FeatureCounter(options.patterns)
+    batches, counter.truncated = _plan_batches(
+        iter_source_files(src_path, options), options
+    )
+    args = (options.file_max_bytes, options.deadline(), options.patterns)
+    for counters, truncated in _scan_batches(batches, args, workers):
+        counter.merge(counters)
+        counter.truncated = counter.truncated or truncated
+    return counter.top(k)
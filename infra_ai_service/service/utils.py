@@ -50,11 +50,34 @@ def update_json(j_xml: dict, j_spec: dict):
     return j_spec
 
 
+def update_json_indexed(xml_index, j_spec: dict):
+    """
+    update_json with the xml packages indexed by name (see XmlIndex), one
+    lookup and a copy of the matching record instead of a scan
+    """
+    if not xml_index:
+        return j_spec
+
+    spec_info = j_spec[1]
+    spec_name = _get_and_check_name(spec_info)
+    xml_info = xml_index.copy_record(spec_name) if spec_name != "" else None
+    if xml_info is not None:
+        j_spec[1] = _update_json(xml_info, spec_info)
+
+    return j_spec
+
+
 def write_json(file, data):
     with open(file, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4)
 
 
+def to_ndjson(items):
+    """serialize pydantic models as newline delimited json"""
+    for item in items:
+        yield item.json() + "\n"
+
+
 def convert_to_str(data: dict):
     ordered_keys = [
         "name",
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+import asyncio
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service.concurrency import run_blocking
+
+# created lazily, it has to live on the loop of the running server
+_INGEST_SLOTS = None
+_STAGE_SLOTS = {}
+
+# how often an extraction is measured against the quota
+QUOTA_POLL_INTERVAL = 0.2
+
+
+def workspace_root():
+    # WORKSPACE_DIR may point to a tmpfs mount such as /dev/shm
+    return os.path.expanduser(settings.WORKSPACE_DIR or settings.SRC_RPM_DIR)
+
+
+def quota_bytes():
+    return settings.WORKSPACE_QUOTA_MB * 1024 * 1024
+
+
+def disk_usage(path: str):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _quota_exceeded():
+    return Exception(
+        f"workspace quota exceeded: {settings.WORKSPACE_QUOTA_MB}MB"
+    )
+
+
+def check_quota(path: str):
+    limit = quota_bytes()
+    if limit and disk_usage(path) > limit:
+        raise _quota_exceeded()
+
+
+def remaining_quota(path: str):
+    """bytes the workspace path may still grow by, 0 when unlimited"""
+    limit = quota_bytes()
+    if not limit:
+        return 0
+    used = disk_usage(path)
+    if used >= limit:
+        raise _quota_exceeded()
+    return limit - used
+
+
+def _limit_file_size(pid: int, max_bytes: int):
+    # a single file can not outgrow the quota even between two polls
+    try:
+        resource.prlimit(pid, resource.RLIMIT_FSIZE, (max_bytes, max_bytes))
+    except (AttributeError, OSError):
+        pass
+
+
+def _wait_within(proc, path: str, max_bytes: int, timeout: float):
+    deadline = time.monotonic() + timeout if timeout else 0
+    while True:
+        try:
+            return proc.wait(QUOTA_POLL_INTERVAL)
+        except subprocess.TimeoutExpired:
+            pass
+        if max_bytes and disk_usage(path) > max_bytes:
+            raise _quota_exceeded()
+        if deadline and time.monotonic() > deadline:
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+
+
+def run_within_quota(cmd, path: str, max_bytes: int, timeout: float = 0):
+    """
+    Run the argv cmd and return its exit code. It is killed as soon as what it
+    wrote under path exceeds max_bytes (0 means unlimited) or timeout
+    runs out, not after the whole archive is on disk.
+    """
+    proc = subprocess.Popen(cmd)
+    try:
+        if max_bytes:
+            _limit_file_size(proc.pid, max_bytes)
+        returncode = _wait_within(proc, path, max_bytes, timeout)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    # killed by RLIMIT_FSIZE
+    if returncode == -signal.SIGXFSZ:
+        raise _quota_exceeded()
+    return returncode
+
+
+@asynccontextmanager
+async def workspace():
+    """
+    A private directory for one feature-insert request, removed on exit
+    whatever happens inside.
+    """
+    root = workspace_root()
+    os.makedirs(root, exist_ok=True)
+
+    limit = quota_bytes()
+    if limit and shutil.disk_usage(root).free < limit:
+        raise Exception(f"not enough free space in {root} for a workspace")
+
+    path = tempfile.mkdtemp(prefix="feature-", dir=root)
+    logger.info(f"workspace created: {path}")
+    try:
+        yield path
+    finally:
+        await run_blocking(shutil.rmtree, path, True)
+        logger.info(f"workspace removed: {path}")
+
+
+def _ingest_slots():
+    global _INGEST_SLOTS
+    if _INGEST_SLOTS is None:
+        _INGEST_SLOTS = asyncio.Semaphore(max(settings.INGEST_CONCURRENCY, 1))
+    return _INGEST_SLOTS
+
+
+@asynccontextmanager
+async def ingest_slot():
+    """bound the number of ingestions running at the same time"""
+    async with _ingest_slots():
+        yield
+
+
+def _stage_limit(stage: str):
+    return {
+        "download": settings.INGEST_DOWNLOAD_CONCURRENCY,
+        "extract": settings.INGEST_EXTRACT_CONCURRENCY,
+        "embed": settings.INGEST_EMBED_CONCURRENCY,
+    }[stage]
+
+
+@asynccontextmanager
+async def stage_slot(stage: str):
+    """
+    bound one pipeline stage over all ingestions, so the stages of
+    different packages overlap while none of them is overloaded
+    """
+    if stage not in _STAGE_SLOTS:
+        _STAGE_SLOTS[stage] = asyncio.Semaphore(max(_stage_limit(stage), 1))
+    async with _STAGE_SLOTS[stage]:
+        yield
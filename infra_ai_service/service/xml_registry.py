@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+"""
+The xml metadata of every configured os_version. An ingestion only looks
+up the entry of its own os_version, so several releases are ingested at
+once, and configuring, refreshing or evicting one leaves the others alone.
+"""
+
+import os
+import sys
+from collections.abc import Mapping
+from datetime import datetime
+from typing import NamedTuple
+
+from loguru import logger
+
+from infra_ai_service.service import xml_snapshot
+from infra_ai_service.service.xml_snapshot import SnapshotIndex
+
+# os_version -> XmlEntry, an entry is replaced as a whole, never changed
+_ENTRIES = {}
+
+
+class XmlEntry(NamedTuple):
+    xml_info: Mapping
+    xml_url: str
+    loaded_at: datetime
+    # estimated, the records of a snapshot stay on disk
+    memory_bytes: int
+
+
+def _children(obj):
+    if isinstance(obj, Mapping):
+        return [item for pair in obj.items() for item in pair]
+    if isinstance(obj, (list, tuple)):
+        return obj
+    return ()
+
+
+def _deep_sizeof(obj, seen: set):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, Mapping) and not isinstance(obj, dict):
+        # a proxy (XmlIndex, frozen record) is small, count its dict
+        size += sys.getsizeof(dict(obj))
+    return size + sum(_deep_sizeof(child, seen) for child in _children(obj))
+
+
+def memory_bytes(xml_info):
+    if isinstance(xml_info, SnapshotIndex):
+        return _deep_sizeof(xml_info.meta, set())
+    return _deep_sizeof(xml_info, set())
+
+
+def total_memory_bytes():
+    return sum(entry.memory_bytes for entry in list(_ENTRIES.values()))
+
+
+def _close(entry, keep=None):
+    # a snapshot holds an open sqlite connection
+    if entry is None or entry.xml_info is keep:
+        return
+    if isinstance(entry.xml_info, SnapshotIndex):
+        entry.xml_info.close()
+
+
+def register(xml_info, xml_url: str = ""):
+    """make xml_info the metadata of its os_version, blocking"""
+    entry = XmlEntry(xml_info, xml_url, datetime.now(), memory_bytes(xml_info))
+    _close(_ENTRIES.get(xml_info.os_version), keep=xml_info)
+    _ENTRIES[xml_info.os_version] = entry
+    logger.info(
+        f"xml of {xml_info.os_version} registered: {len(xml_info)} packages, "
+        f"{entry.memory_bytes} bytes, {total_memory_bytes()} bytes "
+        f"for {len(_ENTRIES)} os_version"
+    )
+    return entry
+
+
+def get_entry(os_version: str):
+    return _ENTRIES.get(os_version)
+
+
+def get(os_version: str):
+    """the xml metadata of os_version, raises when it is not configured"""
+    entry = _ENTRIES.get(os_version)
+    if entry is None:
+        raise Exception(
+            f"xml of os_version[{os_version}] not configured, "
+            "need config xml with API '/feature-insert/xml/'"
+        )
+    return entry.xml_info
+
+
+def evict(os_version: str):
+    """forget os_version and its snapshot, False if it was not configured"""
+    entry = _ENTRIES.pop(os_version, None)
+    _close(entry)
+    if xml_snapshot.enabled():
+        xml_snapshot.remove(os_version)
+    if entry is None:
+        return False
+    logger.info(f"xml of {os_version} evicted")
+    return True
+
+
+def describe(entry: XmlEntry):
+    xml_info = entry.xml_info
+    snapshot = isinstance(xml_info, SnapshotIndex)
+    return {
+        "os_version": xml_info.os_version,
+        "xml_url": entry.xml_url,
+        "packages": len(xml_info),
+        "storage": "snapshot" if snapshot else "memory",
+        "memory_bytes": entry.memory_bytes,
+        "disk_bytes": os.path.getsize(xml_info.path) if snapshot else 0,
+        "loaded_at": entry.loaded_at.isoformat(),
+    }
+
+
+def list_entries():
+    """describe every configured os_version, blocking"""
+    return [describe(entry) for _, entry in sorted(_ENTRIES.items())]
+
+
+def load_snapshots():
+    """reopen the xml of every os_version configured before the restart"""
+    for snapshot in xml_snapshot.open_all():
+        register(snapshot, snapshot.meta.get("xml_url", ""))
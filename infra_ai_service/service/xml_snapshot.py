@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+"""
+On-disk snapshots of the parsed xml, one SQLite file per os_version in
+XML_SNAPSHOT_DIR. Configuring an xml whose source did not change (same
+ETag / Last-Modified, or the same size and mtime for a local file) opens
+the snapshot instead of parsing again, and a restarted server reopens
+every snapshot: the records are read from the file when a merge asks for
+them. These validators are the only freshness check, the content of the
+xml is not hashed: that would mean downloading it every time.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import urllib.parse
+from collections.abc import Mapping
+
+from loguru import logger
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import downloader
+from infra_ai_service.service.extract_xml import _freeze
+from infra_ai_service.service.local_source import local_path
+
+SNAPSHOT_FORMAT = "1"
+SNAPSHOT_SUFFIX = ".sqlite"
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE packages (name TEXT PRIMARY KEY, record TEXT NOT NULL);
+"""
+
+
+def enabled():
+    return bool(settings.XML_SNAPSHOT_DIR)
+
+
+def _snapshot_dir():
+    return os.path.expanduser(settings.XML_SNAPSHOT_DIR)
+
+
+def snapshot_path(os_version: str):
+    name = os_version
+    if not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9._-]*", name):
+        name = "os-" + hashlib.sha256(os_version.encode()).hexdigest()[:16]
+    return os.path.join(_snapshot_dir(), name + SNAPSHOT_SUFFIX)
+
+
+class SnapshotIndex(Mapping):
+    """
+    XmlIndex read from a snapshot file, only the meta data is loaded when
+    it is opened; one read only connection shared by the threads
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.meta = dict(self._query("SELECT key, value FROM meta"))
+        if self.meta.get("format") != SNAPSHOT_FORMAT:
+            raise Exception(f"unknown xml snapshot format: {path}")
+        self.os_version = self.meta["os_version"]
+        self.source = json.loads(self.meta["source"])
+
+    def _query(self, sql: str, params=()):
+        with self._lock:
+            if self._conn is None:
+                uri = f"file:{urllib.parse.quote(self.path)}?mode=ro"
+                self._conn = sqlite3.connect(
+                    uri, uri=True, check_same_thread=False
+                )
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        """a request still reading the index reconnects, the gc closes it"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _record(self, name: str):
+        rows = self._query(
+            "SELECT record FROM packages WHERE name = ?", (name,)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def __getitem__(self, name):
+        record = self._record(name)
+        if record is None:
+            raise KeyError(name)
+        return _freeze(record)
+
+    def __iter__(self):
+        rows = self._query("SELECT name FROM packages ORDER BY rowid")
+        return (row[0] for row in rows)
+
+    def __len__(self):
+        return self._query("SELECT count(*) FROM packages")[0][0]
+
+    def copy_record(self, name: str):
+        return self._record(name)
+
+
+def source_validators(xml_url: str):
+    """what tells whether the xml changed, None when nothing does"""
+    src_path = local_path(xml_url)
+    if src_path:
+        st = os.stat(src_path)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    probe = downloader.probe_url(xml_url)
+    if not probe or not (probe["etag"] or probe["last_modified"]):
+        return None
+    return {"etag": probe["etag"], "last_modified": probe["last_modified"]}
+
+
+def _open(path: str):
+    try:
+        return SnapshotIndex(path)
+    except Exception as e:
+        logger.warning(f"xml snapshot {path} unusable: {e}")
+        return None
+
+
+def open_valid(xml_url: str, os_version: str, validators):
+    """the snapshot of os_version when it was built from the same source"""
+    path = snapshot_path(os_version)
+    if validators is None or not os.path.exists(path):
+        return None
+    snapshot = _open(path)
+    if snapshot is None:
+        return None
+    valid = snapshot.meta.get("xml_url") == xml_url
+    if not valid or snapshot.source != validators:
+        snapshot.close()
+        return None
+    return snapshot
+
+
+def write(xml_index, xml_url: str, validators):
+    """store xml_index as the snapshot of its os_version"""
+    path = snapshot_path(xml_index.os_version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [
+                    ("format", SNAPSHOT_FORMAT),
+                    ("os_version", xml_index.os_version),
+                    ("xml_url", xml_url),
+                    ("source", json.dumps(validators)),
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO packages VALUES (?, ?)",
+                (
+                    (name, json.dumps(dict(record)))
+                    for name, record in xml_index.items()
+                ),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    logger.info(f"xml snapshot written: {path}")
+
+
+def remove(os_version: str):
+    """drop the snapshot of os_version, True if there was one"""
+    try:
+        os.remove(snapshot_path(os_version))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def open_all():
+    """every usable snapshot, to reopen what was configured before"""
+    if not enabled() or not os.path.isdir(_snapshot_dir()):
+        return []
+    snapshots = []
+    for file in sorted(os.listdir(_snapshot_dir())):
+        if file.endswith(SNAPSHOT_SUFFIX):
+            snapshot = _open(os.path.join(_snapshot_dir(), file))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    return snapshots
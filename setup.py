@@ -6,4 +6,9 @@ setup(
     version="0.1",
     packages=find_packages(),
     install_requires=[],
+    entry_points={
+        "console_scripts": [
+            "infra-ai-extract = infra_ai_service.cli:main",
+        ],
+    },
 )
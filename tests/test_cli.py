@@ -0,0 +1,195 @@
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import zstandard
+
+import infra_ai_service.service.extract_spec as es
+from infra_ai_service import cli
+from infra_ai_service.config.config import settings
+from infra_ai_service.service.spec_parser import parse_spec
+from tests.test_rpm_reader import build_src_rpm
+
+SPEC = """Name: {name}
+Version: 1.0
+BuildRequires: gcc
+Source0: {name}-1.0.tar.gz
+"""
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common"
+    xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="1">
+  <package type="rpm">
+    <name>bunch</name>
+    <version epoch="0" ver="1.0.1" rel="3.oe2403"/>
+    <url>https://bunch.example.com</url>
+    <format>
+      <rpm:requires>
+        <rpm:entry name="python3"/>
+      </rpm:requires>
+    </format>
+  </package>
+</metadata>
+"""
+
+
+def _rpmspec_parse(abs_path, dir_path):
+    # no rpmspec on the test host, the specs have no macros
+    with open(abs_path) as f:
+        return parse_spec(f.read())
+
+
+def _rpmspec_parse_or_crash(abs_path, dir_path):
+    if os.path.basename(abs_path) == "bad.spec":
+        os._exit(1)
+    # apple is still running when bad kills the other worker
+    time.sleep(0.5)
+    return _rpmspec_parse(abs_path, dir_path)
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.rpm_dir = os.path.join(self.tmp_dir, "rpms")
+        os.makedirs(self.rpm_dir)
+        for name in ("fish", "bunch", "apple"):
+            spec = SPEC.format(name=name).encode()
+            build_src_rpm(
+                os.path.join(self.rpm_dir, f"{name}-1.0-1.src.rpm"),
+                [(f"{name}.spec", spec)],
+            )
+        with open(os.path.join(self.rpm_dir, "broken.src.rpm"), "w") as f:
+            f.write("not a src.rpm\n")
+
+        self.xml_path = os.path.join(self.tmp_dir, "primary.xml.zst")
+        with open(self.xml_path, "wb") as f:
+            f.write(zstandard.ZstdCompressor().compress(PRIMARY.encode()))
+
+        # the workers are forked, they see the patches
+        patchers = [
+            patch.object(es, "_rpmspec_parse", side_effect=_rpmspec_parse),
+            patch.multiple(
+                settings,
+                SRC_SCAN_MODE="archive",
+                WORKSPACE_DIR=os.path.join(self.tmp_dir, "work"),
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _run(self, *argv):
+        out = io.StringIO()
+        failed = cli.run(cli.parse_args(list(argv)), out)
+        return failed, [
+            json.loads(line) for line in out.getvalue().splitlines()
+        ]
+
+    def test_ordered_jsonl(self):
+        failed, results = self._run(
+            "--xml", self.xml_path, "-j", "2", self.rpm_dir
+        )
+        self.assertEqual(failed, 1)
+        self.assertEqual(
+            [os.path.basename(r["src_rpm_url"]) for r in results],
+            [
+                "apple-1.0-1.src.rpm",
+                "broken.src.rpm",
+                "bunch-1.0-1.src.rpm",
+                "fish-1.0-1.src.rpm",
+            ],
+        )
+        self.assertEqual([r["index"] for r in results], [0, 1, 2, 3])
+        self.assertEqual(results[1]["status"], "error")
+        self.assertIn("decompress src.rpm fail", results[1]["message"])
+
+        bunch = json.loads(results[2]["insert_content"])
+        self.assertEqual(bunch["name"], "bunch")
+        self.assertEqual(bunch["version"], "1.0")
+        self.assertEqual(bunch["url"], "https://bunch.example.com")
+        self.assertEqual(bunch["requires"], ["python3"])
+        self.assertEqual(bunch["buildRequires"], ["gcc"])
+        # no xml package for fish
+        self.assertNotIn("url", json.loads(results[3]["insert_content"]))
+
+    def test_embed_in_batches(self):
+        batches = []
+        with patch.object(
+            cli,
+            "create_embeddings",
+            side_effect=lambda contents, os_version, names: batches.append(
+                (os_version, names)
+            )
+            or len(names),
+        ), patch.object(cli.pgvector, "setup_model_and_pool"), patch.object(
+            cli.pgvector, "close_pool"
+        ):
+            failed, _ = self._run(
+                "--embed",
+                "--os-version",
+                "openEuler-24.03",
+                "--batch-size",
+                "2",
+                self.rpm_dir,
+            )
+        self.assertEqual(failed, 1)
+        self.assertEqual(
+            batches,
+            [
+                ("openEuler-24.03", ["apple", "bunch"]),
+                ("openEuler-24.03", ["fish"]),
+            ],
+        )
+
+    def test_embed_needs_os_version(self):
+        with self.assertRaises(SystemExit), patch("sys.stderr"):
+            cli.parse_args(["--embed", self.rpm_dir])
+
+    def test_dead_worker_fails_only_its_src_rpm(self):
+        build_src_rpm(
+            os.path.join(self.rpm_dir, "bad-1.0-1.src.rpm"),
+            [("bad.spec", SPEC.format(name="bad").encode())],
+        )
+        with patch.object(
+            es, "_rpmspec_parse", side_effect=_rpmspec_parse_or_crash
+        ):
+            failed, results = self._run("-j", "2", self.rpm_dir)
+        self.assertEqual(failed, 2)
+        errors = {
+            os.path.basename(r["src_rpm_url"]): r["message"]
+            for r in results
+            if r["status"] == "error"
+        }
+        self.assertEqual(
+            sorted(errors), ["bad-1.0-1.src.rpm", "broken.src.rpm"]
+        )
+        self.assertIn("worker died", errors["bad-1.0-1.src.rpm"])
+
+    def test_only_started_jobs_rerun_alone(self):
+        build_src_rpm(
+            os.path.join(self.rpm_dir, "bad-1.0-1.src.rpm"),
+            [("bad.spec", SPEC.format(name="bad").encode())],
+        )
+        rerun_alone = cli._Extractor._rerun_alone
+        with patch.object(
+            es, "_rpmspec_parse", side_effect=_rpmspec_parse_or_crash
+        ), patch.object(
+            cli._Extractor,
+            "_rerun_alone",
+            autospec=True,
+            side_effect=rerun_alone,
+        ) as spy:
+            failed, results = self._run("-j", "1", self.rpm_dir)
+        self.assertEqual(failed, 2)
+        self.assertEqual(len(results), 5)
+        # the queued jobs went to the new worker, only bad ran alone
+        self.assertEqual(
+            [os.path.basename(c.args[2]) for c in spy.call_args_list],
+            ["bad-1.0-1.src.rpm"],
+        )
@@ -0,0 +1,150 @@
+import functools
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import download_cache
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    statuses = []
+
+    def log_request(self, code="-", size="-"):
+        self.statuses.append(int(code))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.serve_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.out_dir = tempfile.TemporaryDirectory()
+        for tmp_dir in (self.serve_dir, self.cache_dir, self.out_dir):
+            self.addCleanup(tmp_dir.cleanup)
+
+        _Handler.statuses = []
+        handler = functools.partial(_Handler, directory=self.serve_dir.name)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        patcher = patch.multiple(
+            settings,
+            DOWNLOAD_CACHE_DIR=self.cache_dir.name,
+            DOWNLOAD_CACHE_MB=1,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _serve(self, name, data):
+        with open(os.path.join(self.serve_dir.name, name), "wb") as f:
+            f.write(data)
+        return f"http://127.0.0.1:{self.server.server_port}/{name}"
+
+    def _fetch(self, url, name="out"):
+        dst = os.path.join(self.out_dir.name, name)
+        meta = download_cache.fetch(url, dst)
+        with open(dst, "rb") as f:
+            return f.read(), meta
+
+    def test_revalidated_not_downloaded_again(self):
+        url = self._serve("a.src.rpm", b"rpm content")
+        data, meta = self._fetch(url)
+        self.assertEqual(data, b"rpm content")
+        self.assertEqual(meta["size"], 11)
+
+        self.assertEqual(self._fetch(url)[0], b"rpm content")
+        # probe and download, then one conditional request
+        self.assertEqual(_Handler.statuses, [200, 200, 304])
+
+        # a changed file on the mirror is fetched again
+        self._serve("a.src.rpm", b"rebuilt rpm")
+        path = os.path.join(self.serve_dir.name, "a.src.rpm")
+        os.utime(path, (2e9, 2e9))
+        self.assertEqual(self._fetch(url)[0], b"rebuilt rpm")
+        self.assertEqual(_Handler.statuses[-1], 200)
+
+    def test_concurrent_downloads_share_one_fetch(self):
+        url = self._serve("b.src.rpm", b"b" * 1000)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(
+                pool.map(lambda i: self._fetch(url, f"out{i}")[0], range(4))
+            )
+        self.assertEqual(results, [b"b" * 1000] * 4)
+        # one probe and one download, the others revalidate
+        self.assertEqual(_Handler.statuses.count(200), 2)
+        self.assertEqual(_Handler.statuses.count(304), 3)
+
+    def test_lru_eviction(self):
+        urls = [
+            self._serve(f"{i}.src.rpm", bytes([i]) * 400 * 1024)
+            for i in range(3)
+        ]
+        for url in urls:
+            self._fetch(url)
+
+        cached = [
+            os.path.exists(download_cache._entry_path(url)) for url in urls
+        ]
+        self.assertEqual(cached, [False, True, True])
+
+    def test_stale_partials_evicted(self):
+        stale = self._serve("stale.src.rpm", b"s" * 10)
+        path = download_cache._entry_path(stale)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            f.write(b"s" * 900 * 1024)
+        with open(path + ".part.json", "w") as f:
+            f.write("{}")
+        os.utime(path + ".part", (0, 0))
+        os.utime(path + ".part.json", (0, 0))
+
+        self._fetch(self._serve("new.src.rpm", b"n" * 400 * 1024))
+        self.assertFalse(os.path.exists(path + ".part"))
+        self.assertFalse(os.path.exists(path + ".part.json"))
+
+    def test_max_bytes(self):
+        url = self._serve("c.src.rpm", b"c" * 100)
+        with self.assertRaises(Exception) as context:
+            download_cache.fetch(url, os.path.join(self.out_dir.name, "c"), 10)
+        self.assertIn("larger than 10 bytes", str(context.exception))
+        self.assertFalse(os.path.exists(download_cache._entry_path(url)))
+
+    def _read_stream(self, url):
+        with download_cache.open_stream(url) as f:
+            return f.read(4) + f.read()
+
+    def test_open_stream_fills_the_cache(self):
+        url = self._serve("primary.xml.zst", b"x" * 5000)
+        self.assertEqual(self._read_stream(url), b"x" * 5000)
+        path = download_cache._entry_path(url)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"x" * 5000)
+        self.assertEqual(download_cache._read_meta(path)["size"], 5000)
+
+        # read from the cache after a conditional GET
+        self.assertEqual(self._read_stream(url), b"x" * 5000)
+        self.assertEqual(_Handler.statuses, [200, 304])
+
+    def test_open_stream_partly_read(self):
+        url = self._serve("primary.xml.gz", b"y" * 5000)
+        with download_cache.open_stream(url) as f:
+            self.assertEqual(f.read(10), b"y" * 10)
+        # the rest was read for the cache
+        with open(download_cache._entry_path(url), "rb") as f:
+            self.assertEqual(f.read(), b"y" * 5000)
+
+        # a reader failing half way leaves nothing in the cache
+        bad_url = self._serve("bad.xml.gz", b"z" * 100)
+        with self.assertRaises(ValueError):
+            with download_cache.open_stream(bad_url):
+                raise ValueError("not xml")
+        self.assertFalse(os.path.exists(download_cache._entry_path(bad_url)))
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service.downloader import (
+    PART_SUFFIX,
+    STATE_SUFFIX,
+    DownloadError,
+    download,
+    download_resumable,
+)
+
+MB = 1024 * 1024
+DATA = bytes(range(256)) * (MB * 7 // 2 // 256)
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    ranges = True
+    # range start -> number of broken answers left
+    broken = {}
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._answer(body=False)
+
+    def do_GET(self):
+        self._answer(body=True)
+
+    def _answer(self, body):
+        header = self.headers.get("Range")
+        self.requests.append((self.command, header))
+        start, end, status = 0, len(DATA) - 1, 200
+        if header and self.ranges:
+            first, _, last = header[len("bytes=") :].partition("-")
+            start, status = int(first), 206
+            end = int(last) if last else end
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", '"v1"')
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{len(DATA)}"
+            )
+        self.end_headers()
+        if not body:
+            return
+        if self.broken.get(start):
+            # the connection drops half way
+            self.broken[start] -= 1
+            self.wfile.write(DATA[start : start + (end - start) // 2])
+            return
+        self.wfile.write(DATA[start : end + 1])
+
+
+class TestDownloader(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dst = os.path.join(tmp_dir.name, "primary.xml.zst")
+        self.src_rpm_dir = os.path.join(tmp_dir.name, "src_rpm")
+
+        _RangeHandler.ranges = True
+        _RangeHandler.broken = {}
+        _RangeHandler.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/primary"
+
+        patcher = patch.multiple(
+            settings,
+            DOWNLOAD_RANGE_WORKERS=3,
+            DOWNLOAD_RANGE_CHUNK_MB=1,
+            DOWNLOAD_RETRIES=0,
+            SRC_RPM_DIR=self.src_rpm_dir,
+            FEATURE_CACHE_DIR="",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ranges(self):
+        return sorted(r for m, r in _RangeHandler.requests if m == "GET")
+
+    def _read(self):
+        with open(self.dst, "rb") as f:
+            return f.read()
+
+    def test_parallel_ranges(self):
+        sha256 = hashlib.sha256(DATA).hexdigest()
+        meta = download(self.url, self.dst, sha256=sha256)
+        self.assertEqual(self._read(), DATA)
+        self.assertEqual(meta["sha256"], sha256)
+        self.assertEqual(meta["etag"], '"v1"')
+        self.assertEqual(len(self._ranges()), 4)
+        self.assertFalse(os.path.exists(self.dst + STATE_SUFFIX))
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(DownloadError):
+            download(self.url, self.dst, sha256="0" * 64)
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertFalse(os.path.exists(self.dst + PART_SUFFIX))
+
+    def test_single_stream_without_range_support(self):
+        _RangeHandler.ranges = False
+        download(self.url, self.dst)
+        self.assertEqual(self._read(), DATA)
+        self.assertEqual(self._ranges(), [None])
+
+        with self.assertRaises(DownloadError):
+            download(self.url, self.dst + "2", max_bytes=MB)
+
+    def test_resume_after_failure(self):
+        _RangeHandler.broken = {MB: 1}
+        with self.assertRaises(Exception):
+            download(self.url, self.dst)
+        self.assertFalse(os.path.exists(self.dst))
+        with open(self.dst + STATE_SUFFIX) as f:
+            done = json.load(f)["done"]
+        self.assertIn(0, done)
+        self.assertNotIn(1, done)
+
+        _RangeHandler.requests = []
+        download(self.url, self.dst)
+        self.assertEqual(self._read(), DATA)
+        # only the missing chunks are fetched again
+        missing = [
+            f"bytes={i * MB}-{min((i + 1) * MB, len(DATA)) - 1}"
+            for i in range(4)
+            if i not in done
+        ]
+        self.assertEqual(self._ranges(), sorted(missing))
+
+    def test_retry_dropped_range(self):
+        _RangeHandler.broken = {2 * MB: 1}
+        with patch.object(settings, "DOWNLOAD_RETRIES", 1), patch(
+            "infra_ai_service.service.downloader.time.sleep"
+        ):
+            download(self.url, self.dst)
+        self.assertEqual(self._read(), DATA)
+        self.assertEqual(len(self._ranges()), 5)
+
+    def test_sha256_only_when_needed(self):
+        self.assertEqual(download(self.url, self.dst)["sha256"], "")
+
+    def test_resume_in_a_new_workspace(self):
+        _RangeHandler.broken = {MB: 1}
+        with tempfile.TemporaryDirectory() as workspace:
+            with self.assertRaises(Exception):
+                download_resumable(self.url, os.path.join(workspace, "a"))
+
+        _RangeHandler.requests = []
+        download_resumable(self.url, self.dst)
+        self.assertEqual(self._read(), DATA)
+        self.assertIn(f"bytes={MB}-{2 * MB - 1}", self._ranges())
+        self.assertNotIn(f"bytes=0-{MB - 1}", self._ranges())
+        partial_dir = os.path.join(self.src_rpm_dir, "partial")
+        self.assertFalse(
+            [f for f in os.listdir(partial_dir) if f.endswith(PART_SUFFIX)]
+        )
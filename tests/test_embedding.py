@@ -2,7 +2,10 @@ from fastapi import HTTPException
 import unittest
 from unittest.mock import patch, MagicMock
 
-from infra_ai_service.service.embedding_service import create_embedding
+from infra_ai_service.service.embedding_service import (
+    DELETE_SQL,
+    create_embedding,
+)
 from infra_ai_service.model.model import EmbeddingOutput
 
 
@@ -25,6 +28,33 @@ class TestCreateEmbedding(unittest.TestCase):
         self.assertEqual(result.embedding, [0.1] * 1024)
         mock_embedding.assert_called_once_with("test content")
 
+    @patch("infra_ai_service.sdk.pgvector.pool", new_callable=MagicMock)
+    @patch("infra_ai_service.sdk.ai_proxy.embedding")
+    def test_create_embedding_replace(self, mock_embedding, mock_pool):
+        mock_embedding.return_value = [0.1] * 1024
+        mock_connection = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connection.__enter__.return_value.cursor.return_value = (
+            mock_cursor
+        )
+        mock_pool.connection.return_value = mock_connection
+
+        conn = mock_connection.__enter__.return_value
+        cursor = mock_cursor.__enter__.return_value
+        conn.transaction.return_value.__enter__.side_effect = (
+            lambda: self.assertFalse(cursor.execute.called)
+        )
+        conn.transaction.return_value.__exit__.side_effect = (
+            lambda *args: self.assertEqual(cursor.execute.call_count, 2)
+        )
+        create_embedding("test content", "v1.0", "test_name", replace=True)
+        # the pool is in autocommit, the transaction holds both statements
+        conn.transaction.assert_called_once()
+        conn.transaction.return_value.__exit__.assert_called_once()
+        delete, insert = cursor.execute.call_args_list
+        self.assertEqual(delete.args, (DELETE_SQL, ("v1.0", "test_name")))
+        self.assertIn("INSERT INTO documents", insert.args[0])
+
     @patch("infra_ai_service.sdk.pgvector.pool", new_callable=MagicMock)
     @patch("infra_ai_service.sdk.ai_proxy.embedding")
     def test_create_embedding_db_failure(self, mock_embedding, mock_pool):
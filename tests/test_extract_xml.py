@@ -0,0 +1,259 @@
+import copy
+import functools
+import gzip
+import io
+import os
+import tempfile
+import threading
+import tracemalloc
+import unittest
+import xml.etree.ElementTree as ET
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import zstandard
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import extract_xml
+from infra_ai_service.service.extract_spec import check_xml_info
+from infra_ai_service.service.extract_xml import (
+    XmlIndex,
+    _get_func_with_name,
+    _get_tag_name,
+    extract_xml_features,
+)
+from infra_ai_service.service.utils import update_json, update_json_indexed
+
+PACKAGE = """
+<package type="rpm">
+  <name>{name}</name>
+  <arch>x86_64</arch>
+  <version epoch="0" ver="{ver}" rel="1.oe2403"/>
+  <!-- a comment -->
+  <summary>{name} summary</summary>
+  <description>.</description>
+  <url>https://{name}.example.com</url>
+  <format>
+    <rpm:license>MIT</rpm:license>
+    <rpm:requires>
+      <rpm:entry name="python3"/>
+      <rpm:entry name="/bin/sh"/>
+      <rpm:entry name="lib{name} &gt;= 1.0"/>
+    </rpm:requires>
+    {files}
+  </format>
+</package>"""
+
+
+def _primary(count, files_per_package=0):
+    packages = "".join(
+        PACKAGE.format(
+            name=f"pkg{i}",
+            ver=f"{i}.0.1",
+            files="".join(
+                f"<file>/usr/share/pkg{i}/data/file{j}.txt</file>"
+                for j in range(files_per_package)
+            ),
+        )
+        for i in range(count)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+        'xmlns:rpm="http://linux.duke.edu/metadata/rpm" '
+        f'packages="{count}">{packages}\n</metadata>\n'
+    ).encode()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _extract_with_full_tree(path):
+    # the former implementation, the whole tree in memory
+    metadata = ET.parse(path, parser=ET.XMLParser(encoding="utf-8")).getroot()
+    res = {}
+    count = 1
+    for package in metadata:
+        if _get_tag_name(package.tag) != "package":
+            continue
+        res[count] = {}
+        for info in package:
+            tag_func = _get_func_with_name(_get_tag_name(info.tag))
+            if tag_func:
+                tag_func(res[count], info)
+        count += 1
+    return res
+
+
+def _peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class TestExtractXml(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+
+    def _write(self, data, name="primary.xml"):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_same_output_as_full_tree(self):
+        path = self._write(_primary(50, files_per_package=3))
+        expected = _extract_with_full_tree(path)
+        self.assertEqual(len(expected), 50)
+        self.assertEqual(
+            expected[2],
+            {
+                "name": "pkg1",
+                "version": "1.0",
+                "url": "https://pkg1.example.com",
+                "requires": ["python3", "libpkg1"],
+            },
+        )
+
+        self.assertEqual(extract_xml_features(path), expected)
+        with gzip.open(
+            self._write(gzip.compress(_primary(50, 3)), "p.gz")
+        ) as f:
+            self.assertEqual(extract_xml_features(f), expected)
+        with patch.object(extract_xml, "lxml_etree", None):
+            self.assertEqual(extract_xml_features(path), expected)
+
+    def test_empty_and_broken_xml(self):
+        self.assertEqual(extract_xml_features(io.BytesIO(_primary(0))), {})
+        with self.assertRaises(Exception) as context:
+            extract_xml_features(io.BytesIO(b"<metadata><package>"))
+        self.assertIn("process xml error", str(context.exception))
+
+    def test_peak_memory(self):
+        # file lists dominate a real primary.xml
+        path = self._write(_primary(300, files_per_package=200))
+        with patch.object(extract_xml, "lxml_etree", None):
+            streamed = _peak_memory(extract_xml_features, path)
+        full_tree = _peak_memory(_extract_with_full_tree, path)
+        # 2.9MB of xml: about 0.5MB streamed against 11MB for the tree
+        self.assertLess(streamed * 10, full_tree)
+
+
+class TestCheckXmlInfo(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        serve_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(serve_dir.cleanup)
+        self.serve_dir = os.path.realpath(serve_dir.name)
+
+        handler = functools.partial(_QuietHandler, directory=self.serve_dir)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f"http://127.0.0.1:{server.server_port}"
+
+        patcher = patch.multiple(
+            settings, LOCAL_SOURCE_ROOTS=self.serve_dir, DOWNLOAD_CACHE_DIR=""
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.data = _primary(20, files_per_package=3)
+        self.expected = {
+            data["name"]: data
+            for data in extract_xml_features(io.BytesIO(self.data)).values()
+        }
+        compressed = {
+            "primary.xml.zst": zstandard.ZstdCompressor().compress(self.data),
+            "primary.xml.gz": gzip.compress(self.data),
+            "primary.xml": self.data,
+        }
+        for name, data in compressed.items():
+            with open(os.path.join(self.serve_dir, name), "wb") as f:
+                f.write(data)
+
+    def _check(self, xml_info):
+        self.assertEqual(xml_info.os_version, "openEuler-24.03")
+        self.assertEqual(
+            {name: xml_info.copy_record(name) for name in xml_info},
+            self.expected,
+        )
+
+    async def test_streamed_from_url(self):
+        for name in ("primary.xml.zst", "primary.xml.gz", "primary.xml"):
+            xml_info = await check_xml_info(
+                f"{self.base_url}/{name}", "openEuler-24.03"
+            )
+            self._check(xml_info)
+
+    async def test_local_and_cached(self):
+        xml_info = await check_xml_info(
+            f"file://{self.serve_dir}/primary.xml.zst", "openEuler-24.03"
+        )
+        self._check(xml_info)
+
+        with tempfile.TemporaryDirectory() as cache_dir, patch.object(
+            settings, "DOWNLOAD_CACHE_DIR", cache_dir
+        ):
+            for _ in range(2):
+                xml_info = await check_xml_info(
+                    f"{self.base_url}/primary.xml.gz", "openEuler-24.03"
+                )
+                self._check(xml_info)
+
+    async def test_wrong_url(self):
+        with self.assertRaises(Exception) as context:
+            await check_xml_info(f"{self.base_url}/nothing.xml.zst", "os")
+        self.assertIn("download xml fail", str(context.exception))
+
+        with self.assertRaises(Exception) as context:
+            await check_xml_info(f"{self.base_url}/primary.xml.bz2", "os")
+        self.assertIn("xml must be", str(context.exception))
+
+
+class TestXmlIndex(unittest.TestCase):
+    features = {
+        1: {"name": "bunch", "requires": ["python3"], "url": "u1"},
+        2: {"name": "fish", "requires": [], "version": "2.0"},
+        3: {"name": "bunch", "requires": ["later"], "url": "u2"},
+        4: {"requires": ["no-name"]},
+    }
+
+    def setUp(self):
+        self.index = XmlIndex.from_features(
+            copy.deepcopy(self.features).values(), "openEuler-24.03"
+        )
+
+    def test_first_name_wins_and_read_only(self):
+        self.assertEqual(sorted(self.index), ["bunch", "fish"])
+        self.assertEqual(self.index["bunch"]["url"], "u1")
+        with self.assertRaises(TypeError):
+            self.index["bunch"]["url"] = "changed"
+        with self.assertRaises(TypeError):
+            self.index._packages["apple"] = {}
+
+        record = self.index.copy_record("bunch")
+        record["requires"].append("python3-six")
+        self.assertEqual(self.index["bunch"]["requires"], ("python3",))
+        self.assertIsNone(self.index.copy_record("apple"))
+
+    def test_same_merge_as_update_json(self):
+        for spec in (
+            {"name": "bunch", "requires": ["gcc"], "source0": "b.tar.gz"},
+            {"name": "fish", "version": "2.1"},
+            {"name": "apple"},
+            {"source0": "nameless.tar.gz"},
+        ):
+            expected = update_json(
+                copy.deepcopy(self.features), {1: dict(spec)}
+            )
+            merged = update_json_indexed(self.index, {1: dict(spec)})
+            self.assertEqual(merged, expected)
+        self.assertEqual(self.index["bunch"]["requires"], ("python3",))
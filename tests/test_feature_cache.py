@@ -0,0 +1,100 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import feature_cache, xml_registry
+from infra_ai_service.service.extract_xml import XmlIndex
+from infra_ai_service.service.feature_pipeline import ingest_src_rpm
+
+FEATURES = {1: {"name": "bunch", "macro_names": ["MAX_SIZE"]}}
+
+
+class TestFeatureCache(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        patcher = patch.multiple(
+            settings, FEATURE_CACHE_DIR=tmp_dir.name, FEATURE_CACHE_MB=1
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_trip(self):
+        self.assertIsNone(feature_cache.get("ab" * 32))
+        feature_cache.put("AB" * 32, FEATURES)
+        self.assertEqual(feature_cache.get("ab" * 32), FEATURES)
+
+        # other scan settings, other features
+        with patch.object(settings, "SRC_SCAN_EXCLUDE", "*/vendor/*"):
+            self.assertIsNone(feature_cache.get("ab" * 32))
+
+    def test_lru_eviction(self):
+        big = {1: {"name": "x" * (400 * 1024)}}
+        feature_cache.put("01" * 32, big)
+        feature_cache.put("02" * 32, big)
+        os.utime(
+            feature_cache._entry_path(feature_cache.cache_key("01" * 32)),
+            (0, 0),
+        )
+        feature_cache.get("02" * 32)
+        feature_cache.put("03" * 32, big)
+
+        self.assertIsNone(feature_cache.get("01" * 32))
+        self.assertIsNotNone(feature_cache.get("02" * 32))
+        self.assertIsNotNone(feature_cache.get("03" * 32))
+
+    def test_broken_entry_dropped(self):
+        feature_cache.put("cd" * 32, FEATURES)
+        path = feature_cache._entry_path(feature_cache.cache_key("cd" * 32))
+        with open(path, "w") as f:
+            f.write("{not json")
+        self.assertIsNone(feature_cache.get("cd" * 32))
+        self.assertFalse(os.path.exists(path))
+
+
+class TestCachedIngestion(unittest.IsolatedAsyncioTestCase):
+    async def test_unchanged_src_rpm_extracted_once(self):
+        async def download(url, work_dir):
+            rpm_path = os.path.join(work_dir, "tmp.src.rpm")
+            with open(rpm_path, "wb") as f:
+                f.write(b"same src.rpm")
+            return rpm_path
+
+        sha256 = hashlib.sha256(b"same src.rpm").hexdigest()
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.multiple(
+            settings,
+            FEATURE_CACHE_DIR=tmp_dir,
+            WORKSPACE_DIR=tmp_dir,
+            SANDBOX_WORKERS=0,
+        ), patch.dict(xml_registry._ENTRIES, clear=True), patch(
+            "infra_ai_service.service.feature_pipeline.download_src_rpm",
+            side_effect=download,
+        ) as mock_download, patch(
+            "infra_ai_service.service.feature_pipeline.unpack_src_rpm",
+            new_callable=AsyncMock,
+            return_value=tmp_dir,
+        ) as mock_unpack, patch(
+            "infra_ai_service.service.feature_pipeline.extract_src_features",
+            return_value=FEATURES,
+        ), patch(
+            "infra_ai_service.service.feature_pipeline.create_embedding"
+        ) as mock_embedding:
+            xml_registry.register(XmlIndex({}, "openEuler-24.03"))
+            for _ in range(2):
+                await ingest_src_rpm("x.src.rpm", "openEuler-24.03")
+            self.assertEqual(mock_download.call_count, 2)
+            mock_unpack.assert_called_once()
+
+            await ingest_src_rpm("x.src.rpm", "openEuler-24.03", "", sha256)
+            # a known digest skips the download too
+            self.assertEqual(mock_download.call_count, 2)
+            self.assertEqual(mock_embedding.call_count, 3)
+
+            with self.assertRaises(Exception) as context:
+                await ingest_src_rpm(
+                    "x.src.rpm", "openEuler-24.03", "", "0" * 64
+                )
+            self.assertIn("sha256 mismatch", str(context.exception))
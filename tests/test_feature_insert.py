@@ -1,21 +1,40 @@
+import asyncio
+import io
 import json
+import time
 import unittest
 import os
+import subprocess
+import tarfile
 import tempfile
-from unittest.mock import patch, MagicMock
+from unittest.mock import AsyncMock, patch, MagicMock
 from httpx import AsyncClient
+import zstandard
 import xml.etree.ElementTree as ET
 from infra_ai_service.core.app import get_app
 from infra_ai_service.config.config import settings
 from infra_ai_service.service.extract_spec import (
     extract_spec_features,
-    _decompress_src_rpm,
+    decompress_src_rpm,
     _get_tar_cmd,
-    _decompress_tar_file,
+    decompress_tar_file,
     _process_binarylist,
     check_xml_info,
 )
-import infra_ai_service.service.extract_spec as es
+from infra_ai_service.service.concurrency import (
+    cancel_on_disconnect,
+    run_blocking,
+)
+from infra_ai_service.service import feature_pipeline, xml_registry
+from infra_ai_service.service import workspace as ws
+from infra_ai_service.service.feature_pipeline import ingest_batch
+from infra_ai_service.service.workspace import (
+    check_quota,
+    disk_usage,
+    run_within_quota,
+    workspace,
+)
+from infra_ai_service.service.extract_xml import XmlIndex
 
 app = get_app()
 
@@ -70,7 +89,7 @@ class TestFeatureInsert(unittest.TestCase):
                 f.write("This is a simulated .src.rpm package.\n")
 
             try:
-                await _decompress_src_rpm(src_rpm_path)
+                await decompress_src_rpm(src_rpm_path)
             except Exception as e:
                 prefix = str(e)[:23]
                 self.assertEqual("decompress src.rpm fail", prefix)
@@ -82,11 +101,11 @@ class TestFeatureInsert(unittest.TestCase):
         tar_path = "/path/tmp.tar.gz"
         dst_path = "/path/"
         res = {
-            ".tar.gz": f"tar -xzf {tar_path} -C {dst_path}",
-            ".tgz": f"tar -xzf {tar_path} -C {dst_path}",
-            ".tar.bz2": f"tar -xjf {tar_path} -C {dst_path}",
-            ".tar.xz": f"tar -xJf {tar_path} -C {dst_path}",
-            ".zip": f"unzip {tar_path} -d {dst_path}",
+            ".tar.gz": ["tar", "-xzf", tar_path, "-C", dst_path],
+            ".tgz": ["tar", "-xzf", tar_path, "-C", dst_path],
+            ".tar.bz2": ["tar", "-xjf", tar_path, "-C", dst_path],
+            ".tar.xz": ["tar", "-xJf", tar_path, "-C", dst_path],
+            ".zip": ["unzip", "-q", tar_path, "-d", dst_path],
         }
         for k, v in res.items():
             cmd = _get_tar_cmd(k, tar_path, dst_path)
@@ -102,11 +121,26 @@ class TestFeatureInsert(unittest.TestCase):
                 f.write("This is a simulated .tar.gz package.\n")
 
             try:
-                _decompress_tar_file(tar_dir)
+                decompress_tar_file(tar_dir)
             except Exception as e:
                 prefix = str(e)[:25]
                 self.assertEqual("decompress tar file error", prefix)
 
+    def test_decompress_tar_file_no_shell(self):
+        with tempfile.TemporaryDirectory() as tar_dir:
+            name = "bunch$(touch INJECTED)-1.0.tar.gz"
+            with tarfile.open(os.path.join(tar_dir, name), "w:gz") as tar:
+                info = tarfile.TarInfo("bunch-1.0/setup.py")
+                info.size = 5
+                tar.addfile(info, io.BytesIO(b"pass\n"))
+
+            dst_path = decompress_tar_file(tar_dir)
+            self.assertTrue(
+                os.path.exists(os.path.join(dst_path, "bunch-1.0/setup.py"))
+            )
+            self.assertFalse(os.path.exists("INJECTED"))
+            self.assertFalse(os.path.exists(os.path.join(tar_dir, "INJECTED")))
+
     def _create_spec_content(slef):
         return (
             "Name:           python-bunch\nVersion:        1.0.1\n"
@@ -138,25 +172,29 @@ class TestFeatureInsert(unittest.TestCase):
         )
 
     def test_extract_spec_features(self):
-        es.XML_INFO = {
-            1: {
-                "description": "Best practices checker for Ansible",
-                "name": "ansible-lint",
-                "requires": [],
-            },
-            3: {
-                "description": "A dot-accessible dictionary",
-                "name": "bunch",
-                "version": "1.0.1",
-                "url": "http://github.com/dsc/bunch",
-            },
-        }
+        xml_index = XmlIndex.from_features(
+            [
+                {
+                    "description": "Best practices checker for Ansible",
+                    "name": "ansible-lint",
+                    "requires": [],
+                },
+                {
+                    "description": "A dot-accessible dictionary",
+                    "name": "bunch",
+                    "version": "1.0.1",
+                    "url": "http://github.com/dsc/bunch",
+                },
+            ]
+        )
         with tempfile.TemporaryDirectory() as dir_path:
             spec_path = os.path.join(dir_path, "bunch.spec")
             with open(spec_path, "w", encoding="utf-8") as f:
                 f.write(self._create_spec_content())
 
-            data = extract_spec_features(dir_path)
+            with patch.dict(xml_registry._ENTRIES, clear=True):
+                xml_registry.register(xml_index)
+                data = extract_spec_features(dir_path, "")
             expected_data = {
                 1: {
                     "binaryList": [
@@ -259,13 +297,8 @@ class TestFeatureInsert(unittest.TestCase):
             "</metadata>\n"
         )
 
-    @patch("xml.etree.ElementTree.parse")
-    @patch("urllib.request.urlretrieve")
-    @patch("os.path.exists", return_value=True)
-    @patch("subprocess.run")
-    async def test_extract_xml_features(
-        self, mock_run, mock_exists, mock_urlretrieve, mock_parse
-    ):
+    @patch("infra_ai_service.service.extract_spec.urllib.request.urlopen")
+    def test_extract_xml_features(self, mock_urlopen):
         TEST_XML_URL = "http://example.com/primary.xml.zst"
         TEST_OS_VERSION = "test_os_version"
 
@@ -305,14 +338,12 @@ class TestFeatureInsert(unittest.TestCase):
                 attrib=req,
             )
 
-        mock_parse.return_value.getroot.return_value = mock_root
-        mock_urlretrieve.return_value = ("download success", {})
-        mock_run.return_value = MagicMock(
-            returncode=0, stdout=None, stderr=None
+        mock_urlopen.return_value = io.BytesIO(
+            zstandard.ZstdCompressor().compress(ET.tostring(mock_root))
         )
-        result = await check_xml_info(TEST_XML_URL, TEST_OS_VERSION)
+        result = asyncio.run(check_xml_info(TEST_XML_URL, TEST_OS_VERSION))
         xml_expected = {
-            1: {
+            "ansible-lint": {
                 "name": "ansible-lint",
                 "requires": [
                     "ansible",
@@ -332,6 +363,233 @@ class TestFeatureInsert(unittest.TestCase):
                 "url": "https://github.com/ansible/ansible-lint",
                 "version": "4.2",
             },
-            "os_version": "test_os_version",
         }
-        self.assertEqual(result, xml_expected)
+        self.assertEqual(result.os_version, TEST_OS_VERSION)
+        self.assertEqual(
+            {name: result.copy_record(name) for name in result}, xml_expected
+        )
+
+
+class TestWorkspace(unittest.IsolatedAsyncioTestCase):
+    async def test_workspaces_are_isolated_and_removed(self):
+        with tempfile.TemporaryDirectory() as root:
+            with patch.object(settings, "WORKSPACE_DIR", root):
+                async with workspace() as first, workspace() as second:
+                    self.assertNotEqual(first, second)
+                    self.assertTrue(os.path.isdir(first))
+                    self.assertEqual(os.path.dirname(second), root)
+
+                with self.assertRaises(ValueError):
+                    async with workspace() as third:
+                        raise ValueError("stage failed")
+
+                for path in (first, second, third):
+                    self.assertFalse(os.path.exists(path))
+
+    async def test_workspace_quota(self):
+        with tempfile.TemporaryDirectory() as root:
+            with patch.object(settings, "WORKSPACE_DIR", root), patch.object(
+                settings, "WORKSPACE_QUOTA_MB", 1
+            ):
+                async with workspace() as work_dir:
+                    with open(os.path.join(work_dir, "big"), "wb") as f:
+                        f.write(b"0" * (1024 * 1024 + 1))
+                    with self.assertRaises(Exception) as context:
+                        check_quota(work_dir)
+                    self.assertIn("quota exceeded", str(context.exception))
+
+    def test_tar_stopped_at_quota(self):
+        with tempfile.TemporaryDirectory() as work_dir, patch.object(
+            settings, "WORKSPACE_QUOTA_MB", 1
+        ):
+            rpm_dir = os.path.join(work_dir, "tmp_src_rpm")
+            os.makedirs(rpm_dir)
+            data = b"0" * (8 * 1024 * 1024)
+            with tarfile.open(
+                os.path.join(rpm_dir, "bomb-1.0.tar.gz"), "w:gz"
+            ) as tar:
+                info = tarfile.TarInfo("bomb-1.0/zeros")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+            with self.assertRaises(Exception) as context:
+                decompress_tar_file(rpm_dir)
+            self.assertIn("quota exceeded", str(context.exception))
+            self.assertLessEqual(disk_usage(work_dir), 1024 * 1024)
+
+    def test_extraction_timeout_kills_the_command(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            started = time.monotonic()
+            with self.assertRaises(subprocess.TimeoutExpired):
+                run_within_quota(["sleep", "30"], work_dir, 0, timeout=0.3)
+            self.assertLess(time.monotonic() - started, 5)
+
+
+class _Request:
+    def __init__(self, disconnect_after):
+        self.polls = 0
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self):
+        self.polls += 1
+        return self.polls > self.disconnect_after
+
+
+class TestConcurrency(unittest.IsolatedAsyncioTestCase):
+    async def test_blocking_stage_leaves_loop_free(self):
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        await run_blocking(time.sleep, 0.3)
+        ticker.cancel()
+        self.assertGreater(ticks, 10)
+
+    @patch("infra_ai_service.service.concurrency.DISCONNECT_POLL_INTERVAL", 0)
+    async def test_cancel_on_disconnect(self):
+        stages = []
+
+        def stage(name):
+            time.sleep(0.1)
+            stages.append(name)
+
+        async def pipeline():
+            await run_blocking(stage, "unpack")
+            await run_blocking(stage, "embedding")
+
+        with self.assertRaises(asyncio.CancelledError):
+            await cancel_on_disconnect(_Request(1), pipeline())
+        # the running stage ends, the next one never starts
+        self.assertEqual(stages, ["unpack"])
+
+        self.assertEqual(
+            await cancel_on_disconnect(_Request(100), run_blocking(sum, [1])),
+            1,
+        )
+
+
+class TestFeatureInsertBatch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patchers = [
+            patch.dict(xml_registry._ENTRIES, clear=True),
+            patch.object(ws, "_STAGE_SLOTS", {}),
+            patch.object(ws, "_INGEST_SLOTS", None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        xml_registry.register(XmlIndex({}, "openEuler-24.03"))
+
+    async def test_batch_streams_ndjson(self):
+        async def ingest(url, os_version, package_name, sha256, replace):
+            await asyncio.sleep(0.1 if "slow" in url else 0)
+            if "bad" in url:
+                raise Exception("url of src.rpm may be wrong")
+            return f"feature of {package_name}"
+
+        data = {
+            "os_version": "openEuler-24.03",
+            "packages": [
+                {"src_rpm_url": "slow.src.rpm", "package_name": "slow"},
+                {"src_rpm_url": "bad.src.rpm2"},
+                {"src_rpm_url": "fast.src.rpm", "package_name": "fast"},
+            ],
+        }
+        with patch.object(
+            feature_pipeline, "ingest_src_rpm", side_effect=ingest
+        ):
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                resp = await ac.post("/api/v1/feature-insert/batch", json=data)
+        self.assertEqual(resp.headers["content-type"], "application/x-ndjson")
+        results = [json.loads(line) for line in resp.text.splitlines()]
+        self.assertEqual([r["index"] for r in results[2:]], [0])
+        by_index = {r["index"]: r for r in results}
+        self.assertEqual(by_index[0]["insert_content"], "feature of slow")
+        self.assertEqual(by_index[1]["status"], "error")
+        self.assertEqual(by_index[1]["message"], "url of src.rpm may be wrong")
+        self.assertEqual(by_index[2]["status"], "success")
+
+    async def test_batch_wrong_os_version(self):
+        data = {"os_version": "other", "packages": []}
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            resp = await ac.post("/api/v1/feature-insert/batch", json=data)
+        self.assertEqual(resp.json()["status"], "error")
+        self.assertIn("not configured", resp.json()["message"])
+
+    async def test_stages_overlap(self):
+        spans = []
+
+        async def download(url, work_dir):
+            start = time.monotonic()
+            await asyncio.sleep(0.05)
+            spans.append(("download", start, time.monotonic()))
+            return url
+
+        def extract(rpm_dir):
+            start = time.monotonic()
+            time.sleep(0.05)
+            spans.append(("extract", start, time.monotonic()))
+            return {1: {"name": "bunch"}}
+
+        packages = [
+            MagicMock(src_rpm_url=f"{i}.src.rpm", package_name="", sha256="")
+            for i in range(4)
+        ]
+        with tempfile.TemporaryDirectory() as root, patch.multiple(
+            settings,
+            WORKSPACE_DIR=root,
+            SANDBOX_WORKERS=0,
+            INGEST_DOWNLOAD_CONCURRENCY=1,
+            INGEST_EXTRACT_CONCURRENCY=1,
+        ), patch.object(
+            feature_pipeline, "download_src_rpm", side_effect=download
+        ), patch.object(
+            feature_pipeline, "unpack_src_rpm", new_callable=AsyncMock
+        ), patch.object(
+            feature_pipeline, "extract_src_features", side_effect=extract
+        ), patch.object(
+            feature_pipeline, "create_embedding"
+        ):
+            results = [
+                r async for r in ingest_batch(packages, "openEuler-24.03")
+            ]
+
+        self.assertEqual(sorted(r[0] for r in results), [0, 1, 2, 3])
+        self.assertTrue(all(r[2] is None for r in results))
+        downloads = [s for s in spans if s[0] == "download"]
+        extracts = [s for s in spans if s[0] == "extract"]
+        # a download runs while another package is extracted
+        self.assertTrue(
+            any(
+                d[1] < e[2] and e[1] < d[2]
+                for d in downloads
+                for e in extracts
+            )
+        )
+
+    async def test_insert_reports_scan_truncated(self):
+        features = {1: {"name": "bunch", "scan_truncated": True}}
+        with patch.object(
+            feature_pipeline,
+            "_extract_features",
+            new_callable=AsyncMock,
+            return_value=features,
+        ), patch.object(feature_pipeline, "create_embedding") as embedding:
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                resp = await ac.post(
+                    "/api/v1/feature-insert/",
+                    json={
+                        "src_rpm_url": "bunch.src.rpm",
+                        "os_version": "openEuler-24.03",
+                    },
+                )
+        self.assertEqual(resp.json()["status"], "success")
+        self.assertTrue(resp.json()["scan_truncated"])
+        # the flag is not embedded
+        self.assertNotIn("scan", resp.json()["insert_content"])
+        self.assertNotIn("scan", embedding.call_args[0][0])
@@ -0,0 +1,199 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from httpx import AsyncClient
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.core.app import get_app
+from infra_ai_service.service import job_queue, xml_registry
+from infra_ai_service.service.extract_xml import XmlIndex
+from infra_ai_service.service.job_queue import fail_job, run_job
+
+app = get_app()
+
+
+def _job(attempts=1, max_attempts=3):
+    return {
+        "id": 7,
+        "kind": "src_rpm",
+        "payload": {
+            "src_rpm_url": "https://example.com/bunch-1.0.1-3.src.rpm",
+            "os_version": "openEuler-24.03",
+        },
+        "attempts": attempts,
+        "max_attempts": max_attempts,
+    }
+
+
+class TestJobQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.calls = []
+        self.rowcount = 1
+        patchers = [
+            patch.object(
+                job_queue,
+                "_execute",
+                side_effect=self._execute,
+            ),
+            patch.object(settings, "JOB_RETRY_BACKOFF", 30),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _execute(self, sql, params, fetch=False):
+        self.calls.append((sql, params))
+        # rows updated, 0 once the job was claimed again
+        return self.rowcount
+
+    def test_fail_job_backoff(self):
+        fail_job(_job(attempts=2), "download src.rpm fail")
+        self.assertEqual(
+            self.calls,
+            [(job_queue.RETRY_SQL, ("download src.rpm fail", 60, 7, 2))],
+        )
+
+        self.calls.clear()
+        fail_job(_job(attempts=3), "download src.rpm fail")
+        self.assertEqual(
+            self.calls, [(job_queue.FAIL_SQL, ("download src.rpm fail", 7, 3))]
+        )
+
+    async def test_run_job_reports_stages(self):
+        async def ingest(url, os_version, package_name, sha256, report):
+            await report("download")
+            await report("embed")
+            return "feature of bunch"
+
+        with patch.object(job_queue, "ingest_src_rpm", side_effect=ingest):
+            await run_job(_job())
+
+        self.assertEqual(
+            self.calls,
+            [
+                (job_queue.STAGE_SQL, ("download", 7, 1)),
+                (job_queue.STAGE_SQL, ("embed", 7, 1)),
+                (job_queue.COMPLETE_SQL, ("feature of bunch", 7, 1)),
+            ],
+        )
+
+    async def test_run_job_failure_is_retried(self):
+        with patch.object(
+            job_queue,
+            "ingest_src_rpm",
+            side_effect=Exception("url of src.rpm may be wrong"),
+        ):
+            await run_job(_job())
+        self.assertEqual(
+            self.calls,
+            [(job_queue.RETRY_SQL, ("url of src.rpm may be wrong", 30, 7, 1))],
+        )
+
+    async def test_cancelled_job_is_released(self):
+        started = asyncio.Event()
+
+        async def ingest(*args, **kwargs):
+            started.set()
+            await asyncio.sleep(10)
+
+        with patch.object(job_queue, "ingest_src_rpm", side_effect=ingest):
+            task = asyncio.ensure_future(run_job(_job()))
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertEqual(self.calls, [(job_queue.RELEASE_SQL, (7, 1))])
+
+    async def test_lost_lease_stops_job(self):
+        cancelled = asyncio.Event()
+
+        async def ingest(*args, **kwargs):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with patch.object(settings, "JOB_LEASE_SECONDS", 3), patch.object(
+            job_queue, "heartbeat", side_effect=Exception("database down")
+        ) as heartbeat, patch.object(
+            job_queue, "ingest_src_rpm", side_effect=ingest
+        ):
+            await asyncio.wait_for(run_job(_job()), 5)
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(heartbeat.call_count, 2)
+        # neither failed nor released, another worker owns it now
+        self.assertEqual(self.calls, [])
+
+    async def test_job_claimed_again_is_stopped(self):
+        cancelled = asyncio.Event()
+
+        async def ingest(*args, **kwargs):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        self.rowcount = 0
+        with patch.object(settings, "JOB_LEASE_SECONDS", 3), patch.object(
+            job_queue, "ingest_src_rpm", side_effect=ingest
+        ):
+            await asyncio.wait_for(run_job(_job()), 5)
+        self.assertTrue(cancelled.is_set())
+        # one heartbeat found the row fenced off, nothing else written
+        self.assertEqual(self.calls, [(job_queue.HEARTBEAT_SQL, (3, 7, 1))])
+
+    async def test_stale_result_is_dropped(self):
+        async def ingest(url, os_version, package_name, sha256, report):
+            self.rowcount = 0
+            return "feature of bunch"
+
+        with patch.object(job_queue, "ingest_src_rpm", side_effect=ingest):
+            await run_job(_job())
+        self.assertEqual(
+            self.calls, [(job_queue.COMPLETE_SQL, ("feature of bunch", 7, 1))]
+        )
+
+
+class TestJobApi(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = patch.dict(xml_registry._ENTRIES, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        xml_registry.register(XmlIndex({}, "openEuler-24.03"))
+
+    async def test_submit_and_poll(self):
+        data = {
+            "src_rpm_url": "https://example.com/bunch-1.0.1-3.src.rpm",
+            "os_version": "openEuler-24.03",
+        }
+        job = dict(_job(), status="running", stage="extract")
+        with patch(
+            "infra_ai_service.api.ai_enhance.feature_insert.submit_job",
+            return_value=7,
+        ) as submit, patch(
+            "infra_ai_service.api.ai_enhance.feature_insert.get_job",
+            side_effect=lambda job_id: job if job_id == 7 else None,
+        ):
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                resp = await ac.post("/api/v1/feature-insert/jobs", json=data)
+                self.assertEqual(
+                    resp.json(), {"status": "success", "job_id": 7}
+                )
+                self.assertEqual(submit.call_args[0][0], "src_rpm")
+
+                resp = await ac.get("/api/v1/feature-insert/jobs/7")
+                self.assertEqual(resp.json()["job"]["stage"], "extract")
+
+                resp = await ac.get("/api/v1/feature-insert/jobs/8")
+                self.assertEqual(resp.json()["status"], "error")
+                self.assertIn("not found", resp.json()["message"])
+
+    async def test_submit_wrong_os_version(self):
+        data = {"src_rpm_url": "a.src.rpm", "os_version": "other"}
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            resp = await ac.post("/api/v1/feature-insert/jobs", json=data)
+        self.assertEqual(resp.json()["status"], "error")
+        self.assertIn("not configured", resp.json()["message"])
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service.extract_spec import (
+    download_src_rpm,
+    unpack_src_rpm,
+)
+from infra_ai_service.service.local_source import link_or_copy, local_path
+from tests.test_rpm_reader import build_src_rpm
+
+
+class TestLocalSource(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        mirror = tempfile.TemporaryDirectory()
+        self.addCleanup(mirror.cleanup)
+        self.mirror = os.path.realpath(mirror.name)
+        self.rpm_path = os.path.join(self.mirror, "bunch-1.0.1-3.src.rpm")
+        build_src_rpm(self.rpm_path, [("bunch.spec", b"Name: bunch\n")])
+
+        patcher = patch.multiple(
+            settings, LOCAL_SOURCE_ROOTS=f"/not/a/mirror, {self.mirror}"
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_local_path(self):
+        self.assertEqual(local_path(self.rpm_path), self.rpm_path)
+        self.assertEqual(local_path(f"file://{self.rpm_path}"), self.rpm_path)
+        self.assertIsNone(local_path("https://example.com/a.src.rpm"))
+
+        for url in ("/etc/passwd", f"{self.mirror}/../x.src.rpm"):
+            with self.assertRaises(Exception) as context:
+                local_path(url)
+            self.assertIn(
+                "outside of LOCAL_SOURCE_ROOTS", str(context.exception)
+            )
+
+        with patch.object(settings, "LOCAL_SOURCE_ROOTS", ""):
+            with self.assertRaises(Exception):
+                local_path(self.rpm_path)
+
+    def test_link_or_copy(self):
+        with tempfile.TemporaryDirectory() as dst_dir:
+            dst = os.path.join(dst_dir, "a.src.rpm")
+            with patch("os.link", side_effect=OSError("cross-device link")):
+                link_or_copy(self.rpm_path, dst)
+            with open(dst, "rb") as f, open(self.rpm_path, "rb") as g:
+                self.assertEqual(f.read(), g.read())
+
+        dst = os.path.join(self.mirror, "linked.src.rpm")
+        link_or_copy(self.rpm_path, dst)
+        self.assertTrue(os.path.samefile(dst, self.rpm_path))
+
+    async def test_src_rpm_read_in_place(self):
+        with tempfile.TemporaryDirectory() as work_dir, patch.object(
+            settings, "SANDBOX_WORKERS", 0
+        ), patch.object(settings, "SRC_SCAN_MODE", "archive"):
+            rpm_path = await download_src_rpm(
+                f"file://{self.rpm_path}", work_dir
+            )
+            self.assertEqual(rpm_path, self.rpm_path)
+            rpm_dir = await unpack_src_rpm(rpm_path, work_dir)
+
+            self.assertEqual(os.path.dirname(rpm_dir), work_dir)
+            self.assertEqual(os.listdir(rpm_dir), ["bunch.spec"])
+            self.assertEqual(
+                os.listdir(self.mirror), [os.path.basename(rpm_path)]
+            )
@@ -0,0 +1,186 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import feature_pipeline, repo_ingest
+from infra_ai_service.service import workspace as ws
+from infra_ai_service.service import xml_registry
+from infra_ai_service.service.extract_xml import XmlIndex
+from infra_ai_service.service.repo_ingest import ingest_repo
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="filelists">
+    <location href="repodata/filelists.xml.gz"/>
+  </data>
+  <data type="primary">
+    <location href="repodata/abc-primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+PACKAGE = """
+  <package type="rpm">
+    <name>{name}</name>
+    <arch>{arch}</arch>
+    <version epoch="{epoch}" ver="{ver}" rel="1"/>
+    <checksum type="sha256" pkgid="YES">{sha256}</checksum>
+    <location href="Packages/{name}-{ver}-1.{arch}.rpm"/>
+  </package>"""
+
+
+class TestRepoIngest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        repo_dir = tempfile.TemporaryDirectory()
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(repo_dir.cleanup)
+        self.addCleanup(work_dir.cleanup)
+        self.repo_dir = os.path.realpath(repo_dir.name)
+        os.makedirs(os.path.join(self.repo_dir, "repodata"))
+        with open(
+            os.path.join(self.repo_dir, "repodata", "repomd.xml"), "w"
+        ) as f:
+            f.write(REPOMD)
+
+        self.states = {}
+        self.ingested = []
+        self.fixed = False
+        patchers = [
+            patch.dict(xml_registry._ENTRIES, clear=True),
+            patch.object(ws, "_STAGE_SLOTS", {}),
+            patch.object(ws, "_INGEST_SLOTS", None),
+            patch.multiple(
+                settings,
+                LOCAL_SOURCE_ROOTS=self.repo_dir,
+                WORKSPACE_DIR=work_dir.name,
+                REPO_INGEST_BATCH=2,
+            ),
+            patch.object(
+                repo_ingest,
+                "load_package_states",
+                side_effect=lambda os_version: dict(self.states),
+            ),
+            patch.object(
+                repo_ingest,
+                "save_package_state",
+                side_effect=self._save_state,
+            ),
+            patch.object(
+                feature_pipeline, "ingest_src_rpm", side_effect=self._ingest
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        xml_registry.register(XmlIndex({}, "openEuler-24.03"))
+
+    def _save_state(self, os_version, package, status, error=None):
+        self.states[package.package_name] = (
+            package.version,
+            package.sha256,
+            status,
+        )
+
+    async def _ingest(self, url, os_version, package_name, sha256, replace):
+        self.assertTrue(replace)
+        self.ingested.append(url)
+        if "broken" in url and not self.fixed:
+            raise Exception("url of src.rpm may be wrong")
+        return f"feature of {package_name}"
+
+    def _write_primary(self, packages):
+        body = "".join(
+            PACKAGE.format(
+                name=name,
+                arch=arch,
+                epoch=0,
+                ver=ver,
+                sha256=name * 2,
+            )
+            for name, arch, ver in packages
+        )
+        path = os.path.join(self.repo_dir, "repodata", "abc-primary.xml.gz")
+        with gzip.open(path, "wt") as f:
+            f.write(
+                '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+                f'packages="{len(packages)}">{body}\n</metadata>\n'
+            )
+
+    async def test_incremental_runs(self):
+        self._write_primary(
+            [
+                ("bunch", "src", "1.0"),
+                ("bunch", "x86_64", "1.0"),
+                ("broken", "src", "2.0"),
+                ("fish", "src", "3.0"),
+            ]
+        )
+        summary = await ingest_repo(self.repo_dir, "openEuler-24.03")
+        self.assertEqual(
+            summary, {"added": 2, "updated": 0, "skipped": 0, "failed": 1}
+        )
+        self.assertEqual(
+            sorted(self.ingested),
+            [
+                f"{self.repo_dir}/Packages/broken-2.0-1.src.rpm",
+                f"{self.repo_dir}/Packages/bunch-1.0-1.src.rpm",
+                f"{self.repo_dir}/Packages/fish-3.0-1.src.rpm",
+            ],
+        )
+        self.assertEqual(self.states["bunch"], ("1.0-1", "bunchbunch", "done"))
+        self.assertEqual(self.states["broken"][2], "failed")
+
+        # only the failed and the changed packages are ingested again
+        self._write_primary(
+            [
+                ("bunch", "src", "1.0"),
+                ("broken", "src", "2.0"),
+                ("fish", "src", "3.1"),
+            ]
+        )
+        self.ingested.clear()
+        summary = await ingest_repo(
+            f"file://{self.repo_dir}/", "openEuler-24.03"
+        )
+        self.assertEqual(
+            summary, {"added": 0, "updated": 1, "skipped": 1, "failed": 1}
+        )
+        self.assertEqual(len(self.ingested), 2)
+        self.assertEqual(self.states["fish"][0], "3.1-1")
+
+        # a package that failed before is added, not updated
+        self.fixed = True
+        summary = await ingest_repo(self.repo_dir, "openEuler-24.03")
+        self.assertEqual(
+            summary, {"added": 1, "updated": 0, "skipped": 2, "failed": 0}
+        )
+
+    async def test_newest_version_only(self):
+        self._write_primary(
+            [
+                ("bunch", "src", "1.10"),
+                ("bunch", "src", "1.9"),
+                ("fish", "src", "3.0"),
+                ("bunch", "src", "1.2"),
+            ]
+        )
+        summary = await ingest_repo(self.repo_dir, "openEuler-24.03")
+        self.assertEqual(
+            summary, {"added": 2, "updated": 0, "skipped": 2, "failed": 0}
+        )
+        self.assertEqual(
+            sorted(self.ingested),
+            [
+                f"{self.repo_dir}/Packages/bunch-1.10-1.src.rpm",
+                f"{self.repo_dir}/Packages/fish-3.0-1.src.rpm",
+            ],
+        )
+        self.assertEqual(self.states["bunch"][0], "1.10-1")
+
+    async def test_wrong_os_version(self):
+        with self.assertRaises(Exception) as context:
+            await ingest_repo(self.repo_dir, "other")
+        self.assertIn("not configured", str(context.exception))
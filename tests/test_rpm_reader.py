@@ -0,0 +1,110 @@
+import gzip
+import lzma
+import os
+import struct
+import tempfile
+import unittest
+
+import zstandard
+
+from infra_ai_service.service.extract_spec import decompress_src_rpm
+from infra_ai_service.service.rpm_reader import (
+    RPMTAG_PAYLOADCOMPRESSOR,
+    extract_members,
+)
+
+
+def _cpio_entry(name, data, mode=0o100644):
+    name_bytes = name.encode() + b"\0"
+    fields = [0, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name_bytes), 0]
+    header = b"070701" + b"".join(b"%08X" % f for f in fields)
+    entry = header + name_bytes
+    entry += b"\0" * ((4 - len(entry) % 4) % 4)
+    entry += data + b"\0" * ((4 - len(data) % 4) % 4)
+    return entry
+
+
+def _header(entries):
+    index, store = b"", b""
+    for tag, value in entries:
+        index += struct.pack(">iiii", tag, 6, len(store), 1)
+        store += value.encode() + b"\0"
+    intro = b"\x8e\xad\xe8\x01" + b"\0" * 4
+    return intro + struct.pack(">II", len(entries), len(store)) + index + store
+
+
+def build_src_rpm(path, files, compressor="gzip"):
+    cpio = b"".join(_cpio_entry(name, data) for name, data in files)
+    cpio += _cpio_entry("./docs", b"", mode=0o040755)
+    cpio += _cpio_entry("TRAILER!!!", b"")
+    compress = {
+        "gzip": gzip.compress,
+        "xz": lzma.compress,
+        "zstd": zstandard.ZstdCompressor().compress,
+    }[compressor]
+
+    lead = b"\xed\xab\xee\xdb" + b"\0" * 92
+    # one entry with a 5 byte store, the signature needs padding
+    signature = _header([(1000, "size")])
+    signature += b"\0" * ((8 - len(signature) % 8) % 8)
+    header = _header([(RPMTAG_PAYLOADCOMPRESSOR, compressor)])
+    with open(path, "wb") as f:
+        f.write(lead + signature + header + compress(cpio))
+
+
+class TestRpmReader(unittest.TestCase):
+    files = [
+        ("bunch.spec", b"Name: bunch\n"),
+        ("bunch-1.0.1.tar.gz", b"\x1f\x8b fake tarball"),
+        ("fix-build.patch", b"--- a\n+++ b\n"),
+        ("./bunch-doc.zip", b"PK fake zip"),
+    ]
+
+    def test_extract_only_spec_and_archives(self):
+        for compressor in ("gzip", "xz", "zstd"):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                rpm_path = os.path.join(tmp_dir, "bunch.src.rpm")
+                dst_dir = os.path.join(tmp_dir, "out")
+                build_src_rpm(rpm_path, self.files, compressor)
+
+                extracted = extract_members(rpm_path, dst_dir)
+
+                self.assertEqual(
+                    extracted,
+                    ["bunch.spec", "bunch-1.0.1.tar.gz", "bunch-doc.zip"],
+                )
+                self.assertEqual(
+                    sorted(os.listdir(dst_dir)), sorted(extracted)
+                )
+                with open(os.path.join(dst_dir, "bunch.spec"), "rb") as f:
+                    self.assertEqual(f.read(), b"Name: bunch\n")
+
+    def test_members_over_budget(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rpm_path = os.path.join(tmp_dir, "bunch.src.rpm")
+            dst_dir = os.path.join(tmp_dir, "out")
+            build_src_rpm(rpm_path, self.files)
+            with self.assertRaises(ValueError) as context:
+                extract_members(rpm_path, dst_dir, max_bytes=20)
+            self.assertIn("exceed 20 bytes", str(context.exception))
+            # the member going over is never written
+            self.assertEqual(os.listdir(dst_dir), ["bunch.spec"])
+
+    def test_decompress_src_rpm(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rpm_path = os.path.join(tmp_dir, "tmp.src.rpm")
+            build_src_rpm(rpm_path, self.files)
+            rpm_dir = decompress_src_rpm(rpm_path)
+            self.assertEqual(rpm_dir, os.path.join(tmp_dir, "tmp_src_rpm"))
+            self.assertIn("bunch.spec", os.listdir(rpm_dir))
+
+    def test_decompress_not_rpm(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rpm_path = os.path.join(tmp_dir, "tmp.src.rpm")
+            with open(rpm_path, "w") as f:
+                f.write("This is a simulated .src.rpm package.\n")
+            with self.assertRaises(Exception) as context:
+                decompress_src_rpm(rpm_path)
+            self.assertTrue(
+                str(context.exception).startswith("decompress src.rpm fail")
+            )
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import sandbox
+from infra_ai_service.service.sandbox import (
+    StageTimeout,
+    run_sandboxed,
+    stop_sandbox,
+)
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def _allocate(mb):
+    return len(bytearray(mb * 1024 * 1024))
+
+
+def _crash(delay=0):
+    time.sleep(delay)
+    os._exit(1)
+
+
+class TestSandbox(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = patch.multiple(
+            settings,
+            SANDBOX_WORKERS=1,
+            SANDBOX_MAX_JOBS=2,
+            SANDBOX_MEMORY_MB=512,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(stop_sandbox)
+
+    async def test_runs_in_worker_and_recycles(self):
+        pids = [await run_sandboxed(_sleep, 0) for _ in range(3)]
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    async def test_stage_timeout(self):
+        with self.assertRaises(StageTimeout):
+            await run_sandboxed(_sleep, 5, timeout=0.2)
+        # the worker survives its own timeout
+        self.assertIsInstance(await run_sandboxed(_sleep, 0), int)
+
+    async def test_parent_kills_hung_worker(self):
+        with patch.object(sandbox, "KILL_GRACE", 0), patch.object(
+            sandbox, "_on_alarm", lambda *_: None
+        ):
+            with self.assertRaises(StageTimeout):
+                await run_sandboxed(_sleep, 5, timeout=0.2)
+        self.assertIsInstance(await run_sandboxed(_sleep, 0), int)
+
+    async def test_memory_limit(self):
+        with self.assertRaises(MemoryError):
+            await run_sandboxed(_allocate, 1024)
+        self.assertEqual(await run_sandboxed(_allocate, 1), 1024 * 1024)
+
+    async def test_dead_worker_replaced(self):
+        with self.assertRaises(Exception) as context:
+            await run_sandboxed(_crash)
+        self.assertIn("worker died", str(context.exception))
+        self.assertIsInstance(await run_sandboxed(_sleep, 0), int)
+
+    async def test_crash_fails_only_its_job(self):
+        with patch.object(settings, "SANDBOX_WORKERS", 2):
+            ok, crashed = await asyncio.gather(
+                run_sandboxed(_sleep, 0.5),
+                run_sandboxed(_crash, 0.1),
+                return_exceptions=True,
+            )
+        self.assertIsInstance(ok, int)
+        self.assertIn("worker died", str(crashed))
+
+    async def test_hang_fails_only_its_job(self):
+        with patch.multiple(
+            sandbox, KILL_GRACE=0, _on_alarm=lambda *_: None
+        ), patch.object(settings, "SANDBOX_WORKERS", 2):
+            ok, hung = await asyncio.gather(
+                run_sandboxed(_sleep, 0.5),
+                run_sandboxed(_sleep, 5, timeout=0.2),
+                return_exceptions=True,
+            )
+        self.assertIsInstance(ok, int)
+        self.assertIsInstance(hung, StageTimeout)
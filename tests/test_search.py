@@ -4,10 +4,16 @@ from unittest.mock import AsyncMock, MagicMock, patch
 
 from fastapi import HTTPException
 
-from infra_ai_service.model.model import SearchInput
+from infra_ai_service.model.model import BatchSearchInput, SearchInput
 
 # 导入被测试的函数
-from infra_ai_service.service.search_service import perform_vector_search
+from infra_ai_service.service.search_service import (
+    decode_cursor,
+    perform_batch_vector_search,
+    perform_similar_search_by_id,
+    perform_similar_search_by_name,
+    perform_vector_search,
+)
 
 
 class TestPerformVectorSearch(unittest.IsolatedAsyncioTestCase):
@@ -75,3 +81,148 @@ class TestPerformVectorSearch(unittest.IsolatedAsyncioTestCase):
             )
             await perform_vector_search(test_input)
         self.assertEqual(context.exception.status_code, 500)
+
+
+class TestPerformBatchVectorSearch(unittest.IsolatedAsyncioTestCase):
+    @patch("infra_ai_service.service.search_service.pgvector")
+    @patch("infra_ai_service.service.search_service.ai_proxy")
+    async def test_batch_search_keeps_input_order(
+        self, mock_ai_proxy, mock_pgvector
+    ):
+        mock_ai_proxy.embedding_batch.return_value = [
+            [0.1, 0.2],
+            [0.3, 0.4],
+            [0.5, 0.6],
+        ]
+        mock_cur = MagicMock()
+        # the second query has no hit at all
+        mock_cur.stream.return_value = iter(
+            [
+                (1, 11, "content11", 0.95, "libc"),
+                (1, 12, "content12", 0.50, "glibc"),
+                (3, 31, "content31", 0.80, "zlib"),
+            ]
+        )
+        mock_conn = mock_pgvector.pool.connection.return_value.__enter__()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cur
+
+        test_input = BatchSearchInput(
+            queries=["libc", "nothing", "zlib"],
+            os_version="ubuntu",
+            top_n=2,
+            score_threshold=0.7,
+        )
+        result = await perform_batch_vector_search(test_input)
+
+        mock_ai_proxy.embedding_batch.assert_called_once_with(
+            ["libc", "nothing", "zlib"]
+        )
+        mock_cur.stream.assert_called_once()
+        params = mock_cur.stream.call_args[0][1]
+        self.assertEqual(params[0], ["[0.1,0.2]", "[0.3,0.4]", "[0.5,0.6]"])
+        self.assertEqual(params[1:], ("ubuntu", 2))
+
+        self.assertEqual([i.index for i in result.results], [0, 1, 2])
+        self.assertEqual(
+            [i.query_text for i in result.results], test_input.queries
+        )
+        self.assertEqual([r.id for r in result.results[0].results], ["11"])
+        self.assertEqual(result.results[1].results, [])
+        self.assertEqual([r.name for r in result.results[2].results], ["zlib"])
+
+    @patch("infra_ai_service.service.search_service.ai_proxy")
+    async def test_batch_search_proxy_failure(self, mock_ai_proxy):
+        mock_ai_proxy.embedding_batch.side_effect = Exception("proxy down")
+        test_input = BatchSearchInput(queries=["libc"], os_version="ubuntu")
+        with self.assertRaises(HTTPException) as context:
+            await perform_batch_vector_search(test_input)
+        self.assertEqual(context.exception.status_code, 500)
+
+
+class TestPerformSimilarSearch(unittest.IsolatedAsyncioTestCase):
+    def _mock_cursor(self, mock_pgvector, rows):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = rows
+        mock_conn = mock_pgvector.pool.connection.return_value.__enter__()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cur
+        return mock_cur
+
+    @patch("infra_ai_service.service.search_service.ai_proxy")
+    @patch("infra_ai_service.service.search_service.pgvector")
+    async def test_similar_by_name_cross_version(
+        self, mock_pgvector, mock_ai_proxy
+    ):
+        mock_cur = self._mock_cursor(
+            mock_pgvector,
+            [
+                (7, 21, "content21", 0.98, "zlib"),
+                (7, 22, "content22", 0.40, "zlib-ng"),
+            ],
+        )
+        result = await perform_similar_search_by_name(
+            "zlib", "openEuler-22.03", "openEuler-24.03", 2, 0.7
+        )
+
+        mock_ai_proxy.embedding.assert_not_called()
+        sql, params = mock_cur.execute.call_args[0]
+        self.assertIn("name=%s", sql)
+        self.assertEqual(
+            params, ("openEuler-22.03", "zlib", "openEuler-24.03", 2)
+        )
+        self.assertEqual([r.id for r in result.results], ["21"])
+
+    @patch("infra_ai_service.service.search_service.pgvector")
+    async def test_similar_by_id_without_neighbour(self, mock_pgvector):
+        self._mock_cursor(mock_pgvector, [(7, None, None, None, None)])
+        result = await perform_similar_search_by_id(7)
+        self.assertEqual(result.results, [])
+
+    @patch("infra_ai_service.service.search_service.pgvector")
+    async def test_similar_source_not_found(self, mock_pgvector):
+        self._mock_cursor(mock_pgvector, [])
+        with self.assertRaises(HTTPException) as context:
+            await perform_similar_search_by_name("nope", "openEuler-24.03")
+        self.assertEqual(context.exception.status_code, 404)
+
+
+class TestPaginatedVectorSearch(unittest.IsolatedAsyncioTestCase):
+    @patch("infra_ai_service.service.search_service.pgvector")
+    @patch("infra_ai_service.service.search_service.ai_proxy")
+    async def test_keyset_pages(self, mock_ai_proxy, mock_pgvector):
+        mock_ai_proxy.embedding.return_value = [0.1, 0.2]
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [
+            [(1, "content1", 0.05, "libc"), (2, "content2", 0.1, "glibc")],
+            [(3, "content3", 0.2, "musl")],
+        ]
+        mock_conn = mock_pgvector.pool.connection.return_value.__enter__()
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cur
+
+        test_input = SearchInput(
+            query_text="libc", os_version="ubuntu", top_n=2
+        )
+        first = await perform_vector_search(test_input)
+        self.assertEqual([r.id for r in first.results], ["1", "2"])
+        self.assertAlmostEqual(first.results[0].score, 0.95)
+        self.assertEqual(decode_cursor(first.next_cursor), (0.1, 2))
+        sql, params = mock_cur.execute.call_args[0]
+        self.assertNotIn("%(id)s", sql)
+        self.assertAlmostEqual(params["max_distance"], 0.3)
+
+        test_input.cursor = first.next_cursor
+        second = await perform_vector_search(test_input)
+        self.assertEqual([r.id for r in second.results], ["3"])
+        self.assertIsNone(second.next_cursor)
+        sql, params = mock_cur.execute.call_args[0]
+        self.assertIn("> (%(d)s, %(id)s)", sql)
+        self.assertEqual((params["d"], params["id"]), (0.1, 2))
+
+    @patch("infra_ai_service.service.search_service.ai_proxy")
+    async def test_invalid_cursor(self, mock_ai_proxy):
+        test_input = SearchInput(
+            query_text="libc", os_version="ubuntu", cursor="!!"
+        )
+        with self.assertRaises(HTTPException) as context:
+            await perform_vector_search(test_input)
+        self.assertEqual(context.exception.status_code, 400)
+        mock_ai_proxy.embedding.assert_not_called()
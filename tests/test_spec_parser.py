@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from infra_ai_service.service.extract_spec import _process_spec_file
+from infra_ai_service.service.spec_parser import _split_deps, parse_spec
+
+# what `rpmspec -P` prints for a small spec, macros already expanded
+EXPANDED_SPEC = """\
+%global pypi_name bunch
+Name:           python-bunch
+Version:        1.0.1
+Release:        3
+Summary:        A dot-accessible dictionary (a la JavaScript objects)
+License:        MIT
+URL:            http://github.com/dsc/bunch
+Source0:        https://pythonhosted.org/bunch-1.0.1.zip
+Source1:        https://pythonhosted.org/bunch-docs.tar.gz
+BuildArch:      noarch
+%description
+Bunch is a dictionary. Source0: not a tag here
+
+%package -n python3-bunch
+Summary:  A dot-accessible dictionary (a la JavaScript objects)
+Provides:       python-bunch
+BuildRequires:  python3-devel
+BuildRequires:  python3-setuptools, python3-pbr >= 2.0
+BuildRequires:  python3-pip python3-wheel
+BuildRequires:  (python3-six or python3-future)
+%description -n python3-bunch
+Bunch is a dictionary.
+
+%package help
+Summary:        A dot-accessible dictionary (a la JavaScript objects)
+Provides:       python3-bunch-doc
+%description help
+Provides: not-a-provide
+%prep
+%autosetup -n bunch-1.0.1 -p1
+%build
+%install
+%files -n python3-bunch -f filelist.lst
+%files help -f doclist.lst
+%changelog
+* Thu Sep 30 2024 bot <bot@gmail.com> - 1.0.1-3
+- DESC: fix conflict with bunch
+"""
+
+
+class TestSpecParser(unittest.TestCase):
+    def test_parse_spec(self):
+        spec = parse_spec(EXPANDED_SPEC)
+        self.assertEqual(
+            spec["binaries"],
+            ["python-bunch", "python3-bunch", "python-bunch-help"],
+        )
+        self.assertEqual(
+            spec["provides"],
+            [
+                "python-bunch",
+                "python-bunch",
+                "python3-bunch",
+                "python-bunch-help",
+                "python3-bunch-doc",
+            ],
+        )
+        self.assertEqual(
+            spec["build_requires"],
+            [
+                "(python3-six or python3-future)",
+                "python3-devel",
+                "python3-pbr >= 2.0",
+                "python3-pip",
+                "python3-setuptools",
+                "python3-wheel",
+            ],
+        )
+        self.assertEqual(
+            spec["source0"], "https://pythonhosted.org/bunch-1.0.1.zip"
+        )
+
+    def test_source_without_number(self):
+        spec = parse_spec("Name: a\nSource: a-1.tar.gz\nSource1: b.tar.gz\n")
+        self.assertEqual(spec["source0"], "a-1.tar.gz")
+
+    def test_split_deps(self):
+        self.assertEqual(
+            _split_deps("a, b >= 1.0 c,d = 2 (e if f)"),
+            ["a", "b >= 1.0", "c", "d = 2", "(e if f)"],
+        )
+
+    @patch("infra_ai_service.service.extract_spec.subprocess.run")
+    def test_process_spec_file_runs_rpmspec_once(self, mock_run):
+        mock_run.return_value = MagicMock(
+            returncode=0, stdout=EXPANDED_SPEC.encode(), stderr=b""
+        )
+        with tempfile.TemporaryDirectory() as dir_path:
+            data = {}
+            _process_spec_file(dir_path, "bunch.spec", data, 1)
+
+        mock_run.assert_called_once()
+        self.assertEqual(
+            mock_run.call_args[0][0],
+            ["rpmspec", "-P", os.path.join(dir_path, "bunch.spec")],
+        )
+        self.assertEqual(
+            data[1],
+            {
+                "name": "bunch",
+                "binaryList": [
+                    "python-bunch",
+                    "python3-bunch",
+                    "python-bunch-help",
+                ],
+                "provides": [
+                    "python-bunch",
+                    "python3-bunch",
+                    "python-bunch-help",
+                    "python3-bunch-doc",
+                ],
+                "buildRequires": [
+                    "(python3-six or python3-future)",
+                    "python3-dev",
+                    "python3-pbr",
+                    "python3-pip",
+                    "python3-setuptools",
+                    "python3-wheel",
+                ],
+                "source0": "https://pythonhosted.org/bunch-1.0.1.zip",
+            },
+        )
@@ -0,0 +1,288 @@
+import asyncio
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch
+
+import zstandard
+
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import src_scanner
+from infra_ai_service.service.extract_spec import (
+    _process_src_dir,
+    _scan_workers,
+)
+from infra_ai_service.service.sandbox import (
+    init_worker,
+    run_sandboxed,
+    stop_sandbox,
+)
+from infra_ai_service.service.src_scanner import (
+    TOP_K,
+    FeatureCounter,
+    ScanOptions,
+    scan_archive,
+    scan_dir,
+)
+
+SOURCE_FILES = {
+    "bunch-1.0.1/bunch/__init__.py": (
+        b"# maintainer: dsc@less.ly\n"
+        b'HOME = "https://github.com/dsc/bunch"\n'
+        b"class BunchDict(dict):\n"
+        b'    CONF_PATH = "/etc/bunch/bunch.conf"\n'
+        b"    MAX_SIZE = 10; MAX_SIZE += 1\n"
+    ),
+    "bunch-1.0.1/bunch/test.py": (
+        b"from bunch import BunchDict\n"
+        b'HOME = "https://github.com/dsc/bunch" # dsc@less.ly\n'
+        b"assert MAX_SIZE\n"
+    ),
+    # binary content and hidden files are never scanned
+    "bunch-1.0.1/bunch/blob.bin": b"\0BINARY_DATA FakeClassName\n",
+    "bunch-1.0.1/.github/ci.yml": b"HIDDEN_MACRO HiddenClassName\n",
+}
+
+EXPECTED = {
+    "macro_names": ["MAX_SIZE", "CONF_PATH"],
+    "email_names": ["dsc@less.ly"],
+    # the class pattern of rg matched literal braces
+    "class_names": [],
+    "path_names": ["/etc/bunch/bunch.conf"],
+    "url_names": ["https://github.com/dsc/bunch"],
+}
+
+FIXED_EXPECTED = dict(EXPECTED, class_names=["BunchDict"])
+
+
+def _tar_bytes(mode):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        for name, data in SOURCE_FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class TestSrcScanner(unittest.TestCase):
+    def test_scan_archive_formats(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archives = {
+                "bunch.tar.gz": _tar_bytes("w:gz"),
+                "bunch.tar.bz2": _tar_bytes("w:bz2"),
+                "bunch.tar.xz": _tar_bytes("w:xz"),
+                "bunch.tar.zst": zstandard.ZstdCompressor().compress(
+                    _tar_bytes("w")
+                ),
+            }
+            for name, content in archives.items():
+                with open(os.path.join(tmp_dir, name), "wb") as f:
+                    f.write(content)
+
+            zip_path = os.path.join(tmp_dir, "bunch.zip")
+            with zipfile.ZipFile(zip_path, "w") as archive:
+                for name, data in SOURCE_FILES.items():
+                    archive.writestr(name, data)
+            archives["bunch.zip"] = b""
+
+            for name in archives:
+                res = scan_archive(os.path.join(tmp_dir, name))
+                self.assertEqual(res, EXPECTED, name)
+
+            options = ScanOptions(
+                exclude=("*/test.py",), byte_budget=1, patterns="fixed"
+            )
+            res = scan_archive(os.path.join(tmp_dir, "bunch.zip"), 10, options)
+            self.assertEqual(res["class_names"], ["BunchDict"])
+            self.assertEqual(res["path_names"], ["/etc/bunch/bunch.conf"])
+            self.assertTrue(res["scan_truncated"])
+
+    def test_feed_stream_across_chunks(self):
+        counter = FeatureCounter("fixed")
+        data = b"BunchDict\n" * 10 + b"LAST_MACRO"
+        with patch("infra_ai_service.service.src_scanner.READ_CHUNK", 7):
+            counter.feed_stream(io.BytesIO(data))
+        res = counter.top()
+        self.assertEqual(counter.counters["class_names"][b"BunchDict"], 10)
+        self.assertEqual(res["macro_names"], ["LAST_MACRO"])
+
+    def test_top_ties_ordered_like_sort_nr(self):
+        counter = FeatureCounter()
+        counter.feed(b"AAA_X BBB_X CCC_X CCC_X\n")
+        self.assertEqual(counter.top(2)["macro_names"], ["CCC_X", "BBB_X"])
+
+
+class TestScanDir(unittest.TestCase):
+    def _write_corpus(self, src_path, files):
+        for name, data in files.items():
+            path = os.path.join(src_path, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def test_golden_corpus(self):
+        # expected values are what the rg pipelines produced for it
+        with tempfile.TemporaryDirectory() as src_path:
+            self._write_corpus(src_path, SOURCE_FILES)
+            os.symlink(
+                os.path.join(src_path, "bunch-1.0.1/bunch/test.py"),
+                os.path.join(src_path, "link.py"),
+            )
+            self.assertEqual(scan_dir(src_path), EXPECTED)
+
+            data = {}
+            _process_src_dir(src_path, data, 1)
+            self.assertEqual(data, {1: EXPECTED})
+
+            with patch.object(settings, "SRC_SCAN_PATTERNS", "fixed"):
+                data = {}
+                _process_src_dir(src_path, data, 1)
+            self.assertEqual(data, {1: FIXED_EXPECTED})
+
+    def test_rg_quirks(self):
+        files = {
+            "src/urls.py": (
+                b'URLS = ["https://a.org/x", "https://b.org/y"]\n'
+                b'HOME = "https://c.org/a b"\n'
+                b"mail: dsc@less.ly.Net\n"
+            )
+        }
+        with tempfile.TemporaryDirectory() as src_path:
+            self._write_corpus(src_path, files)
+            res = scan_dir(src_path)
+            fixed = scan_dir(src_path, options=ScanOptions(patterns="fixed"))
+        # the match runs to the last quote, the name was cut from it and
+        # the one with a space got lost
+        self.assertEqual(res["url_names"], ["https://a.org/x"])
+        self.assertEqual(res["email_names"], ["dsc@less.ly"])
+        self.assertEqual(
+            fixed["url_names"],
+            ["https://c.org/a b", "https://b.org/y", "https://a.org/x"],
+        )
+
+    def test_top_ten_cut(self):
+        files = {
+            f"src/m{i}.c": f"MACRO_{chr(65 + i)}\n".encode() * (i + 1)
+            for i in range(12)
+        }
+        with tempfile.TemporaryDirectory() as src_path:
+            self._write_corpus(src_path, files)
+            res = scan_dir(src_path)
+        self.assertEqual(
+            res["macro_names"],
+            [f"MACRO_{chr(65 + i)}" for i in range(11, 1, -1)],
+        )
+        self.assertEqual(res["url_names"], [])
+
+    def test_parallel_scan_matches_serial(self):
+        with tempfile.TemporaryDirectory() as src_path:
+            self._write_corpus(src_path, SOURCE_FILES)
+            with patch(
+                "infra_ai_service.service.src_scanner.SCAN_BATCH_FILES", 1
+            ):
+                self.assertEqual(scan_dir(src_path, workers=2), EXPECTED)
+
+    def test_per_file_byte_budget(self):
+        files = {"src/a.c": b"HEAD_MACRO\n" + b"x" * 100 + b"\nTAIL_MACRO\n"}
+        with tempfile.TemporaryDirectory() as src_path:
+            self._write_corpus(src_path, files)
+            res = scan_dir(src_path, options=ScanOptions(file_max_bytes=50))
+            self.assertEqual(res["macro_names"], ["HEAD_MACRO"])
+            res = scan_dir(src_path)
+            self.assertEqual(res["macro_names"], ["TAIL_MACRO", "HEAD_MACRO"])
+
+    def test_filters(self):
+        files = {
+            "pkg/src/main.c": b"MAIN_MACRO\n",
+            "pkg/vendor/lib/dep.c": b"VENDOR_MACRO\n",
+            "pkg/web/app.min.js": b"MINI_MACRO\n",
+            "pkg/docs/logo.png": b"PNG_MACRO\n",
+            "pkg/src/huge.c": b"HUGE_MACRO\n" + b"x" * 200,
+        }
+        options = ScanOptions(
+            exclude=("*/vendor/*", "*.min.js"), max_file_size=100
+        )
+        with tempfile.TemporaryDirectory() as src_path:
+            self._write_corpus(src_path, files)
+            res = scan_dir(src_path, options=options)
+            self.assertEqual(res["macro_names"], ["MAIN_MACRO"])
+
+            res = scan_dir(src_path, options=ScanOptions(include=("*.c",)))
+            self.assertEqual(
+                res["macro_names"],
+                ["VENDOR_MACRO", "MAIN_MACRO", "HUGE_MACRO"],
+            )
+
+    def test_budgets_truncate(self):
+        files = {
+            f"src/m{i}.c": f"MACRO_{chr(65 + i)}\n".encode() for i in range(4)
+        }
+        with tempfile.TemporaryDirectory() as src_path:
+            self._write_corpus(src_path, files)
+            res = scan_dir(src_path, options=ScanOptions(byte_budget=16))
+            self.assertEqual(res["macro_names"], ["MACRO_B", "MACRO_A"])
+            self.assertTrue(res["scan_truncated"])
+
+            res = scan_dir(src_path, options=ScanOptions(time_budget=1e-9))
+            self.assertEqual(res["macro_names"], [])
+            self.assertTrue(res["scan_truncated"])
+
+            self.assertNotIn("scan_truncated", scan_dir(src_path))
+
+    def test_broken_pool_replaced(self):
+        with tempfile.TemporaryDirectory() as src_path, patch.object(
+            src_scanner, "SCAN_BATCH_FILES", 1
+        ), patch.object(src_scanner, "_SCAN_POOL", None):
+            self._write_corpus(src_path, SOURCE_FILES)
+            # a worker killed while the pool is idle
+            pool = src_scanner._scan_pool(2)
+            with self.assertRaises(BrokenProcessPool):
+                pool.submit(os._exit, 1).result()
+            self.assertEqual(scan_dir(src_path, workers=2), EXPECTED)
+
+            # a worker dying in the scan fails that scan only
+            feed_file = FeatureCounter.feed_file
+            with patch.object(src_scanner, "_SCAN_POOL", None), patch.object(
+                FeatureCounter,
+                "feed_file",
+                lambda self, path, max_bytes=0: os._exit(1),
+            ):
+                with self.assertRaises(Exception) as context:
+                    scan_dir(src_path, workers=2)
+                self.assertIn("scan worker died", str(context.exception))
+            self.assertIs(FeatureCounter.feed_file, feed_file)
+            self.assertEqual(scan_dir(src_path, workers=2), EXPECTED)
+            src_scanner._SCAN_POOL.shutdown()
+
+    def test_scan_workers_share_the_cpus(self):
+        # the workers are forked, they see the patch
+        with patch("os.cpu_count", return_value=8):
+            self.assertEqual(_scan_workers(), 8)
+            with ProcessPoolExecutor(
+                max_workers=1, initializer=init_worker, initargs=(0, 3)
+            ) as pool:
+                self.assertEqual(pool.submit(_scan_workers).result(), 2)
+        with patch.object(settings, "SRC_SCAN_WORKERS", 3):
+            self.assertEqual(_scan_workers(), 3)
+
+    def test_parallel_scan_in_sandbox(self):
+        with tempfile.TemporaryDirectory() as src_path, patch.object(
+            src_scanner, "SCAN_BATCH_FILES", 1
+        ), patch.multiple(settings, SANDBOX_WORKERS=1):
+            self._write_corpus(src_path, SOURCE_FILES)
+            try:
+                res = asyncio.run(run_sandboxed(scan_dir, src_path, TOP_K, 2))
+            finally:
+                stop_sandbox()
+        self.assertEqual(res, EXPECTED)
+
+    def test_src_dir_missing(self):
+        with self.assertRaises(Exception) as context:
+            _process_src_dir("/not/exist/src", {}, 1)
+        self.assertIn("src dir not exist", str(context.exception))
@@ -0,0 +1,170 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from httpx import AsyncClient
+
+import infra_ai_service.service.extract_spec as es
+from infra_ai_service.config.config import settings
+from infra_ai_service.core.app import get_app
+from infra_ai_service.service import xml_registry
+from infra_ai_service.service.extract_xml import XmlIndex
+from tests.test_extract_xml import _primary
+
+app = get_app()
+
+
+class TestXmlRegistry(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(xml_registry._ENTRIES, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_merge_per_os_version(self):
+        for os_version, url in (("openEuler-22.03", "u1"), ("24.03", "u2")):
+            xml_registry.register(
+                XmlIndex.from_features(
+                    [{"name": "bunch", "url": url, "requires": []}],
+                    os_version,
+                )
+            )
+        for os_version, url in (("openEuler-22.03", "u1"), ("24.03", "u2")):
+            feature = es.merge_xml_features({1: {"name": "bunch"}}, os_version)
+            self.assertEqual(feature[1]["url"], url)
+
+        with self.assertRaises(Exception) as context:
+            es.merge_xml_features({1: {"name": "bunch"}}, "other")
+        self.assertIn("not configured", str(context.exception))
+
+    def test_memory_accounting(self):
+        small = xml_registry.register(
+            XmlIndex.from_features([{"name": "bunch"}], "small")
+        )
+        large = xml_registry.register(
+            XmlIndex.from_features(
+                (
+                    {"name": f"pkg{i}", "requires": [f"lib{i}", "python3"]}
+                    for i in range(1000)
+                ),
+                "large",
+            )
+        )
+        self.assertGreater(large.memory_bytes, small.memory_bytes * 100)
+        self.assertEqual(
+            xml_registry.total_memory_bytes(),
+            small.memory_bytes + large.memory_bytes,
+        )
+
+        self.assertTrue(xml_registry.evict("large"))
+        self.assertFalse(xml_registry.evict("large"))
+        self.assertEqual(xml_registry.total_memory_bytes(), small.memory_bytes)
+
+
+class TestXmlApi(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = os.path.realpath(tmp_dir.name)
+        self.xml_paths = {
+            "openEuler-22.03": self._write("22.03-primary.xml", 5),
+            "openEuler-24.03": self._write("24.03-primary.xml", 8),
+        }
+
+        patchers = [
+            patch.dict(xml_registry._ENTRIES, clear=True),
+            patch.multiple(
+                settings,
+                LOCAL_SOURCE_ROOTS=self.tmp_dir,
+                XML_SNAPSHOT_DIR="",
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _write(self, name, count):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "wb") as f:
+            f.write(_primary(count))
+        return path
+
+    async def _list(self, ac):
+        resp = await ac.get("/api/v1/feature-insert/xml/")
+        return resp.json()
+
+    async def test_config_refresh_evict(self):
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            for os_version, path in self.xml_paths.items():
+                resp = await ac.post(
+                    "/api/v1/feature-insert/xml/",
+                    json={"xml_url": path, "os_version": os_version},
+                )
+                self.assertEqual(resp.json(), {"status": "success"})
+
+            listed = await self._list(ac)
+            self.assertEqual(
+                [(x["os_version"], x["packages"]) for x in listed["xml"]],
+                [("openEuler-22.03", 5), ("openEuler-24.03", 8)],
+            )
+            self.assertEqual(
+                listed["memory_bytes"],
+                sum(x["memory_bytes"] for x in listed["xml"]),
+            )
+            self.assertEqual(listed["xml"][0]["storage"], "memory")
+
+            # configured already, the other release is not replaced
+            resp = await ac.post(
+                "/api/v1/feature-insert/xml/",
+                json={
+                    "xml_url": self.xml_paths["openEuler-22.03"],
+                    "os_version": "openEuler-24.03",
+                },
+            )
+            self.assertIn("force_refresh", resp.json()["message"])
+
+            self._write("24.03-primary.xml", 9)
+            resp = await ac.post(
+                "/api/v1/feature-insert/xml/refresh",
+                json={"os_version": "openEuler-24.03"},
+            )
+            self.assertEqual(resp.json()["xml"]["packages"], 9)
+
+            resp = await ac.delete(
+                "/api/v1/feature-insert/xml/openEuler-22.03"
+            )
+            self.assertEqual(resp.json(), {"status": "success"})
+            listed = await self._list(ac)
+            self.assertEqual(
+                [(x["os_version"], x["packages"]) for x in listed["xml"]],
+                [("openEuler-24.03", 9)],
+            )
+
+            resp = await ac.delete(
+                "/api/v1/feature-insert/xml/openEuler-22.03"
+            )
+            self.assertIn("not configured", resp.json()["message"])
+            resp = await ac.post(
+                "/api/v1/feature-insert/xml/refresh",
+                json={"os_version": "openEuler-22.03"},
+            )
+            self.assertIn("not configured", resp.json()["message"])
+
+    async def test_evict_removes_snapshot(self):
+        with patch.object(settings, "XML_SNAPSHOT_DIR", self.tmp_dir):
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                for os_version, path in self.xml_paths.items():
+                    await ac.post(
+                        "/api/v1/feature-insert/xml/",
+                        json={"xml_url": path, "os_version": os_version},
+                    )
+                await ac.delete("/api/v1/feature-insert/xml/openEuler-22.03")
+
+            xml_registry._ENTRIES.clear()
+            xml_registry.load_snapshots()
+            listed = xml_registry.list_entries()
+        self.assertEqual(
+            [(x["os_version"], x["storage"]) for x in listed],
+            [("openEuler-24.03", "snapshot")],
+        )
+        self.assertGreater(listed[0]["disk_bytes"], 0)
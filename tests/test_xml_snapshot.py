@@ -0,0 +1,168 @@
+import functools
+import io
+import os
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from unittest.mock import patch
+
+import zstandard
+
+import infra_ai_service.service.extract_spec as es
+from infra_ai_service.config.config import settings
+from infra_ai_service.service import xml_registry, xml_snapshot
+from infra_ai_service.service.extract_xml import extract_xml_features
+from infra_ai_service.service.xml_snapshot import SnapshotIndex
+from tests.test_extract_xml import _primary, _QuietHandler
+
+
+class TestXmlSnapshot(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        serve_dir = tempfile.TemporaryDirectory()
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(serve_dir.cleanup)
+        self.addCleanup(snapshot_dir.cleanup)
+        self.serve_dir = os.path.realpath(serve_dir.name)
+        self.snapshot_dir = snapshot_dir.name
+
+        handler = functools.partial(_QuietHandler, directory=self.serve_dir)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f"http://127.0.0.1:{server.server_port}"
+
+        self.data = _primary(20, files_per_package=3)
+        self.expected = {
+            data["name"]: data
+            for data in extract_xml_features(io.BytesIO(self.data)).values()
+        }
+        self.xml_path = os.path.join(self.serve_dir, "primary.xml.zst")
+        with open(self.xml_path, "wb") as f:
+            f.write(zstandard.ZstdCompressor().compress(self.data))
+
+        self.parsed = []
+        read_xml_info = es.read_xml_info
+        patchers = [
+            patch.multiple(
+                settings,
+                LOCAL_SOURCE_ROOTS=self.serve_dir,
+                DOWNLOAD_CACHE_DIR="",
+                XML_SNAPSHOT_DIR=self.snapshot_dir,
+            ),
+            patch.object(
+                es,
+                "read_xml_info",
+                side_effect=lambda *args: self.parsed.append(args[0])
+                or read_xml_info(*args),
+            ),
+            patch.dict(xml_registry._ENTRIES, clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _check(self, xml_info):
+        self.assertEqual(xml_info.os_version, "openEuler-24.03")
+        self.assertEqual(
+            {name: xml_info.copy_record(name) for name in xml_info},
+            self.expected,
+        )
+
+    async def _config(self, xml_url):
+        xml_info = await es.check_xml_info(xml_url, "openEuler-24.03")
+        self._check(xml_info)
+        return xml_info
+
+    async def test_local_source(self):
+        await self._config(self.xml_path)
+        xml_info = await self._config(self.xml_path)
+        self.assertIsInstance(xml_info, SnapshotIndex)
+        self.assertEqual(self.parsed, [self.xml_path])
+        self.assertEqual(
+            xml_info.source["size"], os.path.getsize(self.xml_path)
+        )
+        self.assertEqual(xml_info["pkg1"]["requires"], ("python3", "libpkg1"))
+
+        # a touched file is parsed again
+        st = os.stat(self.xml_path)
+        os.utime(self.xml_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        await self._config(self.xml_path)
+        self.assertEqual(len(self.parsed), 2)
+
+    async def test_remote_source(self):
+        xml_url = f"{self.base_url}/primary.xml.zst"
+        await self._config(xml_url)
+        xml_info = await self._config(xml_url)
+        self.assertIsInstance(xml_info, SnapshotIndex)
+        self.assertEqual(self.parsed, [xml_url])
+        self.assertTrue(xml_info.source["last_modified"])
+
+        # the same snapshot is not reused for another url
+        await self._config(self.xml_path)
+        self.assertEqual(len(self.parsed), 2)
+
+    async def test_warm_start(self):
+        await self._config(self.xml_path)
+        xml_registry.load_snapshots()
+        xml_info = xml_registry.get("openEuler-24.03")
+        self.assertIsInstance(xml_info, SnapshotIndex)
+        self._check(xml_info)
+        self.assertEqual(
+            xml_registry.get_entry("openEuler-24.03").xml_url, self.xml_path
+        )
+        self.assertEqual(
+            es.merge_xml_features(
+                {1: {"name": "pkg2", "requires": ["gcc"]}}, "openEuler-24.03"
+            ),
+            {
+                1: dict(
+                    self.expected["pkg2"],
+                    requires=["gcc", "python3", "libpkg2"],
+                )
+            },
+        )
+
+    async def test_unusable_snapshot_rebuilt(self):
+        await self._config(self.xml_path)
+        with open(xml_snapshot.snapshot_path("openEuler-24.03"), "wb") as f:
+            f.write(b"not a snapshot")
+        xml_registry.load_snapshots()
+        self.assertIsNone(xml_registry.get_entry("openEuler-24.03"))
+
+        xml_info = await self._config(self.xml_path)
+        self.assertEqual(len(self.parsed), 2)
+        self.assertIsInstance(await self._config(self.xml_path), SnapshotIndex)
+        self.assertEqual(len(xml_info), len(self.expected))
+
+    async def test_connection_closed_when_replaced(self):
+        await self._config(self.xml_path)
+        xml_registry.load_snapshots()
+        first = xml_registry.get("openEuler-24.03")
+        # the threads of the merges share the connection
+        threads = [
+            threading.Thread(target=lambda: len(first)) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        conn = first._conn
+
+        second = await self._config(self.xml_path)
+        xml_registry.register(second, self.xml_path)
+        with self.assertRaises(Exception):
+            conn.execute("SELECT 1")
+        # a request still holding the replaced index can finish
+        self.assertEqual(len(first), len(self.expected))
+        first.close()
+
+        xml_registry.evict("openEuler-24.03")
+        self.assertIsNone(second._conn)
+
+    def test_snapshot_path(self):
+        path = xml_snapshot.snapshot_path("openEuler-24.03")
+        self.assertEqual(os.path.basename(path), "openEuler-24.03.sqlite")
+        path = xml_snapshot.snapshot_path("../other os")
+        self.assertEqual(os.path.dirname(path), self.snapshot_dir)